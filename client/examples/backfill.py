@@ -0,0 +1,57 @@
+import sys
+sys.path.append('../src')
+
+import argparse
+import glob
+import json
+import logging
+from datetime import datetime, timezone
+from ptprobe import backfill, sinks
+
+if __name__ == "__main__":
+    format = "%(asctime)s: %(message)s"
+    logging.basicConfig(format=format, level=logging.INFO, datefmt="%H:%M:%S")
+
+    parser = argparse.ArgumentParser(description='Backfill a database from CSV or archive recordings')
+    parser.add_argument('sink', choices=['sqlite', 'influxdb'], help='Destination type')
+    parser.add_argument('target', help='SQLite file, or JSON file for InfluxDB config (token, org, bucket, optional url)')
+    parser.add_argument('files', nargs='+', help='Recordings or glob patterns')
+    parser.add_argument('-t', '--table', default='backfill_data',
+            help='SQLite table name, as <com>_<date>. Default is backfill_data')
+    parser.add_argument('-b', '--board-id', type=int, default=None,
+            help='Board ID stored with InfluxDB points')
+    parser.add_argument('-s', '--start', default=None,
+            help='UTC time of the first sample (ISO 8601). Default is the file modification time less the recording span')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+            help='Number of worker processes. Default is the CPU count')
+    parser.add_argument('-c', '--checkpoints', default='.backfill',
+            help='Checkpoint directory. Default is .backfill')
+    args = parser.parse_args()
+
+    files = []
+    for pattern in args.files:
+        files.extend(sorted(glob.glob(pattern)) or [pattern])
+
+    sink_args, sink_kwargs, write_args = (), {}, ()
+    if args.sink == 'sqlite':
+        sink_args = (args.target,)
+        com, _, date = args.table.rpartition('_')
+        write_args = (com, date)
+    else:
+        with open(args.target) as jf:
+            cfg = json.load(jf)
+        sink_kwargs = {k: cfg[k] for k in ('token', 'org', 'bucket')}
+        sink_kwargs['url'] = cfg.get('url', sinks.INFLUXDB_URL)
+
+    utc_start = None
+    if args.start is not None:
+        start = datetime.fromisoformat(args.start)
+        if start.tzinfo is None:
+            start = start.replace(tzinfo=timezone.utc)
+        utc_start = start.timestamp()
+
+    logging.info("Backfilling {} files to {}".format(len(files), args.sink))
+    counts = backfill.backfill(files, args.sink, sink_args, sink_kwargs, write_args,
+            checkpoint_dir=args.checkpoints, board_id=args.board_id, utc_start=utc_start,
+            processes=args.processes)
+    logging.info("Done: {} samples".format(sum(counts.values())))
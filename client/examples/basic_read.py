@@ -1,8 +1,8 @@
 import sys
-sys.path.append('../src/ptprobe')
+sys.path.append('../src')
 
 import argparse
-import board
+from ptprobe import board
 
 if __name__ == "__main__":
     
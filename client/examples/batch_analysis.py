@@ -0,0 +1,31 @@
+import sys
+sys.path.append('../src')
+
+import argparse
+import glob
+import logging
+from ptprobe import analysis
+
+if __name__ == "__main__":
+    format = "%(asctime)s: %(message)s"
+    logging.basicConfig(format=format, level=logging.INFO, datefmt="%H:%M:%S")
+
+    parser = argparse.ArgumentParser(description='Summarize CSV recordings (statistics, fault counts, Welch PSDs) in parallel')
+    parser.add_argument('files', nargs='+', help='CSV recordings or glob patterns')
+    parser.add_argument('-o', '--output', default='summary.csv',
+            help='Summary table. The PSDs are saved to <output>.psd.npz. Default is summary.csv')
+    parser.add_argument('-n', '--nperseg', type=int, default=1024,
+            help='Welch segment length (samples). Default is 1024')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+            help='Number of worker processes. Default is the CPU count')
+    parser.add_argument('-c', '--cache', default='.analysis-cache',
+            help='Cache directory for per-file results, "" to disable. Default is .analysis-cache')
+    args = parser.parse_args()
+
+    files = []
+    for pattern in args.files:
+        files.extend(sorted(glob.glob(pattern)) or [pattern])
+    logging.info("Analysing {} files".format(len(files)))
+    analysis.analyse_files(files, args.output, nperseg=args.nperseg, processes=args.processes,
+            cache_dir=args.cache or None)
+    logging.info("Summary written to {}".format(args.output))
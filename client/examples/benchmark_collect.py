@@ -0,0 +1,98 @@
+import sys
+sys.path.append('../src')
+
+import argparse
+import gc
+import logging
+import time
+import tracemalloc
+from ptprobe import board
+from ptprobe.simulator import SimulatedBoard
+from ptprobe.sinks import SampleSink
+
+class ReplayPort:
+    """Serve a recorded byte stream through the serial port interface"""
+
+    def __init__(self, data, chunk):
+        self.data = memoryview(data)
+        self.pos = 0
+        self.chunk = chunk
+        self.port = 'replay'
+        self.timeout = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    @property
+    def in_waiting(self):
+        return min(self.chunk, len(self.data) - self.pos)
+
+    def readinto(self, b):
+        n = min(len(b), len(self.data) - self.pos)
+        b[:n] = self.data[self.pos:self.pos+n]
+        self.pos += n
+        return n
+
+    def write(self, msg):
+        return len(msg)
+
+class NullSink(SampleSink):
+    """Discard the samples"""
+
+    def write(self, sample, *args):
+        pass
+
+def record_stream(nframes, compact):
+    sim = SimulatedBoard()
+    if compact:
+        sim.format = board.Controller.FrameFlags.COMPACT | board.Controller.FrameFlags.DELTA_TS
+    frames = []
+    for i in range(nframes):
+        if compact:
+            absolute = i % sim.ABS_TIMESTAMP_EVERY == 0
+            frames.append(sim.compact_frame(10*i, None if absolute else 10*(i-1)))
+        else:
+            frames.append(sim.full_frame(10*i))
+    frames.append(bytes([board.Controller.PacketType.HALT << 6]) + nframes.to_bytes(4, 'big'))
+    return b''.join(frames)
+
+def run(data, nframes, chunk, reuse_records):
+    pt = board.Controller('replay', sinks=[NullSink()])
+    pt.comm = ReplayPort(data, chunk)
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    t0 = time.perf_counter()
+    pt.collect_samples(reuse_records=reuse_records)
+    dt = time.perf_counter() - t0
+    gc.collect()
+    blocks = sys.getallocatedblocks() - blocks
+
+    # peak memory of the loop, in a second (slower) run
+    pt.comm = ReplayPort(data, chunk)
+    tracemalloc.start()
+    pt.collect_samples(reuse_records=reuse_records)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return (dt, blocks, peak)
+
+if __name__ == "__main__":
+    format = "%(asctime)s: %(message)s"
+    logging.basicConfig(format=format, level=logging.INFO, datefmt="%H:%M:%S")
+
+    parser = argparse.ArgumentParser(description='Benchmark the sample decoding loop on a recorded stream')
+    parser.add_argument('-n', '--frames', type=int, default=100000,
+            help='Number of frames. Default is 100000')
+    parser.add_argument('-c', '--chunk', type=int, default=1024,
+            help='Bytes available per read, as buffered by the serial driver. Default is 1024')
+    parser.add_argument('--compact', action='store_true', help='Use compact frames')
+    args = parser.parse_args()
+
+    data = record_stream(args.frames, args.compact)
+    logging.info("Stream of {} frames, {} bytes".format(args.frames, len(data)))
+    for reuse in (False, True):
+        dt, blocks, peak = run(data, args.frames, args.chunk, reuse)
+        print("reuse_records={}: {:.2f} us/frame, {} blocks retained, "
+                "peak traced memory {} bytes".format(reuse, dt/args.frames*1e6, blocks, peak))
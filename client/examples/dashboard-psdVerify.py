@@ -16,6 +16,8 @@ from dash.dependencies import Output, Input
 
 import os
 import sys
+sys.path.append('../src')
+from ptprobe import filters, recording
 
 def info(title):
     print(title)
@@ -38,10 +40,8 @@ def dictparser(item):
 # if platform.system() == 'Windows':
 #     multiprocessing.set_start_method('spawn')
 
-testCSV1 = np.loadtxt("Balance150-c_o_m_2_7-2024-07-08_18h-48m-49s_323714.csv",delimiter=",",dtype=float, usecols=(0,1,2,3,4))
-testCSV2 = np.loadtxt("Balance150-c_o_m_5_8-2024-07-08_18h-48m-49s_324096.csv",delimiter=",",dtype=float, usecols=(0,1,2,3,4))
-# test = np.loadtxt("test.csv", delimiter=",", dtype=str)
-# print(test[:,1])
+# the accelerometer recording whose PSD is verified
+verifyCSV = "Balance150-c_o_m_2_7-2024-07-08_18h-48m-49s_323714.csv"
 
 
 
@@ -137,8 +137,7 @@ def update_intervals(interval):
     # if args.accelPorts:
     #     for item in args.accelPorts:
             # accel_sensor_data[item] = dictparser(accelQueueList[item].get())[item]
-    # accel_sensor_data = testCSV1
-    numpyAccelData = testCSV1
+    numpyAccelData = np.column_stack(list(recording.load_csv(verifyCSV, columns=(0,1,2,3,4), cache=True).values()))
     # xfft = fft.fft(numpyAccelData[:,1])
     # xfreq = fft.fftfreq(numpyAccelData[:,1].shape[-1])
 
@@ -156,18 +155,14 @@ def update_intervals(interval):
     overlap = 0.5 #default behaviour, not entered
     print(samplingFreq)
 
-    #Filter
+    #Filter (zero-phase batch mode for archived data, all axes in one pass)
     cutoff_freq = 30
     order = 3
-    nyq = 0.5*samplingFreq
-    normal_cutoff = cutoff_freq/nyq
-    b, a = signal.butter(order,normal_cutoff,btype='highpass')
-
-    filteredSample = testCSV1
+    filteredSample = filters.zero_phase(numpyAccelData[162271:518310,2:5], samplingFreq, cutoff_freq, order, axis=0)
 
 
     for dimension in range(3):
-        dim_spdf, dim_spd = signal.welch(signal.filtfilt(b,a,numpyAccelData[162271:518310,dimension+2]), samplingFreq, window="boxcar", nperseg=psdSamples)
+        dim_spdf, dim_spd = signal.welch(filteredSample[:,dimension], samplingFreq, window="boxcar", nperseg=psdSamples)
 
         dim_spdfFigure = go.Figure(
             data = [go.Scatter(x=dim_spdf, y=dim_spd), ],
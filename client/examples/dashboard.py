@@ -16,6 +16,8 @@ from dash.dependencies import Output, Input
 
 import os
 import sys
+sys.path.append('../src')
+from ptprobe import filters
 
 def info(title):
     print(title)
@@ -50,6 +52,8 @@ sensor_data_columns = [ "Time",
 
 sensor_data = {}
 accel_sensor_data = {}
+accel_filters = {}
+accel_blocks = {}
 
 
 
@@ -129,7 +133,8 @@ def update_intervals(interval):
 
     if args.accelPorts:
         for item in args.accelPorts:
-            accel_sensor_data[item] = dictparser(accelQueueList[item].get())[item]
+            block = accelQueueList[item].get()
+            accel_sensor_data[item] = dictparser(block)[item]
             numpyAccelData = np.array(accel_sensor_data[item])
 
             # xfft = fft.fft(numpyAccelData[:,1])
@@ -145,9 +150,20 @@ def update_intervals(interval):
             
             samplingFreq = uSecondsToSeconds/np.average(numpyAccelData[:,0])
 
+            # causal high-pass with state carried between refreshes; the
+            # design is cached, only the new chunk is filtered. The sink only
+            # queues a block while the queue is short, so the state is reset
+            # when the block does not follow the one filtered last.
+            if item not in accel_filters:
+                accel_filters[item] = filters.StreamingFilter(samplingFreq, 30, 3, axis=0)
+            elif block[2] != accel_blocks[item] + 1:
+                accel_filters[item].reset()
+            accel_blocks[item] = block[2]
+            filteredAccelData = accel_filters[item].process(numpyAccelData[:,1:4])
+
             for dimension in range(3):
                 #TODO: check if should be dimension+2?
-                dim_spdf, dim_spd = signal.periodogram(numpyAccelData[:,dimension+1], samplingFreq)
+                dim_spdf, dim_spd = signal.periodogram(filteredAccelData[:,dimension], samplingFreq)
 
                 dim_spdfFigure = go.Figure(
                     data = [go.Scatter(x=dim_spdf, y=dim_spd), ],
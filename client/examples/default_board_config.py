@@ -1,8 +1,8 @@
 import sys
-sys.path.append('../src/ptprobe')
+sys.path.append('../src')
 
 import argparse
-import board
+from ptprobe import board
 import random
 import time
 
@@ -26,13 +26,14 @@ if __name__ == "__main__":
         pt.set_P_poly_coeffs(ich, ai_coeffs) #[1+3*ich,2+3*ich,3+3*ich])
     pt.set_debug_level(0)
 
+    # the writes above invalidated the cached metadata, so this reads back
+    info = pt.board_info()
     print("Board configuration updated")
-    print("  + board ID: {}".format(pt.board_id()))
+    print("  + board ID: {}".format(info['board_id']))
     print("  + debug level: 0 (off)")
     print("  + pressure transducer coefficients")
     for ich in range(4):
-        status = pt.sensor_status_P(ich)
-        print("    + ch{}: {}".format(ich, status['ai']))
+        print("    + ch{}: {}".format(ich, info['P'][ich]['ai']))
     choice = input("Store configuration (y/N)? ")
 
     if choice == 'y' or choice == 'Y':
@@ -0,0 +1,25 @@
+import sys
+sys.path.append('../src')
+
+import argparse
+import logging
+from ptprobe import discovery
+
+if __name__ == "__main__":
+    format = "%(asctime)s: %(message)s"
+    logging.basicConfig(format=format, level=logging.INFO, datefmt="%H:%M:%S")
+
+    parser = argparse.ArgumentParser(description='Find connected PTProbe boards')
+    parser.add_argument('-p', '--ports', nargs='+',
+            help='Serial port name(s) to probe. Default is all USB serial ports.')
+    parser.add_argument('-t', '--timeout', type=float, default=0.5,
+            help='Probe timeout per port (s). Default is 0.5s')
+    parser.add_argument('-r', '--refresh', action='store_true',
+            help='Probe all ports, ignoring the cached port map')
+    args = parser.parse_args()
+
+    boards = discovery.discover(ports=args.ports, timeout=args.timeout, refresh=args.refresh)
+
+    print("Found {} board(s)".format(len(boards)))
+    for board_id in sorted(boards):
+        print("  + {}: {}".format(board_id, boards[board_id]))
@@ -0,0 +1,71 @@
+import sys
+sys.path.append('../src')
+
+import argparse
+import json
+import logging
+from ptprobe import loadtest
+
+if __name__ == "__main__":
+    format = "%(asctime)s: %(message)s"
+    logging.basicConfig(format=format, level=logging.INFO, datefmt="%H:%M:%S")
+
+    parser = argparse.ArgumentParser(description='Load test the acquisition with simulated boards on pseudo-terminals')
+    parser.add_argument('-n', '--boards', default='1,2,4,8,16,32',
+            help='Comma separated numbers of boards to sweep. Default is 1,2,4,8,16,32')
+    parser.add_argument('-r', '--rate', type=float, default=5.0,
+            help='Sample rate per board (Hz). Default is 5')
+    parser.add_argument('-d', '--duration', type=float, default=10.0,
+            help='Measured duration per run (s). Default is 10')
+    parser.add_argument('-w', '--warmup', type=float, default=2.0,
+            help='Warm-up before each measurement (s). Default is 2')
+    parser.add_argument('-p', '--processes', action='store_true',
+            help='Collect each board in its own process instead of a thread')
+    parser.add_argument('-s', '--sink', action='append', default=[],
+            help='Sink per board as name[:arg], e.g. csv:load-{board}.csv; repeat for several')
+    parser.add_argument('-i', '--interval', type=int, default=None,
+            help='Sample interval (ms) set with compact frames and pressure only')
+    parser.add_argument('--max-drop', type=float, default=1e-3,
+            help='Tolerated fraction of lost samples. Default is 0.001')
+    parser.add_argument('--max-p99', type=float, default=100.0,
+            help='Tolerated p99 latency (ms). Default is 100')
+    parser.add_argument('-o', '--output', default=None, help='Write the results to a JSON file')
+    args = parser.parse_args()
+
+    sink_specs = []
+    for spec in args.sink:
+        name, _, arg = spec.partition(':')
+        sink_specs.append((name, (arg,) if arg else ()))
+
+    frame_format = None
+    if args.interval is not None:
+        frame_format = {'compact': True, 'T_channels': (), 'interval_ms': args.interval}
+
+    counts = [int(n) for n in args.boards.split(',')]
+    runs, capacity = loadtest.sweep(counts, rate=args.rate, duration=args.duration,
+            max_drop=args.max_drop, max_p99_ms=args.max_p99, warmup=args.warmup,
+            frame_format=frame_format, sinks=sink_specs, processes=args.processes)
+
+    print("{:>4} {:>10} {:>8} {:>8} {:>8} {:>10} {:>9} {:>8} {:>6}".format(
+            "N", "min Hz", "p50 ms", "p99 ms", "p99.9 ms", "CPU ms/s", "RSS kB", "dropped", "failed"))
+    for n, result, summary in runs:
+        print("{:4d} {:10.2f} {:8.2f} {:8.2f} {:8.2f} {:10.2f} {:9d} {:8d} {:6d}".format(n,
+                summary["min_throughput"], summary["p50_ms"], summary["p99_ms"], summary["p999_ms"],
+                summary["cpu_ms_per_board_s"], summary["rss_growth_kb"], summary["dropped"],
+                summary["failed"]))
+        for b in result["failed"]:
+            print("     board {} ({}) failed: {}".format(b["board"], b["port"], b["error"]))
+    if capacity < counts[-1]:
+        print("Saturated above {} boards at {} Hz".format(capacity, args.rate))
+    else:
+        print("Not saturated at {} boards at {} Hz".format(capacity, args.rate))
+
+    if args.output is not None:
+        for n, result, summary in runs:
+            for b in result["boards"]:
+                del b["latencies"]
+        with open(args.output, "w") as jf:
+            json.dump({"rate": args.rate, "duration": args.duration, "capacity": capacity,
+                    "runs": [{"boards": n, "summary": summary, "per_board": result["boards"],
+                    "failed": result["failed"]}
+                    for n, result, summary in runs]}, jf, indent=2)
@@ -1,5 +1,5 @@
 import sys
-sys.path.append('../src/ptprobe')
+sys.path.append('../src')
 import os
 from datetime import datetime
 
@@ -7,8 +7,8 @@ import logging
 import threading
 import time
 import argparse
-import board
-from sinks import CsvSampleSink
+from ptprobe import board
+from ptprobe.sinks import CsvSampleSink
 
 boards = []
 sinks = []
@@ -1,5 +1,5 @@
 import sys
-sys.path.append("C:/Users/VFDControl/github/accelmon/client/src/")
+sys.path.append('../src')
 import os
 from datetime import datetime
 
@@ -7,9 +7,9 @@ import logging
 import threading
 import time
 import argparse
-import accelmon.board as board
+from ptprobe import accel
 import math
-from accelmon.sinks import CsvSampleSink, IntervalSignedInt16Converter, NoConversionConverter
+from ptprobe.sinks import CsvSampleSink, IntervalSignedInt16Converter, NoConversionConverter
 
 class readTo():
     def __init__(self, filename, port):
@@ -20,7 +20,7 @@ class readTo():
 
         (prefix, extension) = os.path.splitext(self.filename)  
         
-        peek = board.Controller(port=self.port)
+        peek = accel.AccelController(port=self.port)
         b_id, accel_type = peek.board_id()
         logging.info(f"Board ID: {b_id}, Accelerometer: {accel_type}")
         
@@ -28,9 +28,7 @@ class readTo():
 
         converter=NoConversionConverter()
         if accel_type == "KX134":
-            gsel = peek.accel_g_range
-            gscaling = 1./(2**(15 - (3 + gsel)))
-            converter = IntervalSignedInt16Converter(scaling=gscaling) 
+            converter = IntervalSignedInt16Converter(scaling=peek.g_scaling())
 
         port_label = self.port.split('/')[-1] 
         sink_name = ''.join(port_label)
@@ -41,7 +39,7 @@ class readTo():
         csv = CsvSampleSink(timed_named_filename, width=values_per_conversion, converter=converter)
         csv.open()
         
-        mon = board.Controller(port=self.port, sinks=[csv])
+        mon = accel.AccelController(port=self.port, sinks=[csv])
 
         logging.info("Main: creating thread")
 
@@ -1,5 +1,5 @@
 import sys
-sys.path.append('../src/ptprobe')
+sys.path.append('../src')
 import os
 from datetime import datetime
 
@@ -7,14 +7,15 @@ import logging
 import threading
 import time
 import argparse
-import board
-from sinks import CsvSampleSink
+from ptprobe import board
+from ptprobe.sinks import CsvSampleSink
+from ptprobe.tracing import ChromeTracer
 
 boards = []
 sinks = []
 threads = []
 
-def readToCSV(max_count, timeout, ports, filename):
+def readToCSV(max_count, timeout, ports, filename, tracer=None):
 
     (prefix, extension) = os.path.splitext(filename)  
 
@@ -28,7 +29,7 @@ def readToCSV(max_count, timeout, ports, filename):
 
 
     for index, item in enumerate(ports):
-        boards.append(board.Controller(port=item, sinks=[sinks[index]]))
+        boards.append(board.Controller(port=item, sinks=[sinks[index]], tracer=tracer))
         logging.info("Board IDs: {}".format(boards[index].board_id()))
 
 
@@ -71,6 +72,10 @@ def readToCSV(max_count, timeout, ports, filename):
         logging.info("Main: closing sinks")
         for sink in sinks:
             sink.close()
+
+        if tracer is not None:
+            logging.info("Main: writing trace {}".format(tracer.path))
+            tracer.save()
             
 
         logging.info("Main: done")
@@ -88,9 +93,16 @@ if __name__ == "__main__":
     parser.add_argument('-p', '--ports', default='/dev/ttyACM0',  nargs='+',
             help='Serial port name(s). Default is /dev/ttyACM0.')
     parser.add_argument('-f', '--filename', default='', help='Prefix filename for CSV file data output with extension as specified')
+    parser.add_argument('--trace', default=None,
+            help='Write a Chrome trace of the collection loop to this file (open in ui.perfetto.dev)')
+    parser.add_argument('--trace-every', type=int, default=1,
+            help='Trace one in this many samples. Default is 1')
     args = parser.parse_args()
     logging.info("Starting demo")
     logging.info(args)
 
-    readToCSV(args.max_count, args.timeout, args.ports, args.filename)
+    tracer = None
+    if args.trace is not None:
+        tracer = ChromeTracer(args.trace, sample_every=args.trace_every)
+    readToCSV(args.max_count, args.timeout, args.ports, args.filename, tracer)
 
@@ -1,12 +1,12 @@
 import sys
-sys.path.append('../src/ptprobe')
+sys.path.append('../src')
 
 import logging
 import threading
 import time
 import argparse
-import board
-from sinks import InfluxDBSampleSink
+from ptprobe import board
+from ptprobe.sinks import InfluxDBSampleSink
 import json
 
 if __name__ == "__main__":
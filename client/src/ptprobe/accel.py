@@ -0,0 +1,317 @@
+import struct
+import time
+
+from .board import Controller, BadHeader, BadPacket, BoardTimeout, FrameReader, ReadInterrupted
+
+_U16 = struct.Struct('>H')
+_U32 = struct.Struct('>I')
+
+# A block frame starts with a DATA header carrying the reserved byte count 63
+BLOCK_HEADER = (Controller.PacketType.DATA << 6) | 0x3F
+# b1-b2: readings, b3: words per reading, b4-b7: board time of the first reading (us)
+BLOCK_PREFIX = 7    # bytes after the header
+MAX_BLOCK_READINGS = 2048
+
+# accelerometer type codes in the channel bits of the ID response
+ACCEL_TYPES = {0: "ADC", 1: "KX134"}
+
+class AccelController(Controller):
+    """A controller for accelerometer boards streaming blocks of 16 bit readings
+
+    The boards share the serial protocol of the PT Probe board (requests,
+    responses, R/H, HALT) but stream blocks of readings instead of single
+    samples, so that kilohertz rates fit the serial link:
+
+    - ``AB\\n`` returns the ID response, with the accelerometer type code in
+      the channel bits (0: ADC, 1: KX134)
+    - ``AG\\n`` returns a FMT response with the KX134 range selector GSEL
+      (uint8), a reserved byte and the output data rate (uint16, Hz)
+    - a block frame is the header byte 0x7F, the number of readings (uint16),
+      the words per reading (uint8), the board time of the first reading
+      (uint32, us) and the readings as big-endian 16 bit words. A KX134
+      reading is the interval since the previous reading (uint16, us) and
+      the x, y, z accelerations (int16).
+
+    Blocks are decoded straight into NumPy arrays, without Python objects
+    per reading. The sinks receive aggregated blocks (see
+    :py:meth:`collect_samples`), which pass through a converter such as
+    :py:class:`sinks.IntervalSignedInt16Converter` to scale them to g.
+    """
+
+    def __init__(self, port, baudrate=115200, sinks=None, **kwargs):
+        """Construct a controller (see :py:class:`board.Controller`)"""
+        super().__init__(port, baudrate=baudrate, sinks=sinks, **kwargs)
+        self.accel_type = None
+        self.accel_g_range = None
+        self.accel_rate_hz = None
+
+    def board_id(self):
+        """Get the ID and the accelerometer type of the connected board
+
+        For a KX134 board, the range setting is read as well
+        (:py:attr:`accel_g_range`, :py:attr:`accel_rate_hz`).
+
+        :returns: a tuple (integer board ID, accelerometer type name)
+        """
+        hdr, body = self._transact(bytes('AB\n','utf-8'), None, self.ResponseType.ID)
+        board_id = 0 if hdr[0] & 0x01 else struct.unpack('>I',body)[0]
+        self.accel_type = ACCEL_TYPES.get((hdr[0] & 0x06) >> 1, "unknown")
+        if self.accel_type == "KX134":
+            self.g_range()
+        return (board_id, self.accel_type)
+
+    def g_range(self):
+        """Get the range selector of the KX134 accelerometer
+
+        The full scale is +/- 2**(3 + GSEL) g (8, 16, 32 or 64 g), so a
+        reading scales to g by 1/2**(15 - (3 + GSEL)).
+
+        :returns: the range selector GSEL (0-3)
+        """
+        hdr, body = self._transact(bytes('AG\n','utf-8'), None, self.ResponseType.FMT)
+        self.accel_g_range = body[0]
+        self.accel_rate_hz = struct.unpack('>H', body[2:4])[0]
+        return self.accel_g_range
+
+    def g_scaling(self):
+        """The factor from a KX134 reading to g for the current range"""
+        if self.accel_g_range is None:
+            self.g_range()
+        return 1./(2**(15 - (3 + self.accel_g_range)))
+
+    def collect_samples(self, max_samples=0, port=False, queue=False, accelRate=1.0):
+        """Collect blocks of readings and write them to the sinks
+
+        Readings are aggregated for ``accelRate`` seconds of board time and
+        written to the sinks as one integer array of shape (n, words per
+        reading), e.g. [interval (us), x, y, z] for a KX134. The inter-reading
+        intervals feed the timing statistics (:py:meth:`T_mean` etc.).
+
+        :param max_samples: The maximum number of readings (0 for no limit)
+        :type max_samples: int
+        :param port: Passed to the sinks
+        :param queue: Passed to the sinks
+        :param accelRate: The time span of the arrays written to the sinks (s)
+        :type accelRate: float
+        :returns: the number of readings
+        """
+        import numpy as np
+        span_us = accelRate*1e6
+        pending = []
+        pending_us = 0
+        with self._stream(max_samples, None) as ser:
+            blocks = self._blocks(ser, max_samples)
+            while True:
+                try:
+                    t_us, block = next(blocks)
+                except StopIteration as e:
+                    count = e.value
+                    break
+                pending.append(block)
+                pending_us += block[:,0].sum() if block.shape[1] == 4 else 0
+                if pending_us >= span_us or block.shape[1] != 4:
+                    self._write_sinks(np.concatenate(pending), port, queue)
+                    pending = []
+                    pending_us = 0
+            if pending:
+                self._write_sinks(np.concatenate(pending), port, queue)
+        return count
+
+    def iter_blocks(self, max_samples=0):
+        """Generate blocks of readings as they arrive from the board
+
+        Closing the generator halts the board.
+
+        :param max_samples: The maximum number of readings (0 for no limit)
+        :type max_samples: int
+        :returns: a generator of tuples (board time of the first reading (us),
+            integer array of shape (n, words per reading))
+        """
+        with self._stream(max_samples, None) as ser:
+            blocks = self._blocks(ser, max_samples)
+            try:
+                for item in blocks:
+                    yield item
+            finally:
+                self._drain(blocks)
+
+    def _write_sinks(self, block, port, queue):
+        """[Internal] Write an aggregated block to the sinks, with latency metrics"""
+        t_start = time.perf_counter()
+        for i, sink in enumerate(self.sinks):
+            sink.write(block, port, queue)
+            t_written = time.perf_counter()
+            self.metrics.sink_write("{}:{}".format(i, type(sink).__name__), t_written - t_start)
+            t_start = t_written
+        self.metrics.maybe_snapshot(t_start)
+
+    def _blocks(self, ser, max_samples):
+        """[Internal] The collection loop: read and decode block frames
+
+        :returns: a generator of (board time (us), block) tuples, which
+            returns the reading count (reported by the board if it was halted)
+        """
+        import numpy as np
+        count = 0
+        run_max = max_samples     # the count at which the board halts itself
+        metrics = self.metrics
+        metrics.start_run()
+        reader = _BlockReader(ser, self._resp_body_len, True,
+                resp_pending=lambda: bool(self._pending), metrics=metrics,
+                idle=lambda: self._idle(reader),
+                halt_expected=lambda count: reader.deadline is not None or count == run_max)
+        while True:
+            if self.user_halt and reader.deadline is None:
+                self._send(bytes("H","utf-8"))
+                reader.deadline = time.monotonic() + self.halt_timeout
+            if reader.deadline is not None:
+                if time.monotonic() >= reader.deadline:
+                    break
+            elif max_samples > 0 and count >= max_samples:
+                break
+
+            try:
+                hdr, pos, nbody, _ = reader.next_frame()
+            except ReadInterrupted:
+                continue
+            except BoardTimeout:
+                if not self.reconnect or reader.deadline is not None:
+                    raise
+                run_max = max_samples - count if max_samples > 0 else 0
+                self._reopen(ser, run_max)
+                reader.restart()
+                metrics.reconnects += 1
+                continue
+            t_arrival = time.perf_counter()
+            if (hdr & 0xC0) >> 6 == self.PacketType.HALT:
+                count = _U32.unpack_from(reader.buf, pos)[0]
+                metrics.halt_frame(count, 5)
+                break
+            elif (hdr & 0xC0) >> 6 == self.PacketType.RESP:
+                metrics.bytes_read += 1 + nbody
+                metrics.frames_decoded += 1
+                self._route_resp(bytes([hdr]), bytes(reader.view[pos:pos+nbody]))
+                continue
+
+            n = _U16.unpack_from(reader.buf, pos)[0]
+            width = reader.buf[pos+2]
+            t_us = _U32.unpack_from(reader.buf, pos+3)[0]
+            words = np.frombuffer(reader.buf, dtype='>i2', count=n*width, offset=pos+BLOCK_PREFIX)
+            block = words.reshape(n, width).astype(np.int32)
+            metrics.bytes_read += 1 + nbody
+            metrics.frames_decoded += 1
+            if reader.deadline is not None:
+                metrics.samples += n    # sent before the halt
+                continue
+            metrics.samples += n
+            count += n
+            if width == 4:
+                block[:,0] &= 0xFFFF    # unsigned interval (us)
+                iv = block[:,0]
+                mean = iv.mean()
+                metrics.interarrival.add_batch(n, float(mean), float(((iv - mean)**2).sum()),
+                        float(iv.min()), float(iv.max()))
+            metrics.decode.add((time.perf_counter() - t_arrival)*1e6)
+            yield (t_us, block)
+
+        return count
+
+class _BlockReader(FrameReader):
+    """[Internal] Split an accelerometer stream into block, response and HALT frames
+
+    A block is accepted only if it is plausible: a reading count and width
+    in range, the width of the blocks before, a board time after that of
+    the block before and no further ahead than its readings can span (at
+    least :py:attr:`MAX_JUMP_US`), and no zero interval between KX134
+    readings. The time is compared with the prefix of the block before, not
+    its intervals, so a block corrupted by noise does not make the following
+    blocks fail. HALT frames are checked as by
+    :py:meth:`board.FrameReader._validate`, with the count of readings.
+    """
+
+    BUFFER_SIZE = 1 << 16
+    # largest accepted forward step of the board clock between blocks (us)
+    MAX_JUMP_US = 10000000
+    # the fastest output data rate of the KX134 (Hz)
+    MAX_RATE = 25600
+
+    def restart(self):
+        """Discard buffered data and the block reference, e.g. after the port was reopened"""
+        super().restart()
+        self.block_width = None
+        self.block_time = None  # board time of the block before (us)
+        self.block_readings = 0
+
+    def next_frame(self):
+        """Read the next frame (see :py:meth:`board.FrameReader.next_frame`)"""
+        buf = self.buf
+        while True:
+            self._fill(1)
+            hdr = buf[self.head]
+            if hdr == BLOCK_HEADER:
+                self._fill(1 + BLOCK_PREFIX)
+                pos = self.head + 1
+                try:
+                    n, width, t_us = self._validate_prefix(pos)
+                except BadPacket as e:
+                    self._reject(e)
+                    continue
+                nbody = BLOCK_PREFIX + 2*n*width
+                self._fill(1 + nbody)
+                try:
+                    self._validate_readings(pos, n, width)
+                except BadPacket as e:
+                    self._reject(e)
+                    continue
+                self.block_width = width
+                self.block_time = t_us
+                self.block_readings = n
+                self.data_frames += n
+            else:
+                nbody = self._body_len(hdr)
+                if nbody is None or (hdr & 0xC0) >> 6 == Controller.PacketType.DATA:
+                    self._reject(BadHeader("Unexpected header: 0x{:x}".format(hdr)))
+                    continue
+                self._fill(1 + nbody)
+                pos = self.head + 1
+                try:
+                    self._validate(hdr, pos, nbody)
+                except BadPacket as e:
+                    self._reject(e)
+                    continue
+            self.head = pos + nbody
+            self.in_sync = True
+            return (hdr, pos, nbody, None)
+
+    def _validate_prefix(self, pos):
+        """[Internal] Check the reading count, width and time of a block
+
+        :raises BadPacket: if the prefix is not plausible
+        :returns: a tuple (readings, words per reading, board time (us))
+        """
+        n = _U16.unpack_from(self.buf, pos)[0]
+        width = self.buf[pos+2]
+        t_us = _U32.unpack_from(self.buf, pos+3)[0]
+        if n == 0 or n > MAX_BLOCK_READINGS or width not in (1, 2, 3, 4):
+            raise BadPacket("Implausible block of {}x{} words".format(n, width))
+        if self.block_width is not None and width != self.block_width:
+            raise BadPacket("Block width {} after {}".format(width, self.block_width))
+        # an interval is at most 0xFFFF us
+        limit = max(self.MAX_JUMP_US, self.block_readings*0x10000)
+        if (self.block_time is not None
+                and not 0 < (t_us - self.block_time) & 0xFFFFFFFF <= limit):
+            raise BadPacket("Block time {} out of sequence after {}".format(t_us, self.block_time))
+        return (n, width, t_us)
+
+    def _validate_readings(self, pos, n, width):
+        """[Internal] Check the reading intervals of a block
+
+        :raises BadPacket: if an interval of a KX134 block is zero
+        """
+        if width != 4:
+            return
+        import numpy as np
+        intervals = np.frombuffer(self.buf, dtype='>u2', count=n*width,
+                offset=pos+BLOCK_PREFIX)[::width]
+        if not intervals.all():
+            raise BadPacket("Block with a zero reading interval")
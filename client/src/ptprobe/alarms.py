@@ -0,0 +1,366 @@
+import time
+from collections import namedtuple
+
+import numpy as np
+
+WRAP = 1 << 32      # the board timestamp is a uint32 millisecond counter
+
+# raised is True when the alarm starts, False when it clears
+AlarmEvent = namedtuple("AlarmEvent", "timestamp board rule channel value raised")
+
+class Threshold:
+    """Alarm while a value is above or below a limit, with hysteresis
+
+    The alarm is raised when the value crosses a limit, and cleared when
+    it is back inside the limits by more than the hysteresis.
+    """
+
+    def __init__(self, name, field, above=None, below=None, hysteresis=0.0, channels=(0,1,2,3)):
+        """Construct a rule
+
+        :param name: The rule name, reported in the events
+        :type name: str
+        :param field: The sample field: 'temperature', 'ref_temperature' or 'pressure'
+        :type field: str
+        :param above: The upper limit, None for no upper limit
+        :type above: float
+        :param below: The lower limit, None for no lower limit
+        :type below: float
+        :param hysteresis: The margin inside the limits to clear the alarm
+        :type hysteresis: float
+        :param channels: The monitored channels
+        :type channels: list
+        """
+        self.name = name
+        self.field = field
+        self.above = np.inf if above is None else float(above)
+        self.below = -np.inf if below is None else float(below)
+        self.hysteresis = float(hysteresis)
+        self.channels = tuple(channels)
+
+class RateOfChange:
+    """Alarm while a value changes faster than a limit over a time window"""
+
+    def __init__(self, name, field, limit, window_ms=1000, channels=(0,1,2,3)):
+        """Construct a rule
+
+        :param name: The rule name, reported in the events
+        :type name: str
+        :param field: The sample field: 'temperature', 'ref_temperature' or 'pressure'
+        :type field: str
+        :param limit: The largest accepted rate of change (units per second)
+        :type limit: float
+        :param window_ms: The time over which the change is measured (ms)
+        :type window_ms: int
+        :param channels: The monitored channels
+        :type channels: list
+        """
+        self.name = name
+        self.field = field
+        self.limit = float(limit)
+        self.window_ms = int(window_ms)
+        self.channels = tuple(channels)
+
+class FaultCode:
+    """Alarm while an active thermocouple reports a fault code"""
+
+    def __init__(self, name, codes=None, channels=(0,1,2,3)):
+        """Construct a rule
+
+        :param name: The rule name, reported in the events
+        :type name: str
+        :param codes: The fault codes to match, None for any fault
+        :type codes: list
+        :param channels: The monitored channels
+        :type channels: list
+        """
+        self.name = name
+        self.codes = None if codes is None else tuple(codes)
+        self.channels = tuple(channels)
+
+class Stale:
+    """Alarm while a channel has had no valid value for some time
+
+    Temperatures are valid if the thermocouple is active and reports no
+    fault. A board that sends nothing at all is detected by
+    :py:meth:`AlarmEngine.poll`.
+    """
+
+    def __init__(self, name, field, max_age_ms, channels=(0,1,2,3)):
+        """Construct a rule
+
+        :param name: The rule name, reported in the events
+        :type name: str
+        :param field: The sample field: 'temperature', 'ref_temperature' or 'pressure'
+        :type field: str
+        :param max_age_ms: The longest accepted time without a valid value (ms)
+        :type max_age_ms: int
+        :param channels: The monitored channels
+        :type channels: list
+        """
+        self.name = name
+        self.field = field
+        self.max_age_ms = int(max_age_ms)
+        self.channels = tuple(channels)
+
+RULE_TYPES = {
+    "threshold": Threshold,
+    "rate": RateOfChange,
+    "fault": FaultCode,
+    "stale": Stale,
+}
+
+def rules_from_config(specs):
+    """Construct rules from declarations, e.g. read from a JSON file
+
+    :param specs: Maps with a 'type' (see :py:data:`RULE_TYPES`) and the
+        arguments of the rule class, e.g.
+        ``{"type": "threshold", "name": "P0 high", "field": "pressure", "above": 50, "channels": [0]}``
+    :type specs: list
+    :returns: a list of rules
+    """
+    rules = []
+    for spec in specs:
+        spec = dict(spec)
+        cls = RULE_TYPES.get(spec.pop("type", None))
+        if cls is None:
+            raise ValueError("Unknown rule type in {}".format(spec))
+        rules.append(cls(**spec))
+    return rules
+
+class AlarmEngine:
+    """Evaluate alarm rules on batches of samples
+
+    The rules are compiled into arrays by type, and each batch (see
+    :py:meth:`board.Controller.iter_batches`) is evaluated with a few NumPy
+    operations per rule type on (samples, rules, channels) arrays, whatever
+    the number of rules. The alarm state of each board, rule and channel is
+    carried over between batches, and an event is emitted only when the
+    state changes, so a persisting condition is reported once.
+    """
+
+    def __init__(self, rules, on_event=None):
+        """Construct an engine
+
+        :param rules: The rules (:py:class:`Threshold`, :py:class:`RateOfChange`,
+            :py:class:`FaultCode`, :py:class:`Stale`)
+        :type rules: list
+        :param on_event: An optional callback for each :py:class:`AlarmEvent`
+        :type on_event: callable
+        """
+        self.on_event = on_event
+        self.names = []
+        self._groups = []
+        for cls in (Threshold, RateOfChange, FaultCode, Stale):
+            group = [r for r in rules if isinstance(r, cls)]
+            if group:
+                self._groups.append((cls, _compile(cls, group)))
+                self.names.extend(r.name for r in group)
+        self._boards = {}
+
+    def process(self, batch, board=0):
+        """Evaluate the rules on a batch of samples from one board
+
+        :param batch: The sample arrays of a batch
+        :type batch: dict
+        :param board: The board label used in the events, e.g. its ID or port
+        :returns: the list of events, in time order
+        """
+        n = len(batch["timestamp"])
+        if n == 0 or not self._groups:
+            return []
+        state = self._boards.get(board)
+        if state is None:
+            state = self._boards[board] = _BoardState(len(self.names))
+        t = state.unwrap(batch["timestamp"])
+        active = np.zeros((n, len(self.names), 4), dtype=bool)
+        values = np.full((n, len(self.names), 4), np.nan)
+        row = 0
+        for cls, compiled in self._groups:
+            nrules = len(compiled["names"])
+            rows = slice(row, row + nrules)
+            prev = state.alarm[rows]
+            if cls is Threshold:
+                active[:,rows], values[:,rows] = _eval_threshold(compiled, batch, prev)
+            elif cls is RateOfChange:
+                active[:,rows], values[:,rows] = _eval_rate(compiled, batch, t, state, row)
+            elif cls is FaultCode:
+                active[:,rows], values[:,rows] = _eval_fault(compiled, batch)
+            else:
+                active[:,rows], values[:,rows] = _eval_stale(compiled, batch, t, state, row)
+            active[:,rows] &= compiled["channels"]
+            row += nrules
+        state.t_last_batch = time.monotonic()
+        return self._emit(board, state, t, batch["timestamp"], active, values)
+
+    def poll(self, now=None):
+        """Raise the stale alarms of boards that have sent no batch for too long
+
+        Call this periodically: without samples, :py:meth:`process` is not
+        called and cannot notice a silent board.
+
+        :param now: The host monotonic time (s), default now
+        :type now: float
+        :returns: the list of events
+        """
+        if now is None:
+            now = time.monotonic()
+        events = []
+        row = 0
+        for cls, compiled in self._groups:
+            nrules = len(compiled["names"])
+            if cls is Stale:
+                for board, state in self._boards.items():
+                    silent = (now - state.t_last_batch)*1000.0 > compiled["max_age_ms"]
+                    active = state.alarm.copy()
+                    active[row:row+nrules] |= silent[:,None] & compiled["channels"]
+                    events.extend(self._emit(board, state, np.array([state.last_t]),
+                            np.array([state.last_raw]), active[None], None))
+            row += nrules
+        return events
+
+    def active_alarms(self, board=0):
+        """The alarms currently raised on a board
+
+        :returns: a list of (rule name, channel) tuples
+        """
+        state = self._boards.get(board)
+        if state is None:
+            return []
+        irule, ich = np.nonzero(state.alarm)
+        return [(self.names[i], int(c)) for i, c in zip(irule, ich)]
+
+    def _emit(self, board, state, t, raw, active, values):
+        """[Internal] Generate the events of the state changes and update the state"""
+        prev = np.concatenate((state.alarm[None], active[:-1]))
+        changed = active != prev
+        state.alarm = active[-1].copy()
+        if not changed.any():
+            return []
+        isample, irule, ich = np.nonzero(changed)
+        events = [AlarmEvent(int(raw[i]), board, self.names[r], int(c),
+                None if values is None or np.isnan(values[i,r,c]) else float(values[i,r,c]),
+                bool(active[i,r,c])) for i, r, c in zip(isample, irule, ich)]
+        if self.on_event is not None:
+            for event in events:
+                self.on_event(event)
+        return events
+
+class _BoardState:
+    """[Internal] The alarm state and history of one board"""
+
+    def __init__(self, nrules):
+        self.alarm = np.zeros((nrules, 4), dtype=bool)
+        self.last_raw = None
+        self.last_t = 0
+        self.history = {}       # rule row -> (times, values) within the rate window
+        self.last_valid = {}    # rule row -> last valid time by channel
+        self.t_last_batch = time.monotonic()
+
+    def unwrap(self, timestamps):
+        """Extend the board timestamps past the rollover of the counter"""
+        raw = np.asarray(timestamps, dtype=np.int64)
+        first = raw[0] if self.last_raw is None else self.last_t + ((raw[0] - self.last_raw) % WRAP)
+        t = first + np.concatenate(([0], np.cumsum(np.diff(raw) % WRAP)))
+        self.last_raw = int(raw[-1])
+        self.last_t = int(t[-1])
+        return t
+
+def _compile(cls, rules):
+    """[Internal] Stack the parameters of rules of one type into arrays"""
+    compiled = {"names": [r.name for r in rules],
+            "channels": np.array([[ich in r.channels for ich in range(4)] for r in rules])}
+    if cls is not FaultCode:
+        compiled["fields"] = [r.field for r in rules]
+    if cls is Threshold:
+        compiled["above"] = np.array([r.above for r in rules])[:,None]
+        compiled["below"] = np.array([r.below for r in rules])[:,None]
+        compiled["hysteresis"] = np.array([r.hysteresis for r in rules])[:,None]
+    elif cls is RateOfChange:
+        compiled["limit"] = np.array([r.limit for r in rules])[:,None]
+        compiled["window_ms"] = np.array([r.window_ms for r in rules])
+    elif cls is FaultCode:
+        codes = sorted(set(c for r in rules if r.codes for c in r.codes))
+        compiled["any"] = np.array([r.codes is None for r in rules])[:,None]
+        compiled["codes"] = np.array(codes, dtype=np.int64)
+        compiled["match"] = np.array([[c in (r.codes or ()) for c in codes] for r in rules],
+                dtype=bool).reshape(len(rules), len(codes))
+    else:
+        compiled["max_age_ms"] = np.array([r.max_age_ms for r in rules])
+    return compiled
+
+def _field_values(batch, rules_fields):
+    """[Internal] The (samples, rules, channels) values of the rule fields, NaN if invalid"""
+    fields = {}
+    for field in set(rules_fields):
+        x = np.array(batch[field], dtype=np.float64)
+        if field == "temperature":
+            x[~batch["active_T"] | (batch["fault_T"] != 0)] = np.nan
+        elif field == "ref_temperature":
+            x[~batch["active_T"]] = np.nan
+        fields[field] = x
+    if len(fields) == 1:
+        return np.broadcast_to(x[:,None,:], (len(x), len(rules_fields), 4))
+    return np.stack([fields[f] for f in rules_fields], axis=1)
+
+def _eval_threshold(compiled, batch, prev):
+    """[Internal] Threshold states: latest set or clear condition, else the previous state"""
+    x = _field_values(batch, compiled["fields"])
+    above, below, h = compiled["above"], compiled["below"], compiled["hysteresis"]
+    with np.errstate(invalid="ignore"):
+        raise_ = (x > above) | (x < below)
+        clear = (x <= above - h) & (x >= below + h)
+    # forward fill the last set (1) or clear (0) condition over the samples
+    n = len(x)
+    idx = np.where(raise_ | clear, np.arange(n)[:,None,None], -1)
+    idx = np.maximum.accumulate(idx, axis=0)
+    state = np.where(idx >= 0, np.take_along_axis(raise_, np.maximum(idx, 0), axis=0), prev[None])
+    return (state, x)
+
+def _eval_rate(compiled, batch, t, state, row):
+    """[Internal] Rate of change states, from the value one window earlier"""
+    x = _field_values(batch, compiled["fields"])
+    out = np.zeros(x.shape, dtype=bool)
+    rates = np.full(x.shape, np.nan)
+    for k, window in enumerate(compiled["window_ms"]):
+        t_hist, x_hist = state.history.get(row + k, (np.zeros(0, dtype=np.int64), np.zeros((0, 4))))
+        t_all = np.concatenate((t_hist, t))
+        x_all = np.concatenate((x_hist, x[:,k]))
+        # the latest sample at least one window before each sample
+        j = np.searchsorted(t_all, t - window, side="right") - 1
+        ok = j >= 0
+        dt = (t - t_all[np.maximum(j, 0)])/1000.0
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rate = (x[:,k] - x_all[np.maximum(j, 0)])/dt[:,None]
+        rate[~ok] = np.nan
+        rates[:,k] = rate
+        with np.errstate(invalid="ignore"):
+            out[:,k] = np.abs(rate) > compiled["limit"][k]
+        keep = t_all >= t[-1] - window
+        keep[max(0, np.argmax(keep) - 1)] = True    # one sample before the window
+        state.history[row + k] = (t_all[keep], x_all[keep])
+    return (out, rates)
+
+def _eval_fault(compiled, batch):
+    """[Internal] Fault code states"""
+    fault = batch["fault_T"]
+    active = batch["active_T"]
+    codes = compiled["codes"]
+    state = (compiled["any"][None] & (fault != 0)[:,None,:])
+    if len(codes):
+        hit = fault[:,:,None] == codes[None,None,:]          # (samples, channels, codes)
+        state |= np.einsum("sck,rk->src", hit, compiled["match"]) > 0
+    state &= active[:,None,:]
+    return (state, np.broadcast_to(fault[:,None,:], state.shape).astype(np.float64))
+
+def _eval_stale(compiled, batch, t, state, row):
+    """[Internal] Stale channel states, from the time of the last valid value"""
+    x = _field_values(batch, compiled["fields"])
+    valid_t = np.where(np.isnan(x), -np.inf, t[:,None,None].astype(np.float64))
+    last = np.stack([state.last_valid.get(row + k, np.full(4, float(t[0])))
+            for k in range(x.shape[1])])
+    last = np.maximum.accumulate(np.concatenate((last[None], valid_t)), axis=0)[1:]
+    for k in range(x.shape[1]):
+        state.last_valid[row + k] = last[-1,k]
+    age = t[:,None,None] - last
+    return (age > compiled["max_age_ms"][None,:,None], age)
@@ -0,0 +1,387 @@
+import csv
+import hashlib
+import json
+import logging
+import os
+from multiprocessing import Pool
+
+import numpy as np
+from scipy import signal
+
+from . import recording
+from .metrics import RunningStats
+
+TASK_BYTES = 1 << 26    # a large file is split into tasks of about this size
+CACHE_VERSION = 2       # changed when the cached summaries change meaning
+
+class ChannelSummary:
+    """Mergeable statistics and Welch PSD of one channel of a recording
+
+    Partial summaries of consecutive parts of a recording (e.g. byte ranges
+    analysed in different processes) are combined with :py:meth:`merge`: the
+    running statistics by Chan's method, the PSD by summing the periodograms
+    of the Welch segments, so the merged PSD is the average over all
+    segments. Each part keeps its first and last samples, from which the
+    segments that span two parts are computed when they are merged; with
+    parts that start on a segment boundary (see :py:func:`analyse_files`)
+    the result is the same as for the whole recording in one part. Faulted
+    samples are left out of the statistics, and the segments that contain
+    one are left out of the PSD.
+    """
+
+    def __init__(self, nperseg):
+        """Construct an empty summary
+
+        :param nperseg: The Welch segment length (samples)
+        :type nperseg: int
+        """
+        self.nperseg = nperseg
+        self.stats = RunningStats()
+        self.faults = 0
+        self.psd_sum = np.zeros(nperseg//2 + 1)
+        self.nseg = 0
+        self.fs_sum = 0.0
+        self.fs_n = 0
+        self._rows = 0
+        self._head = np.zeros(0)
+        self._carry = np.zeros(0)
+
+    def add(self, x, fs, ok=None):
+        """Add the next consecutive samples
+
+        Samples left over after the last whole segment are carried over to
+        the next call.
+
+        :param x: The samples
+        :type x: numpy.ndarray
+        :param fs: The sample rate (Hz)
+        :type fs: float
+        :param ok: The mask of the valid samples, None if all are valid;
+            the others are counted as faults
+        :type ok: numpy.ndarray
+        """
+        if len(x) == 0:
+            return
+        valid = x
+        if ok is not None:
+            valid = x[ok]
+            self.faults += int(len(x) - len(valid))
+            x = np.where(ok, x, np.nan)
+        if len(valid):
+            mean = float(valid.mean())
+            self.stats.add_batch(len(valid), mean, float(((valid - mean)**2).sum()),
+                    float(valid.min()), float(valid.max()))
+            self.fs_sum += fs*len(valid)
+            self.fs_n += len(valid)
+        self._keep_head(x)
+        self._rows += len(x)
+        self._carry = self._segments(np.concatenate((self._carry, x)))
+
+    def merge(self, other):
+        """Add the summary of the next consecutive part of the recording
+
+        :param other: The summary to merge into this one
+        :type other: :py:class:`ChannelSummary`
+        """
+        s = other.stats
+        self.stats.add_batch(s.n, s.mean, s.m2, s.min, s.max)
+        self.faults += other.faults
+        self.fs_sum += other.fs_sum
+        self.fs_n += other.fs_n
+        x = np.concatenate((self._carry, other._head))
+        if other._rows > len(other._head):
+            # other has computed its segments from its first sample on
+            self._segments(x, len(self._carry))
+            self._carry = other._carry
+        else:
+            self._carry = self._segments(x)
+        self.psd_sum += other.psd_sum
+        self.nseg += other.nseg
+        self._keep_head(other._head)
+        self._rows += other._rows
+
+    def _keep_head(self, x):
+        """[Internal] Keep the first samples, which complete the segments of the part before"""
+        need = self.nperseg - 1 - len(self._head)
+        if need > 0:
+            self._head = np.concatenate((self._head, x[:need]))
+
+    def _segments(self, x, starts=None):
+        """[Internal] Add the periodograms of the whole segments of x
+
+        :param starts: Only add the segments starting before this index
+        :returns: the samples from the first segment not added on
+        """
+        step = self.nperseg//2
+        nseg = (len(x) - self.nperseg)//step + 1 if len(x) >= self.nperseg else 0
+        if starts is not None:
+            nseg = min(nseg, -(-starts//step))
+        if nseg > 0:
+            used = x[:(nseg - 1)*step + self.nperseg]
+            # at unit sample rate, scaled by the mean rate in psd()
+            _, _, sxx = signal.spectrogram(used, 1.0, window='hann', nperseg=self.nperseg,
+                    noverlap=self.nperseg - step, detrend='constant', scaling='density', mode='psd')
+            whole = np.isfinite(sxx).all(axis=0)
+            self.psd_sum += sxx[:, whole].sum(axis=-1)
+            self.nseg += int(whole.sum())
+        return x[nseg*step:]
+
+    @property
+    def fs(self):
+        """The mean sample rate (Hz)"""
+        return self.fs_sum/self.fs_n if self.fs_n else 0.0
+
+    @property
+    def rms(self):
+        """The root mean square of the samples"""
+        s = self.stats
+        return float(np.sqrt(s.mean**2 + s.m2/s.n)) if s.n else 0.0
+
+    def psd(self):
+        """The Welch PSD over all segments
+
+        :returns: a tuple (frequencies (Hz), power spectral density)
+        """
+        if not self.fs:
+            return (np.zeros(len(self.psd_sum)), self.psd_sum)
+        freqs = np.fft.rfftfreq(self.nperseg, 1.0/self.fs)
+        return (freqs, self.psd_sum/(self.nseg*self.fs) if self.nseg else self.psd_sum)
+
+    def row(self):
+        """The summary as a map, for the summary table"""
+        s = self.stats
+        freqs, psd = self.psd()
+        return {"n": s.n, "mean": s.mean, "std": np.sqrt(s.variance), "rms": self.rms,
+                "min": s.min if s.n else 0.0, "max": s.max if s.n else 0.0,
+                "faults": self.faults, "fs": self.fs, "segments": self.nseg,
+                "peak_hz": float(freqs[np.argmax(psd[1:]) + 1]) if self.nseg else 0.0}
+
+def channels(layout):
+    """The analysed channels of a recording layout
+
+    :param layout: The column names (see :py:func:`recording.csv_layout`)
+    :type layout: list
+    :returns: a list of (channel name, value column, fault column or None)
+    """
+    if "X" in layout:
+        return [(axis, axis, None) for axis in ("X", "Y", "Z")]
+    if "Time" in layout:
+        out = []
+        for ich in range(4):
+            out.append(("CH_{} Pressure".format(ich), "CH_{} Pressure".format(ich), None))
+            out.append(("CH_{} Temp".format(ich), "CH_{} Temp".format(ich),
+                    "CH_{} Error Code".format(ich)))
+        return out
+    return [(name, name, None) for name in layout]
+
+def analyse_range(filename, start=0, stop=None, nperseg=256, chunk_bytes=recording.CHUNK_BYTES):
+    """Summarize the channels of part of a recording
+
+    :param filename: The CSV recording
+    :type filename: str
+    :param start: The first byte offset (see :py:func:`recording.iter_csv`)
+    :type start: int
+    :param stop: The stop byte offset, None for the end of the file
+    :type stop: int
+    :param nperseg: The Welch segment length (samples)
+    :type nperseg: int
+    :param chunk_bytes: The approximate number of bytes parsed per chunk
+    :type chunk_bytes: int
+    :returns: a map of channel names to :py:class:`ChannelSummary`
+    """
+    out = {}
+    for chunk in recording.iter_csv(filename, chunk_bytes=chunk_bytes, start=start, stop=stop):
+        layout = list(chunk)
+        fs = _sample_rate(chunk)
+        for name, col, fault_col in channels(layout):
+            summary = out.get(name)
+            if summary is None:
+                summary = out[name] = ChannelSummary(nperseg)
+            ok = chunk[fault_col] == 0 if fault_col is not None else None
+            summary.add(chunk[col], fs, ok)
+    return out
+
+def merge(parts):
+    """Merge the summaries of consecutive parts of a recording
+
+    :param parts: Maps of channel names to :py:class:`ChannelSummary`, in order
+    :type parts: list
+    :returns: the merged map
+    """
+    out = {}
+    for part in parts:
+        for name, summary in part.items():
+            if name in out:
+                out[name].merge(summary)
+            else:
+                out[name] = summary
+    return out
+
+def file_key(filename, params):
+    """The cache key of a recording: a hash of its content and the analysis parameters
+
+    :param filename: The recording
+    :type filename: str
+    :param params: The analysis parameters
+    :type params: dict
+    :returns: the key as a hex string
+    """
+    h = hashlib.blake2b(digest_size=20)
+    h.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    with open(filename, "rb") as hf:
+        for block in iter(lambda: hf.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def analyse_files(filenames, summary_path, nperseg=256, processes=None, cache_dir=None,
+        task_bytes=TASK_BYTES):
+    """Analyse recordings in a process pool and write one summary table
+
+    Large files are split into byte ranges of about ``task_bytes``, which
+    start on a Welch segment boundary, analysed in parallel and merged. With
+    a cache directory, the merged summaries are stored by
+    :py:func:`file_key`, and unchanged files are not analysed again. The
+    PSDs are saved next to the table (``<summary_path>.psd.npz``, arrays
+    '<file>|<channel>|freq' and '<file>|<channel>|psd').
+
+    :param filenames: The CSV recordings
+    :type filenames: list
+    :param summary_path: The summary table (CSV, one row per file and channel)
+    :type summary_path: str
+    :param nperseg: The Welch segment length (samples)
+    :type nperseg: int
+    :param processes: The number of worker processes, None for the CPU count
+    :type processes: int
+    :param cache_dir: A directory for cached summaries, None for no cache
+    :type cache_dir: str
+    :param task_bytes: The approximate size of the part of a file per task
+    :type task_bytes: int
+    :returns: a map of file names to maps of channel names to summaries
+    """
+    params = {"nperseg": nperseg, "task_bytes": task_bytes,
+            "chunk_bytes": recording.CHUNK_BYTES, "version": CACHE_VERSION}
+    results = {}
+    with Pool(processes) as pool:
+        keys = {}
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            keys = dict(zip(filenames, pool.starmap(file_key, [(f, params) for f in filenames])))
+            for f in filenames:
+                cached = _load_cached(os.path.join(cache_dir, keys[f] + ".npz"), nperseg)
+                if cached is not None:
+                    logging.info("Cached: {}".format(f))
+                    results[f] = cached
+        todo = [f for f in filenames if f not in results]
+        splits = pool.starmap(_split, [(f, task_bytes, nperseg//2) for f in todo])
+        tasks = []
+        for f, bounds in zip(todo, splits):
+            tasks.extend((f, start, stop, nperseg) for start, stop in bounds)
+        parts = pool.starmap(analyse_range, tasks)
+    for f in todo:
+        results[f] = merge([p for t, p in zip(tasks, parts) if t[0] == f])
+        if cache_dir is not None:
+            _save_cached(os.path.join(cache_dir, keys[f] + ".npz"), results[f])
+    _write_summary(summary_path, filenames, results)
+    return results
+
+def _split(filename, task_bytes, step):
+    """[Internal] Split a recording into byte ranges that start on a segment boundary
+
+    Every range but the first starts at a data line whose index is a
+    multiple of ``step``, so the Welch segments of the parts lie on the
+    same grid as those of the whole file.
+    """
+    size = os.path.getsize(filename)
+    n = max(1, -(-size//task_bytes))
+    bounds = [0]
+    with open(filename, "rb") as hf:
+        header = 1 if _is_header(hf.readline()) else 0
+        hf.seek(0)
+        lines = 0   # the number of lines before the offset pos
+        pos = 0
+        for i in range(1, n):
+            target = size*i//n
+            if target <= pos:
+                continue
+            # the line in progress at the target belongs to the range before
+            while pos < target - 1:
+                block = hf.read(min(1 << 20, target - 1 - pos))
+                lines += block.count(b'\n')
+                pos += len(block)
+            line = hf.readline()
+            lines += line.endswith(b'\n')
+            # on to the next data line with an index that is a multiple of step
+            for _ in range((header - lines) % step):
+                line = hf.readline()
+                if not line:
+                    break
+                lines += line.endswith(b'\n')
+            pos = hf.tell()
+            if pos < size:
+                bounds.append(pos)
+    return list(zip(bounds, bounds[1:] + [size]))
+
+def _is_header(line):
+    """[Internal] Whether a line is a header line, which :py:func:`recording.iter_csv` skips"""
+    first = line.lstrip()[:1]
+    return bool(first) and not (first.isdigit() or first in b'-+.')
+
+def _sample_rate(chunk):
+    """[Internal] Estimate the sample rate of a chunk (Hz)"""
+    if "Interval" in chunk and len(chunk["Interval"]):
+        return 1e6/float(np.mean(chunk["Interval"]))
+    if "Time" in chunk and len(chunk["Time"]) > 1:
+        dt = np.diff(chunk["Time"])
+        dt = dt[(dt > 0) & (dt < 1 << 31)]
+        if len(dt):
+            return 1e3/float(np.median(dt))
+    return 1.0
+
+def _write_summary(path, filenames, results):
+    """[Internal] Write the summary table and the PSD archive"""
+    fields = ["file", "channel", "n", "mean", "std", "rms", "min", "max", "faults",
+            "fs", "segments", "peak_hz"]
+    psds = {}
+    with open(path, "w", newline="") as hf:
+        writer = csv.DictWriter(hf, fieldnames=fields)
+        writer.writeheader()
+        for f in filenames:
+            for name, summary in results[f].items():
+                writer.writerow(dict(summary.row(), file=f, channel=name))
+                freqs, psd = summary.psd()
+                psds["{}|{}|freq".format(f, name)] = freqs
+                psds["{}|{}|psd".format(f, name)] = psd
+    np.savez(path + ".psd.npz", **psds)
+
+def _save_cached(path, summaries):
+    """[Internal] Store the summaries of a file"""
+    arrays = {}
+    for name, s in summaries.items():
+        st = s.stats
+        arrays[name + "|scalars"] = np.array([st.n, st.mean, st.m2, st.min, st.max,
+                s.faults, s.nseg, s.fs_sum, s.fs_n], dtype=np.float64)
+        arrays[name + "|psd_sum"] = s.psd_sum
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+
+def _load_cached(path, nperseg):
+    """[Internal] Read stored summaries, None if there are none"""
+    if not os.path.exists(path):
+        return None
+    out = {}
+    with np.load(path) as data:
+        for key in data.files:
+            name, _, kind = key.rpartition("|")
+            if kind != "scalars":
+                continue
+            n, mean, m2, xmin, xmax, faults, nseg, fs_sum, fs_n = data[key]
+            s = ChannelSummary(nperseg)
+            s.stats.add_batch(int(n), mean, m2, xmin, xmax)
+            s.faults = int(faults)
+            s.nseg = int(nseg)
+            s.fs_sum = fs_sum
+            s.fs_n = int(fs_n)
+            s.psd_sum = data[name + "|psd_sum"]
+            out[name] = s
+    return out
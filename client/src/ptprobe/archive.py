@@ -0,0 +1,386 @@
+import logging
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from .sinks import SampleSink
+
+MAGIC = b'PTZ2'
+MAGIC_V1 = b'PTZ1'      # blocks with XOR coding only, still read
+BLOCK_SIZE = 4096
+
+# the codings of a float channel in a block
+XOR = 0         # XOR of consecutive float32 values
+FIXED = 1       # differences of the values scaled to integers by a power of two
+TABLE = 2       # differences of indices into a table of the distinct values
+
+MAX_FIXED_SHIFT = 24    # finest step of the FIXED coding, 2^-24
+ZERO_ON_FAULT = 0x80    # coding flag: the values of faulted samples are 0.0
+
+# the float fields of a sample, 4 channels each, in block order
+FLOAT_FIELDS = ("temperature", "ref_temperature", "pressure")
+
+_BLOCK_HDR = struct.Struct('<4sIIi')       # magic, samples, first timestamp, first delta
+_PACK_HDR = struct.Struct('<BBI')          # shift, width, bytes
+_FAULT_HDR = struct.Struct('<I')           # number of fault codes
+_CODING_HDR = struct.Struct('<B')          # coding of a float channel
+_FIXED_HDR = struct.Struct('<Bq')          # shift, first scaled value
+_TABLE_HDR = struct.Struct('<I')           # number of distinct values
+
+def encode_block(batch):
+    """Compress a batch of samples into a block
+
+    The format follows the Gorilla time series encoding, adapted to whole
+    blocks so that it can be decoded with vectorized NumPy operations:
+
+    - timestamps are stored as delta-of-deltas (zero at a steady rate),
+      zigzag encoded and bit-packed with the width of the largest
+    - each float channel is stored in the smallest of three codings:
+      XOR of consecutive float32 values, with the trailing bits that are
+      zero in the whole block dropped (Gorilla); differences of the values
+      scaled to integers, if they are all multiples of one power of two (the
+      thermocouple converters have a fixed resolution of 2^-7 or 2^-6 C); or
+      differences of indices into a table of the distinct values of the
+      block (a pressure is one of 4096 ADC counts converted by the same
+      polynomial). The differences are zigzag encoded and bit-packed. The
+      temperature of a faulted sample, which the board sends as 0, is 
+      coded as the previous temperature so that it does not widen the
+      differences of the whole block, and set back to 0 on decoding.
+    - the active flags and the mask of non-zero fault codes are stored as
+      the changes of the 4 channel flags from sample to sample (no bits if
+      they do not change in the block), followed by the non-zero codes
+
+    Values are stored as float32, as sent by the board, so the compression
+    is lossless for recorded samples: a coding is only used if it gives the
+    float32 bits back exactly.
+
+    :param batch: The sample arrays (see :py:meth:`board.Controller.iter_batches`)
+    :type batch: dict
+    :returns: the block as bytes
+    """
+    t = np.asarray(batch["timestamp"], dtype=np.int64)
+    n = len(t)
+    delta = (np.diff(t) + (1 << 31)) % (1 << 32) - (1 << 31)     # across the counter wrap
+    first_delta = int(delta[0]) if n > 1 else 0
+    dod = np.diff(delta)
+    parts = [_BLOCK_HDR.pack(MAGIC, n, int(t[0]) if n else 0, first_delta)]
+    parts.append(_pack((dod << 1) ^ (dod >> 63)))
+    active = np.asarray(batch["active_T"], dtype=bool)
+    parts.append(_pack_flags(active))
+    fault = np.asarray(batch["fault_T"], dtype=np.int64)
+    nonzero = fault != 0
+    parts.append(_pack_flags(nonzero))
+    codes = fault[nonzero].astype('<i4')
+    parts.append(_FAULT_HDR.pack(len(codes)) + codes.tobytes())
+    for field in FLOAT_FIELDS:
+        bits = np.asarray(batch[field], dtype=np.float32).view(np.uint32).astype(np.uint64)
+        for ich in range(4):
+            parts.append(_encode_channel(bits[:,ich],
+                    nonzero[:,ich] if field == "temperature" else None))
+    return b''.join(parts)
+
+def decode_block(buf, offset=0):
+    """Decompress a block written by :py:func:`encode_block`
+
+    :param buf: The data
+    :type buf: bytes
+    :param offset: The offset of the block in buf
+    :type offset: int
+    :raises ValueError: if the data is not a block
+    :returns: a tuple (sample arrays as in :py:meth:`board.Controller.iter_batches`,
+        offset after the block)
+    """
+    magic, n, t0, first_delta = _BLOCK_HDR.unpack_from(buf, offset)
+    if magic != MAGIC and magic != MAGIC_V1:
+        raise ValueError("Not a sample block at offset {}".format(offset))
+    pos = offset + _BLOCK_HDR.size
+    zz, pos = _unpack(buf, pos, max(0, n - 2))
+    dod = (zz >> 1).astype(np.int64) ^ -(zz & 1).astype(np.int64)
+    delta = np.concatenate(([first_delta], first_delta + np.cumsum(dod))) if n > 1 else np.zeros(0, dtype=np.int64)
+    out = {"timestamp": (t0 + np.concatenate(([0], np.cumsum(delta)))[:n]) % (1 << 32)}
+    if magic == MAGIC_V1:
+        nbytes = (4*n + 7)//8
+        mask = np.frombuffer(buf, dtype=np.uint8, count=nbytes, offset=pos)
+        out["active_T"] = np.unpackbits(mask, count=4*n).astype(bool).reshape(n, 4)
+        pos += nbytes
+        mask = np.frombuffer(buf, dtype=np.uint8, count=nbytes, offset=pos)
+        nonzero = np.unpackbits(mask, count=4*n).astype(bool).reshape(n, 4)
+        pos += nbytes
+    else:
+        out["active_T"], pos = _unpack_flags(buf, pos, n)
+        nonzero, pos = _unpack_flags(buf, pos, n)
+    ncodes = _FAULT_HDR.unpack_from(buf, pos)[0]
+    pos += _FAULT_HDR.size
+    fault = np.zeros((n, 4), dtype=np.int64)
+    fault[nonzero] = np.frombuffer(buf, dtype='<i4', count=ncodes, offset=pos)
+    out["fault_T"] = fault
+    pos += 4*ncodes
+    for field in FLOAT_FIELDS:
+        values = np.empty((n, 4), dtype=np.uint32)
+        for ich in range(4):
+            if magic == MAGIC_V1:
+                xor, pos = _unpack(buf, pos, n)
+                values[:,ich] = np.bitwise_xor.accumulate(xor.astype(np.uint32)) if n else xor
+            else:
+                values[:,ich], pos = _decode_channel(buf, pos, n,
+                        nonzero[:,ich] if field == "temperature" else None)
+        out[field] = values.view(np.float32).astype(np.float64)
+    return (out, pos)
+
+def iter_archive(filename):
+    """Read the blocks of an archive file
+
+    :param filename: The file written by :py:class:`ArchiveSampleSink`
+    :type filename: str
+    :returns: a generator of maps of sample arrays, one per block
+    """
+    for block, pos in iter_blocks(filename):
+        yield block
+
+def iter_blocks(filename, offset=0):
+    """Read the blocks of an archive file from an offset, one at a time
+
+    The file is memory-mapped rather than read, so only the pages of the
+    blocks being decoded are loaded. A block that cannot be decoded, such
+    as the last block of an interrupted recording, ends the file.
+
+    :param filename: The file written by :py:class:`ArchiveSampleSink`
+    :type filename: str
+    :param offset: The offset of a block in the file
+    :type offset: int
+    :returns: a generator of tuples (map of sample arrays, offset after the block)
+    """
+    with open(filename, "rb") as hf:
+        if os.fstat(hf.fileno()).st_size <= offset:
+            return
+        with mmap.mmap(hf.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            pos = offset
+            while pos < len(buf):
+                try:
+                    block, end = decode_block(buf, pos)
+                    if end > len(buf):
+                        raise ValueError("Block ends after the end of the file")
+                except (ValueError, struct.error) as e:
+                    # e.g. the last block of a recording cut off by a power loss
+                    logging.warning("Dropped the incomplete block at offset {} of {}: {}".format(
+                            pos, filename, e))
+                    return
+                pos = end
+                yield (block, pos)
+
+def load_archive(filename):
+    """Read an archive file into one map of sample arrays
+
+    :param filename: The file written by :py:class:`ArchiveSampleSink`
+    :type filename: str
+    :returns: a map of sample arrays (see :py:meth:`board.Controller.iter_batches`)
+    """
+    blocks = list(iter_archive(filename))
+    if not blocks:
+        return {}
+    return {field: np.concatenate([b[field] for b in blocks]) for field in blocks[0]}
+
+class ArchiveSampleSink (SampleSink):
+    """Write samples to a compressed archive file (see :py:func:`encode_block`)
+
+    Samples are collected into blocks of ``block_size`` and each full block
+    is compressed and appended to the file; the last, partial block is
+    written on :py:meth:`close`. Read the file with :py:func:`load_archive`.
+    """
+
+    def __init__(self, filename, block_size=BLOCK_SIZE):
+        """Construct a sink
+
+        :param filename: The archive file
+        :type filename: str
+        :param block_size: The number of samples per block
+        :type block_size: int
+        """
+        self.filename = filename
+        self.block_size = block_size
+        self.hf = None
+        self._batch = None
+        self._n = 0
+
+    def open(self):
+        self.close()
+        self.hf = open(self.filename, "ab")
+        self._batch = {
+            "timestamp": np.zeros(self.block_size, dtype=np.int64),
+            "active_T": np.zeros((self.block_size, 4), dtype=bool),
+            "fault_T": np.zeros((self.block_size, 4), dtype=np.int64),
+            "temperature": np.zeros((self.block_size, 4), dtype=np.float32),
+            "ref_temperature": np.zeros((self.block_size, 4), dtype=np.float32),
+            "pressure": np.zeros((self.block_size, 4), dtype=np.float32),
+        }
+        self._n = 0
+
+    def close(self):
+        if self.hf is not None:
+            self.flush()
+            self.hf.close()
+        self.hf = None
+
+    def flush(self):
+        """Write the samples collected so far as a block"""
+        if self._n:
+            self.hf.write(encode_block({k: v[:self._n] for k, v in self._batch.items()}))
+            self.hf.flush()
+            self._n = 0
+
+    def write(self, sample, *args):
+        if self.hf is None:
+            raise RuntimeError("No sink initialized for write")
+        b = self._batch
+        n = self._n
+        b["timestamp"][n] = sample[0]
+        b["active_T"][n] = sample[1]
+        b["fault_T"][n] = sample[2]
+        b["temperature"][n] = sample[3]
+        b["ref_temperature"][n] = sample[4]
+        b["pressure"][n] = sample[5]
+        self._n = n + 1
+        if self._n == self.block_size:
+            self.flush()
+
+def _encode_channel(bits, fault=None):
+    """[Internal] Encode the float32 bits of a channel in the smallest coding
+
+    :param bits: The float32 bits of the values
+    :type bits: numpy.ndarray (uint64)
+    :param fault: The faulted samples, whose values are coded as the
+        previous value if they are all 0.0
+    :type fault: numpy.ndarray (bool)
+    """
+    flags = 0
+    if fault is not None and fault.any() and not fault.all() and not bits[fault].any():
+        last = np.maximum.accumulate(np.where(fault, 0, np.arange(len(bits))))
+        bits = bits[last]
+        bits[:np.argmin(fault)] = bits[np.argmin(fault)]    # faulted from the start
+        flags = ZERO_ON_FAULT
+    xor = np.concatenate((bits[:1], bits[1:] ^ bits[:-1]))
+    best = _CODING_HDR.pack(XOR | flags) + _pack(xor, trailing=True)
+    if len(bits) == 0:
+        return best
+    values = bits.astype(np.uint32).view(np.float32).astype(np.float64)
+
+    # FIXED: the coarsest power of two step that all values are a multiple of
+    if np.all(np.isfinite(values)) and np.max(np.abs(values)) < 2.0**30:
+        for shift in range(MAX_FIXED_SHIFT + 1):
+            scaled = values*2.0**shift
+            if np.all(scaled == np.floor(scaled)):
+                ints = scaled.astype(np.int64)
+                # -0.0 would come back as 0.0
+                if np.array_equal(_fixed_bits(ints, shift), bits):
+                    diff = np.diff(ints)
+                    coded = (_CODING_HDR.pack(FIXED | flags) + _FIXED_HDR.pack(shift, int(ints[0]))
+                            + _pack((diff << 1) ^ (diff >> 63)))
+                    if len(coded) < len(best):
+                        best = coded
+                break
+
+    # TABLE: worth it when the distinct values are few compared to the samples
+    table, index = np.unique(bits, return_inverse=True)
+    if 4*len(table) < len(best):
+        index = index.astype(np.int64).ravel()
+        diff = np.diff(index, prepend=0)
+        coded = (_CODING_HDR.pack(TABLE | flags) + _TABLE_HDR.pack(len(table))
+                + table.astype('<u4').tobytes() + _pack((diff << 1) ^ (diff >> 63)))
+        if len(coded) < len(best):
+            best = coded
+    return best
+
+def _decode_channel(buf, pos, n, fault=None):
+    """[Internal] Decode a channel written by :py:func:`_encode_channel`
+
+    :param fault: The faulted samples, as passed to the encoder
+    :type fault: numpy.ndarray (bool)
+    :returns: a tuple (float32 bits as uint32, offset after the data)
+    """
+    coding = _CODING_HDR.unpack_from(buf, pos)[0]
+    pos += _CODING_HDR.size
+    flags = coding & ZERO_ON_FAULT
+    coding &= ~ZERO_ON_FAULT
+    if coding == XOR:
+        xor, pos = _unpack(buf, pos, n)
+        bits = np.bitwise_xor.accumulate(xor.astype(np.uint32)) if n else xor.astype(np.uint32)
+    elif coding == FIXED:
+        shift, first = _FIXED_HDR.unpack_from(buf, pos)
+        zz, pos = _unpack(buf, pos + _FIXED_HDR.size, n - 1)
+        diff = (zz >> 1).astype(np.int64) ^ -(zz & 1).astype(np.int64)
+        ints = first + np.concatenate(([0], np.cumsum(diff)))
+        bits = _fixed_bits(ints, shift).astype(np.uint32)
+    elif coding == TABLE:
+        count = _TABLE_HDR.unpack_from(buf, pos)[0]
+        pos += _TABLE_HDR.size
+        table = np.frombuffer(buf, dtype='<u4', count=count, offset=pos)
+        zz, pos = _unpack(buf, pos + 4*count, n)
+        diff = (zz >> 1).astype(np.int64) ^ -(zz & 1).astype(np.int64)
+        bits = table[np.cumsum(diff)]
+    else:
+        raise ValueError("Unknown channel coding {}".format(coding))
+    if flags:
+        bits[fault] = 0
+    return (bits, pos)
+
+def _pack_flags(flags):
+    """[Internal] Bit-pack the changes of an (n, 4) flag array"""
+    nibble = np.packbits(flags, axis=1, bitorder="little")[:,0].astype(np.uint64)
+    return _pack(np.concatenate((nibble[:1], nibble[1:] ^ nibble[:-1])))
+
+def _unpack_flags(buf, pos, n):
+    """[Internal] Read flags written by :py:func:`_pack_flags`
+
+    :returns: a tuple (bool array (n, 4), offset after the data)
+    """
+    xor, pos = _unpack(buf, pos, n)
+    nibble = np.bitwise_xor.accumulate(xor.astype(np.uint8)) if n else xor.astype(np.uint8)
+    flags = np.unpackbits(nibble[:,None], axis=1, count=4, bitorder="little").astype(bool)
+    return (flags, pos)
+
+def _fixed_bits(ints, shift):
+    """[Internal] The float32 bits of integers scaled by 2^-shift"""
+    return (ints*2.0**-shift).astype(np.float32).view(np.uint32).astype(np.uint64)
+
+def _pack(values, trailing=False):
+    """[Internal] Bit-pack unsigned integers with the width of the largest
+
+    :param trailing: Drop the trailing bits that are zero in all values
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    shift = 0
+    if trailing and len(values):
+        nz = values[values != 0]
+        if len(nz):
+            low = int(np.bitwise_or.reduce(nz & (~nz + np.uint64(1))))   # lowest set bits
+            shift = (low & -low).bit_length() - 1
+            values = values >> np.uint64(shift)
+    top = int(values.max()) if len(values) else 0
+    width = top.bit_length()
+    if width == 0:
+        return _PACK_HDR.pack(shift, 0, 0)
+    bits = (values[:,None] >> np.arange(width - 1, -1, -1, dtype=np.uint64)) & np.uint64(1)
+    packed = np.packbits(bits.astype(np.uint8).ravel())
+    return _PACK_HDR.pack(shift, width, len(packed)) + packed.tobytes()
+
+def _unpack(buf, pos, n):
+    """[Internal] Read bit-packed integers
+
+    :returns: a tuple (uint64 array, offset after the data)
+    """
+    shift, width, nbytes = _PACK_HDR.unpack_from(buf, pos)
+    pos += _PACK_HDR.size
+    if width == 0:
+        return (np.zeros(n, dtype=np.uint64), pos)
+    padded = np.zeros(nbytes + 8, dtype=np.uint64)
+    padded[:nbytes] = np.frombuffer(buf, dtype=np.uint8, count=nbytes, offset=pos)
+    # assemble the bytes that hold each value, left-aligned in 64 bits (width <= 57)
+    first = np.arange(n, dtype=np.int64)*width
+    index = first >> 3
+    words = padded[index] << np.uint64(56)
+    for i in range(1, (width + 14)//8):
+        words |= padded[index + i] << np.uint64(56 - 8*i)
+    values = (words << (first & 7).astype(np.uint64)) >> np.uint64(64 - width)
+    return (values << np.uint64(shift), pos + nbytes)
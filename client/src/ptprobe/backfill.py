@@ -0,0 +1,202 @@
+import hashlib
+import json
+import logging
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+from . import archive, recording, sinks
+from .clock import RecordingClock, WRAP
+
+BATCH_SIZE = 5000           # samples per sink write
+RANGE_BYTES = 1 << 22       # a checkpoint is saved after each range of a file
+
+def backfill_file(filename, sink_name, sink_args=(), sink_kwargs=None, write_args=(),
+        checkpoint_dir=".", board_id=None, utc_start=None, batch_size=BATCH_SIZE,
+        range_bytes=RANGE_BYTES):
+    """Write a recording to a sink through its batch path
+
+    The recording (a CSV file of :py:class:`sinks.CsvSampleSink` or an
+    archive of :py:class:`archive.ArchiveSampleSink`) is read in ranges of
+    about ``range_bytes``, and each range is written with
+    :py:meth:`sinks.SampleSink.write_batch` in batches of ``batch_size``
+    samples. After each range, the file offset reached is saved in a
+    checkpoint, so an interrupted backfill resumes after the last range
+    written, and a finished file is not written again. A range that was
+    written but not checkpointed is written again on resume, which database
+    sinks treat as an update (InfluxDB points and SQLite rows are unique by
+    time).
+
+    Samples keep their board timestamps. A sink with a clock is given a
+    :py:class:`clock.RecordingClock` that places the first sample at
+    ``utc_start``; the UTC start is stored in the checkpoint, so a resumed
+    backfill maps the rest of the file the same way.
+
+    :param filename: The recording
+    :type filename: str
+    :param sink_name: The sink type (see :py:func:`sinks.create_sink`)
+    :type sink_name: str
+    :param sink_args: The positional arguments of the sink
+    :type sink_args: tuple
+    :param sink_kwargs: The keyword arguments of the sink
+    :type sink_kwargs: dict
+    :param write_args: The extra arguments of each write, e.g. (com, date)
+        for the table of a :py:class:`sinks.SQLiteSampleSink`
+    :type write_args: tuple
+    :param checkpoint_dir: The directory of the checkpoint files
+    :type checkpoint_dir: str
+    :param board_id: The board ID for sinks that store one, None to keep the default
+    :type board_id: int
+    :param utc_start: The UTC time of the first sample (POSIX s), None for
+        the modification time of the file less the span of its timestamps
+    :type utc_start: float
+    :param batch_size: The number of samples per write
+    :type batch_size: int
+    :param range_bytes: The approximate number of bytes between checkpoints
+    :type range_bytes: int
+    :returns: the number of samples of the file written, including earlier runs
+    """
+    path = _checkpoint_path(checkpoint_dir, filename, sink_name, write_args)
+    state = _load_checkpoint(path)
+    size = os.path.getsize(filename)
+    if state is None or state["offset"] > size:
+        span = _time_span(filename)
+        if span is None:
+            logging.info("Empty: {}".format(filename))
+            return 0
+        first, last = span
+        if utc_start is None:
+            utc_start = os.path.getmtime(filename) - ((last - first) % WRAP)*1e-3
+        state = {"file": os.path.abspath(filename), "offset": 0, "samples": 0,
+                "utc_start": utc_start, "board_start": first}
+    if state["offset"] >= size:
+        logging.info("Done before: {}".format(filename))
+        return state["samples"]
+
+    sink = sinks.create_sink(sink_name, *sink_args, **(sink_kwargs or {}))
+    if hasattr(sink, "clock"):
+        sink.clock = RecordingClock(state["utc_start"], state["board_start"])
+    if board_id is not None and hasattr(sink, "set_board_id"):
+        sink.set_board_id(board_id)
+    sink.open()
+    try:
+        if hasattr(sink, "create"):
+            sink.create(*write_args)    # the table of an SQLiteSampleSink
+        for stop, samples in _ranges(filename, state["offset"], range_bytes):
+            for i in range(0, len(samples), batch_size):
+                sink.write_batch(samples[i:i+batch_size], *write_args)
+            if hasattr(sink, "flush"):
+                sink.flush()            # buffered sinks, e.g. ArchiveSampleSink
+            state["offset"] = stop
+            state["samples"] += len(samples)
+            _save_checkpoint(path, state)
+    finally:
+        sink.close()
+    logging.info("Backfilled: {} ({} samples)".format(filename, state["samples"]))
+    return state["samples"]
+
+def backfill(filenames, sink_name, sink_args=(), sink_kwargs=None, write_args=(),
+        checkpoint_dir=".", board_id=None, utc_start=None, processes=None,
+        batch_size=BATCH_SIZE, range_bytes=RANGE_BYTES):
+    """Write recordings to a sink, one file per worker process
+
+    Each worker creates and opens its own sink (see :py:func:`backfill_file`
+    for the arguments), so the sink arguments must be picklable. Workers
+    writing to one SQLite file take turns, each batch in one transaction
+    (see :py:class:`sinks.SQLiteSampleSink`).
+
+    :param filenames: The recordings
+    :type filenames: list
+    :param processes: The number of worker processes, None for the CPU count
+    :type processes: int
+    :returns: a map of file names to the number of samples written
+    """
+    tasks = [(f, sink_name, tuple(sink_args), sink_kwargs, tuple(write_args), checkpoint_dir,
+            board_id, utc_start, batch_size, range_bytes) for f in filenames]
+    with Pool(processes) as pool:
+        counts = pool.starmap(backfill_file, tasks)
+    return dict(zip(filenames, counts))
+
+def to_samples(timestamp, active_T, fault_T, temperature, ref_temperature, pressure):
+    """Convert sample arrays to a list of samples as written to sinks
+
+    :param timestamp: The board timestamps (ms), shape (n,)
+    :type timestamp: numpy.ndarray
+    :param active_T: The thermocouple active flags, shape (n, 4); the other
+        arrays likewise
+    :type active_T: numpy.ndarray
+    :returns: a list of [timestamp, active_T, fault_T, temperature,
+        ref_temperature, pressure] samples
+    """
+    return [list(s) for s in zip(timestamp.tolist(), active_T.tolist(), fault_T.tolist(),
+            temperature.tolist(), ref_temperature.tolist(), pressure.tolist())]
+
+def _is_archive(filename):
+    """[Internal] True if a file is an archive rather than a CSV recording"""
+    with open(filename, "rb") as hf:
+        return hf.read(len(archive.MAGIC)) in (archive.MAGIC, archive.MAGIC_V1)
+
+def _time_span(filename):
+    """[Internal] The first and last board timestamps of a recording, None if empty"""
+    if _is_archive(filename):
+        t = [b["timestamp"] for b in archive.iter_archive(filename)]
+        t = np.concatenate(t) if t else np.zeros(0)
+    else:
+        size = os.path.getsize(filename)
+        head = next(recording.iter_csv(filename, columns=["Time"], chunk_bytes=1 << 16,
+                stop=min(size, 1 << 16)), {"Time": np.zeros(0)})["Time"]
+        tail = list(recording.iter_csv(filename, columns=["Time"], start=max(0, size - (1 << 12))))
+        t = np.concatenate([head] + [c["Time"] for c in tail])
+    if len(t) == 0:
+        return None
+    return (int(t[0]), int(t[-1]))
+
+def _ranges(filename, offset, range_bytes):
+    """[Internal] Read a recording from an offset
+
+    :returns: a generator of (offset after the range, samples)
+    """
+    if _is_archive(filename):
+        for block, offset in archive.iter_blocks(filename, offset):
+            yield (offset, to_samples(*[block[k] for k in
+                    ("timestamp", "active_T", "fault_T", "temperature", "ref_temperature", "pressure")]))
+        return
+    size = os.path.getsize(filename)
+    while offset < size:
+        stop = min(size, offset + range_bytes)
+        chunks = list(recording.iter_csv(filename, chunk_bytes=range_bytes + 1, start=offset, stop=stop))
+        samples = []
+        for c in chunks:
+            if "Time" not in c:
+                raise ValueError("Not a PT Probe recording: {}".format(filename))
+            samples.extend(to_samples(c["Time"],
+                    *[np.column_stack([c["CH_{} {}".format(ich, name)] for ich in range(4)])
+                    for name in ("Active T", "Error Code", "Temp", "Ref Temp", "Pressure")]))
+        yield (stop, samples)
+        offset = stop
+
+def _checkpoint_path(checkpoint_dir, filename, sink_name, write_args):
+    """[Internal] The checkpoint file of a recording and destination"""
+    key = json.dumps([os.path.abspath(filename), sink_name, [str(a) for a in write_args]])
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).hexdigest()
+    return os.path.join(checkpoint_dir, "{}.{}.json".format(os.path.basename(filename), digest))
+
+def _load_checkpoint(path):
+    """[Internal] Read a checkpoint, None if there is none"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as hf:
+            return json.load(hf)
+    except (ValueError, OSError) as e:
+        logging.warning("Ignoring checkpoint {}: {}".format(path, e))
+        return None
+
+def _save_checkpoint(path, state):
+    """[Internal] Write a checkpoint atomically"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = "{}.tmp".format(path)
+    with open(tmp, "w") as hf:
+        json.dump(state, hf, indent=2, sort_keys=True)
+    os.replace(tmp, path)
@@ -1,5 +1,22 @@
+import logging
 import serial
 import struct
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from .gaps import GapIndex
+from .metadata import MetadataCache
+from .metrics import AcquisitionMetrics
+
+_U16 = struct.Struct('>H')
+_U32 = struct.Struct('>I')
+_F32 = struct.Struct('>f')
+_NBITS = [bin(i).count("1") for i in range(16)]
+
+# the fields of a sample, in order (see :py:meth:`Controller.collect_samples`)
+SAMPLE_FIELDS = ("timestamp", "active_T", "fault_T", "temperature", "ref_temperature", "pressure")
 
 class BadHeader(Exception):
     """An error in the packet header"""
@@ -9,8 +26,26 @@ class BadPacket(Exception):
     """A packet has a formatting error"""
     pass
 
+class BoardTimeout(Exception):
+    """The board did not respond within the serial timeout"""
+    pass
+
 class Controller:
-    """A board controller for the PT Probe board using serial communication"""
+    """A board controller for the PT Probe board using serial communication
+
+    While :py:meth:`collect_samples` is running, the collection thread is the
+    only reader of the port. Requests from other threads (one-shot values,
+    status, board ID, configuration) are written to the running stream and
+    their responses are routed back from the collection loop, so health
+    checks do not interrupt the acquisition.
+
+    The collection loop reads with a short timeout (:py:attr:`read_timeout`),
+    so :py:meth:`stop_collection` takes effect within a few tens of
+    milliseconds even if the board is silent. A watchdog raises
+    :py:class:`BoardTimeout`, or reopens the port if :py:attr:`reconnect` is
+    set, when no data arrives for :py:attr:`watchdog_intervals` sample
+    intervals.
+    """
 
     class PacketType:
         """Packet types in the upper two bits of the header byte"""
@@ -19,9 +54,16 @@ class Controller:
         RESP = 0b10
         HALT = 0b11
 
+    class FrameFlags:
+        """Streaming frame format flags (see :py:meth:`set_frame_format`)"""
+        FULL     = 0x00
+        COMPACT  = 0x01
+        DELTA_TS = 0x02
+        RAW_P    = 0x04
+
     class ResponseType:
         """The type of response in RESP packet stored in bits 3-5 of the header byte"""
-        RSVD     = 0b000
+        FMT      = 0b000
         ID       = 0b001
         T        = 0b010
         P        = 0b011
@@ -30,7 +72,8 @@ class Controller:
         STATUS_T = 0b110
         STATUS_P = 0b111
 
-    def __init__(self, port, baudrate=115200, sinks=[]):
+    def __init__(self, port, baudrate=115200, sinks=None, clock=None, tracer=None,
+            metadata_ttl=300.0, metadata_path=None):
         """Construct a Controller with a specified port
 
         :param port: The serial port
@@ -38,26 +81,85 @@ class Controller:
         :param baudrate: The baudrate for the serial connection 
             (default 115200 specified in firmware)
         :type baudrate: int
+        :param sinks: The sinks written by :py:meth:`collect_samples`
+        :type sinks: list
+        :param clock: An optional :py:class:`clock.ClockModel`, updated with
+            the arrival time of each sample during collection
+        :param tracer: An optional :py:class:`tracing.ChromeTracer` recording
+            the time spent in each stage of the collection loop
+        :param metadata_ttl: The time (s) for which board metadata returned by
+            :py:meth:`board_info` is reused before asking the board again
+        :type metadata_ttl: float
+        :param metadata_path: An optional JSON file to persist the metadata
+            cache across restarts
+        :type metadata_path: str
         """
         self.comm = serial.Serial()
         self.comm.port = port
         self.comm.baudrate = baudrate
         self.user_halt = False
-        self.sinks = sinks
+        self.sinks = sinks if sinks is not None else []
+        self.clock = clock
+        self.tracer = tracer
+        self.metrics = AcquisitionMetrics(labels={"port": port})
+        self.gaps = GapIndex()
+        self.sample_interval_ms = 0
+        self.metadata = MetadataCache(ttl=metadata_ttl, path=metadata_path)
+        self.response_timeout = 2.0
+        self.read_timeout = 0.02
+        self.halt_timeout = 0.2
+        self.watchdog_intervals = 10
+        self.watchdog_min = 2.0
+        self.reconnect = False
+        self._wake = threading.Event()
+        self._mux_lock = threading.Lock()
+        self._pending = deque()
+        self._streaming = False
     
     def board_id(self):
         """Get the ID of the connected board
 
         :returns: integer board ID
         """
-        with self.comm as ser:
-            ser.write(bytes('AB\n','utf-8'))    # ask board ID
-            hdr = ser.read(size=1)
-            err_bit = self._validate_resp_hdr(hdr, 0, self.ResponseType.ID)
-            if not err_bit:
-                return struct.unpack('>I',ser.read(size=4))[0]
+        hdr, body = self._transact(bytes('AB\n','utf-8'), 0, self.ResponseType.ID)
+        if not hdr[0] & 0x01:
+            board_id = struct.unpack('>I',body)[0]
+            self.metadata.put("board_id", board_id)
+            return board_id
         return 0
 
+    def board_info(self, refresh=False):
+        """Get the board ID and the status of all sensors, using cached values
+
+        Values are reused until the cache time-to-live expires or the board
+        configuration is changed through this controller. Values persisted
+        in the metadata file are only used for the same board: the one with
+        the USB serial number of the port, or else with the board ID.
+
+        :param refresh: Ask the board for all values, ignoring the cache
+        :type refresh: bool
+        :returns: a map with
+            - 'board_id': the integer board ID
+            - 'P': list of pressure sensor status maps by channel
+              (see :py:meth:`sensor_status_P`)
+            - 'T': list of thermocouple status maps by channel
+              (see :py:meth:`sensor_status_T`)
+        """
+        with self.metadata.batch():
+            if refresh:
+                self.metadata.invalidate()
+            if self.metadata.path is not None and self.metadata.identity is None:
+                self.metadata.bind(self._board_identity())
+            info = {"board_id": self.metadata.get("board_id"), "P": [], "T": []}
+            if info["board_id"] is None:
+                info["board_id"] = self.board_id()
+            for ich in range(4):
+                status = self.metadata.get("P{}".format(ich))
+                info["P"].append(status if status is not None else self.sensor_status_P(ich))
+                status = self.metadata.get("T{}".format(ich))
+                info["T"].append(status if status is not None else self.sensor_status_T(ich))
+        return info
+
     def temperature(self, ch):
         """Request a one-shot temperature sample on the specified channel
 
@@ -107,20 +209,15 @@ class Controller:
             - 'address': 8-byte ROM address
         """
         status = {"channel":-1, "fault":0, "address":b'\x00'*8}
-        with self.comm as ser:
-            ser.write(bytes("AST{}\n".format(ch),"utf-8"))
-            hdr = ser.read(size=1)
-            err_bit = self._validate_resp_hdr(hdr, ch, self.ResponseType.STATUS_T)
-
-            if err_bit:
-                body = ser.read(size=1)
-                if struct.unpack('>B',body)[0] != 0xFF:
-                    raise BadPacket("Temperature status packet with error bit set contains bad body value")
-            else:
-                body = ser.read(size=10)
-                status["channel"] = body[0]
-                status["fault"] = body[1]
-                status["address"] = body[2:]
+        hdr, body = self._transact(bytes("AST{}\n".format(ch),"utf-8"), ch, self.ResponseType.STATUS_T)
+        if hdr[0] & 0x01:
+            if struct.unpack('>B',body)[0] != 0xFF:
+                raise BadPacket("Temperature status packet with error bit set contains bad body value")
+        else:
+            status["channel"] = body[0]
+            status["fault"] = body[1]
+            status["address"] = body[2:]
+        self.metadata.put("T{}".format(ch), status)
         return status
 
     def sensor_status_P(self, ch):
@@ -134,30 +231,132 @@ class Controller:
                 P = a0 + a1*x + a2*x^2 where x is the raw ADC value.
         """
         status = {"channel":-1, "ai":[0,0,0]}
-        with self.comm as ser:
-            ser.write(bytes("ASP{}\n".format(ch),"utf-8"))
-            hdr = ser.read(size=1)
-            err_bit = self._validate_resp_hdr(hdr, ch, self.ResponseType.STATUS_P)
-
-            if err_bit:
-                raise BadHeader("Unexpected error bit set in pressure status packet")
-            else:
-                status["channel"]=ser.read(size=1)[0]
-                body = ser.read(size=12)
-                status["ai"] = [struct.unpack('>f',body[4*i:4*(i+1)])[0] for i in range(3)]
+        hdr, body = self._transact(bytes("ASP{}\n".format(ch),"utf-8"), ch, self.ResponseType.STATUS_P)
+        if hdr[0] & 0x01:
+            raise BadHeader("Unexpected error bit set in pressure status packet")
+        status["channel"] = body[0]
+        status["ai"] = [struct.unpack('>f',body[1+4*i:1+4*(i+1)])[0] for i in range(3)]
+        self.metadata.put("P{}".format(ch), status)
         return status
 
+    def set_frame_format(self, compact=True, delta_timestamp=True,
+            T_channels=(0,1,2,3), P_channels=(0,1,2,3), interval_ms=0, raw_pressure=False):
+        """Select the frame format and sample interval for data streaming
+
+        Compact frames only carry the selected channels that are active and 
+        can send the timestamp as a 16 bit delta, which reduces the frame from
+        56 bytes to as little as 9 bytes (one pressure channel). Without any 
+        selected temperature channel the board skips the thermocouple 
+        conversion, which allows sample rates well above 5Hz. Samples 
+        collected in compact mode have the same layout as full samples, with 
+        unselected channels reported as inactive (zero).
+
+        In raw pressure mode, the pressure of each sample is the raw ADC
+        value (0-1) instead of the pressure converted on the board, so the
+        polynomial can be applied, and later changed, on the host (see
+        :py:mod:`calibration`).
+
+        The format is kept by the board until it is changed or the board is 
+        reset. It cannot be changed during a collection. Requires firmware 
+        0.9 or later, raw pressure mode firmware 0.10 or later.
+
+        :param compact: Send compact frames (False for the full frame)
+        :type compact: bool
+        :param delta_timestamp: Send the timestamp as a delta to the previous 
+            sample (compact frames only)
+        :type delta_timestamp: bool
+        :param T_channels: The thermocouple channels to send (compact only)
+        :type T_channels: list
+        :param P_channels: The pressure channels to send (compact only)
+        :type P_channels: list
+        :param interval_ms: The minimum time between samples (ms), 0 to 
+            sample as fast as possible
+        :type interval_ms: int
+        :param raw_pressure: Send the raw ADC values in place of the pressures
+        :type raw_pressure: bool
+        :raises RuntimeError: if a collection is running
+        :returns: the format reported by the board as a map with 'compact', 
+            'delta_timestamp', 'T_channels', 'P_channels', 'interval_ms' and
+            'raw_pressure', or None if the board did not answer (older
+            firmware always sends full frames)
+        """
+        if self._streaming:
+            raise RuntimeError("The frame format cannot be changed during collection")
+        flags = self.FrameFlags.FULL
+        if compact:
+            flags |= self.FrameFlags.COMPACT
+            if delta_timestamp:
+                flags |= self.FrameFlags.DELTA_TS
+        if raw_pressure:
+            flags |= self.FrameFlags.RAW_P
+        mask = 0
+        for ch in T_channels:
+            mask |= 1 << (self._validate_ch(ch) + 4)
+        for ch in P_channels:
+            mask |= 1 << self._validate_ch(ch)
+        interval_ms = int(interval_ms)
+        if interval_ms < 0 or interval_ms > 0xFFFF:
+            raise ValueError("Sample interval out of range (0-65535 ms)")
+
+        msg = bytes("F","utf-8") + struct.pack('<BBH', flags, mask, interval_ms)
+        timeout = self.comm.timeout
+        if timeout is None:     # older firmware does not answer
+            self.comm.timeout = self.response_timeout
+        try:
+            hdr, body = self._transact(msg, 0, self.ResponseType.FMT)
+        except BoardTimeout:
+            logging.warning("No frame format response, the board sends full frames")
+            return None
+        finally:
+            self.comm.timeout = timeout
+        flags, mask, interval_ms = struct.unpack('>BBH', body)
+        self.sample_interval_ms = interval_ms
+        return {
+            "compact": bool(flags & self.FrameFlags.COMPACT),
+            "delta_timestamp": bool(flags & self.FrameFlags.DELTA_TS),
+            "T_channels": [ich for ich in range(4) if mask & (1 << (ich+4))],
+            "P_channels": [ich for ich in range(4) if mask & (1 << ich)],
+            "interval_ms": interval_ms,
+            "raw_pressure": bool(flags & self.FrameFlags.RAW_P),
+        }
+
     def stop_collection(self):
-        """Request a stop of the collection of samples."""
+        """Request a stop of the collection of samples.
+
+        A blocked read is interrupted, so the collection stops sending samples
+        to the sinks within about one :py:attr:`read_timeout`. It then waits
+        up to :py:attr:`halt_timeout` for the HALT packet from the board.
+        """
         self.user_halt = True
+        self._wake.set()
+        if self._streaming:
+            try:
+                self.comm.cancel_read()
+            except (AttributeError, serial.SerialException, OSError):
+                pass    # not supported, the read timeout applies
 
     # def collect_samples(self, max_samples=0):
-    def collect_samples(self, max_samples=0, port=False, queue=False):
+    def collect_samples(self, max_samples=0, port=False, queue=False, frame_format=None,
+            resync=True, reuse_records=False):
         """Start the free-running collection of temperature and pressure samples
 
         :param max_samples: The maximum number of samples to collect. Set to zero
             for free-running collection. The sample rate for the board is approximately 5Hz.
         :type max_samples: int
+        :param frame_format: Optional keyword arguments for 
+            :py:meth:`set_frame_format`, applied before the collection starts.
+            Full and compact frames are both decoded regardless of this setting.
+        :type frame_format: dict
+        :param resync: Skip corrupted or unexpected bytes (line noise, debug 
+            text) and continue with the next valid frame. Skipped bytes are 
+            counted in :py:attr:`metrics`. If False, a bad frame raises 
+            :py:class:`BadHeader` or :py:class:`BadPacket`.
+        :type resync: bool
+        :param reuse_records: Decode every sample into the same list, which 
+            avoids allocations in the collection loop. Only for sinks that do
+            not keep a reference to the sample after ``write`` returns (not
+            :py:class:`sinks.ListSampleSink`, nor a queue).
+        :type reuse_records: bool
 
         The sample data is stored as a list. Each sample is composed of
             - a timestamp (ms)
@@ -169,64 +368,330 @@ class Controller:
         
         Collected samples are written to the sink(s).
         """
-        sample_count = 0
-        with self.comm as ser:
-            msg = bytes("R","utf-8")+ struct.pack('<I',max_samples)
-            ser.write(msg)
-            while not (self.user_halt 
-                    or (max_samples > 0 and sample_count >= max_samples)):
-
-                hdr = ser.read(size=1)
-                if (hdr[0] & 0xC0) >> 6 == self.PacketType.DATA:
-                    if hdr[0] & 0x3F != 55: # byte count
-                        raise BadHeader("Unexpected byte count (data): 0x{:x}".format(hdr[0]))
-                elif (hdr[0] & 0xC0) >> 6 == self.PacketType.HALT:
-                    sample_count = struct.unpack('>I',ser.read(size=4))[0]
+        metrics = self.metrics
+        sink_keys = ["{}:{}".format(i, type(sink).__name__) for i, sink in enumerate(self.sinks)]
+        tracer = self.tracer
+        with self._stream(max_samples, frame_format) as ser:
+            records = self._records(ser, max_samples, resync, reuse_records)
+            while True:
+                try:
+                    record, traced = next(records)
+                except StopIteration as e:
+                    sample_count = e.value
                     break
-                else:
-                    raise BadHeader("Unexpected header type (data): 0x{:x}".format(hdr[0]))
-                
-                sample_count += 1
-                timestamp = struct.unpack('>I',ser.read(size=4))[0]
-
-                active_T = [False]*4
-                fault_T = [0]*4
-                temperature = [0]*4
-                ref_temperature = [0]*4
-                pressure = [0]*4
-
-                t_hdr = ser.read(size=1)
-                for ich in range(4):
-                    val = ser.read(size=4)
-                    if t_hdr[0] & (1 << (ich+4)):   # active
-                        active_T[ich] = True
-                        if t_hdr[0] & (1 << ich):   # error bit
-                            fault_T[ich] = struct.unpack('>I',val)[0]
-                        else: 
-                            temperature[ich] = struct.unpack('>f',val)[0]
-                
-                p_hdr = ser.read(size=1)
-                for ich in range(4):
-                    val = ser.read(size=4)
-                    if p_hdr[0] & (1 << (ich+4)):   # active
-                        pressure[ich] = struct.unpack('>f',val)[0]
-
-                tr_hdr = ser.read(size=1)
-                for ich in range(4):
-                    val = ser.read(size=4)
-                    if tr_hdr[0] & (1 << (ich+4)):   # active
-                        ref_temperature[ich] = struct.unpack('>f',val)[0]
-                
-                for sink in self.sinks:
+
+                t_decoded = time.perf_counter()
+                for key, sink in zip(sink_keys, self.sinks):
                     # sink.write([timestamp, active_T, fault_T, temperature, ref_temperature, pressure])
-                    sink.write([timestamp, active_T, fault_T, temperature, ref_temperature, pressure], port, queue)
-        
-            if self.user_halt:
-                ser.write(bytes("H","utf-8"))
+                    sink.write(record, port, queue)
+                    t_written = time.perf_counter()
+                    metrics.sink_write(key, t_written - t_decoded)
+                    if traced:
+                        tracer.span("sink " + key, t_decoded, t_written)
+                    t_decoded = t_written
+                metrics.maybe_snapshot(t_decoded)
+
+        for sink in self.sinks:
+            sink.write_gaps(self.gaps)
+        return sample_count
+
+    def iter_samples(self, max_samples=0, frame_format=None, resync=True):
+        """Generate samples as they arrive from the board
+
+        The board streams while the generator is running. Closing the 
+        generator, e.g. by leaving a ``for`` loop early, halts the board.
+        Samples are read only as fast as they are consumed: a consumer that
+        falls behind for long overflows the serial buffers, which shows as
+        dropped samples in :py:attr:`metrics`. Requests from other threads
+        (e.g. :py:meth:`board_id`) are answered while the generator is 
+        consumed; the consuming thread itself must not make requests.
+
+        :param max_samples: The maximum number of samples (0 for no limit)
+        :type max_samples: int
+        :param frame_format: Optional keyword arguments for 
+            :py:meth:`set_frame_format`
+        :type frame_format: dict
+        :param resync: Skip corrupted bytes (see :py:meth:`collect_samples`)
+        :type resync: bool
+        :returns: a generator of samples, each a new list in the layout of
+            :py:meth:`collect_samples`
+        """
+        with self._stream(max_samples, frame_format) as ser:
+            records = self._records(ser, max_samples, resync, False)
+            try:
+                for record, traced in records:
+                    yield record
+            finally:
+                self._drain(records)
+
+    def iter_batches(self, size=100, max_latency_ms=None, max_samples=0, 
+            frame_format=None, resync=True):
+        """Generate NumPy arrays of samples as they arrive from the board
+
+        A batch is complete when it holds ``size`` samples or when its first
+        sample is older than ``max_latency_ms``. The last batch may be 
+        shorter. As with :py:meth:`iter_samples`, closing the generator 
+        halts the board. Requires NumPy.
+
+        :param size: The maximum number of samples in a batch
+        :type size: int
+        :param max_latency_ms: The maximum age of a sample before its batch 
+            is passed on (ms), None to wait for full batches
+        :type max_latency_ms: float
+        :param max_samples: The maximum number of samples (0 for no limit)
+        :type max_samples: int
+        :param frame_format: Optional keyword arguments for 
+            :py:meth:`set_frame_format`
+        :type frame_format: dict
+        :param resync: Skip corrupted bytes (see :py:meth:`collect_samples`)
+        :type resync: bool
+        :returns: a generator of maps with the arrays 'timestamp' (n,), 
+            'active_T', 'fault_T', 'temperature', 'ref_temperature' and 
+            'pressure' (n, 4)
+        """
+        import numpy as np
+        max_latency = None if max_latency_ms is None else max_latency_ms/1000.0
+        with self._stream(max_samples, frame_format) as ser:
+            records = self._records(ser, max_samples, resync, True, 
+                    ticks=max_latency is not None)
+            try:
+                batch = None
+                n = 0
+                for record, traced in records:
+                    if record is not None:
+                        if batch is None:
+                            batch = _new_batch(np, size)
+                            n = 0
+                            t_first = time.monotonic()
+                        for field, val in zip(SAMPLE_FIELDS, record):
+                            batch[field][n] = val
+                        n += 1
+                    if batch is not None and (n == size or (max_latency is not None 
+                            and time.monotonic() - t_first >= max_latency)):
+                        yield {field: arr[:n] for field, arr in batch.items()}
+                        batch = None
+                if batch is not None:
+                    yield {field: arr[:n] for field, arr in batch.items()}
+            finally:
+                self._drain(records)
+
+    @contextmanager
+    def _stream(self, max_samples, frame_format):
+        """[Internal] Open the port and start streaming for the duration of the context"""
+        if frame_format is not None:
+            self.set_frame_format(**frame_format)
+        self._wake.clear()
+        timeout = self.comm.timeout
+        self.comm.timeout = self.read_timeout
+        try:
+            with self.comm as ser:
+                msg = bytes("R","utf-8")+ struct.pack('<I',max_samples)
+                ser.write(msg)
+                with self._mux_lock:
+                    self._streaming = True
+                yield ser
+        finally:
+            self.comm.timeout = timeout
+            with self._mux_lock:
+                self._streaming = False
                 self.user_halt = False
+                while self._pending:
+                    self._pending.popleft().fail(BoardTimeout("Collection ended before response"))
 
+    def _drain(self, records):
+        """[Internal] Halt a stream that was left before its end and wait for the HALT packet"""
+        self.user_halt = True
+        try:
+            for _ in records:
+                pass
+        except (BoardTimeout, BadHeader, BadPacket, serial.SerialException, OSError) as e:
+            logging.debug("Error while halting {}: {}".format(self.comm.port, e))
+
+    def _records(self, ser, max_samples, resync, reuse_records, ticks=False):
+        """[Internal] The collection loop: read, validate and decode frames
+
+        Responses to requests from other threads are routed on the way. 
+        Once a stop is requested, the board is halted and no more samples 
+        are generated.
+
+        :param ticks: Also generate (None, False) when a read times out
+        :type ticks: bool
+        :returns: a generator of (sample, traced) tuples, where traced is True
+            if the sample is recorded by the tracer. The generator returns 
+            the sample count (reported by the board if it was halted).
+        """
+        sample_count = 0
+        run_max = max_samples     # the count at which the board halts itself
+        metrics = self.metrics
+        metrics.start_run()
+        gaps = self.gaps
+        gaps.reset(self.sample_interval_ms)
+        tracer = self.tracer
+        traced = False
+        record = [0, [False]*4, [0]*4, [0]*4, [0]*4, [0]*4]
+        reader = FrameReader(ser, self._resp_body_len, resync, 
+                resp_pending=lambda: bool(self._pending), metrics=metrics,
+                idle=lambda: self._idle(reader),
+                halt_expected=lambda count: reader.deadline is not None or count == run_max)
+        reader.ticks = ticks
+        if tracer is not None:
+            reader.timed = True
+            tracer.name_thread(str(self.comm.port))
+        while True:
+            if self.user_halt and reader.deadline is None:
+                # stop delivering samples, wait for the HALT packet
+                self._send(bytes("H","utf-8"))
+                reader.deadline = time.monotonic() + self.halt_timeout
+            if reader.deadline is not None:
+                if time.monotonic() >= reader.deadline:
+                    break
+            elif max_samples > 0 and sample_count >= max_samples:
+                break
+
+            if tracer is not None:
+                traced = tracer.sample()
+                t_wait = time.perf_counter()
+            try:
+                hdr, pos, nbody, timestamp = reader.next_frame()
+            except ReadInterrupted:
+                if ticks and reader.deadline is None:
+                    yield (None, False)
+                continue
+            except BoardTimeout:
+                if not self.reconnect or reader.deadline is not None:
+                    raise
+                run_max = max_samples - sample_count if max_samples > 0 else 0
+                self._reopen(ser, run_max)
+                reader.restart()
+                gaps.restart()
+                metrics.reconnects += 1
+                continue
+            t_arrival = time.perf_counter()
+            if (hdr & 0xC0) >> 6 == self.PacketType.HALT:
+                sample_count = _U32.unpack_from(reader.buf, pos)[0]
+                metrics.halt_frame(sample_count, 5)
+                gaps.halt(sample_count)
+                break
+            elif (hdr & 0xC0) >> 6 == self.PacketType.RESP:
+                metrics.bytes_read += 1 + nbody
+                metrics.frames_decoded += 1
+                self._route_resp(bytes([hdr]), bytes(reader.view[pos:pos+nbody]))
+                continue
+            
+            gaps.observe(timestamp)
+            if reader.deadline is not None:
+                metrics.data_frame(t_arrival, 1 + nbody)  # sent before the halt
+                continue
+            sample_count += 1
+            metrics.data_frame(t_arrival, 1 + nbody)
+            if traced:
+                # the frame is read, then its header and body are checked
+                tracer.span("read_wait", t_wait, reader.t_read)
+                tracer.span("header", reader.t_read, t_arrival)
+            if not reuse_records:
+                record = [0, [False]*4, [0]*4, [0]*4, [0]*4, [0]*4]
+            record[0] = timestamp
+            if nbody == 55:
+                self._decode_full(reader.buf, pos, record)
+            else:
+                self._decode_compact(reader.buf, pos, record)
+            if self.clock is not None:
+                self.clock.update(timestamp)
+
+            t_decoded = time.perf_counter()
+            metrics.decode.add((t_decoded - t_arrival)*1e6)
+            if traced:
+                tracer.span("decode", t_arrival, t_decoded, timestamp=timestamp)
+            yield (record, traced)
+    
         return sample_count
 
+    def _idle(self, reader):
+        """[Internal] Check for a stop or a silent board when a read returns no data
+
+        :raises ReadInterrupted: if a stop was requested, the halt wait expired,
+            or the reader generates ticks
+        :raises BoardTimeout: if the board has been silent for too long
+        """
+        now = time.monotonic()
+        if self.user_halt and reader.deadline is None:
+            raise ReadInterrupted()
+        if reader.deadline is not None:
+            if now >= reader.deadline:
+                raise ReadInterrupted()
+            return
+        if self.watchdog_intervals:
+            interval = self.metrics.interarrival.mean*1e-6 if self.metrics.interarrival.n else 0.2
+            limit = max(self.watchdog_min, self.watchdog_intervals*interval)
+            if now - reader.t_last_rx > limit:
+                raise BoardTimeout("No data from board on {} for {:.1f}s".format(
+                        self.comm.port, now - reader.t_last_rx))
+        if reader.ticks:
+            raise ReadInterrupted()
+
+    def _reopen(self, ser, max_samples):
+        """[Internal] Reopen the port and restart streaming after a silent period
+
+        The board may still be streaming (e.g. only the USB link stalled),
+        and it ignores a start command while it streams, so it is halted
+        and its remaining output discarded before streaming is restarted.
+        Requests still waiting for a response fail.
+
+        :param max_samples: The number of samples still to collect (0=no limit)
+        :type max_samples: int
+        """
+        logging.warning("No data from board on {}, reconnecting".format(ser.port))
+        while not self.user_halt:
+            with self._mux_lock:
+                try:
+                    ser.close()
+                    ser.open()
+                    ser.write(bytes("H","utf-8"))
+                    self._discard_input(ser)
+                    while self._pending:
+                        self._pending.popleft().fail(BoardTimeout("Port reopened before response"))
+                    ser.write(bytes("R","utf-8")+ struct.pack('<I',max_samples))
+                    return
+                except (serial.SerialException, OSError) as e:
+                    logging.debug("Reconnect to {} failed: {}".format(ser.port, e))
+            self._wake.wait(1.0)
+
+    def _discard_input(self, ser):
+        """[Internal] Read and drop input until the board is quiet for the halt timeout"""
+        t_end = time.monotonic() + self.response_timeout
+        t_quiet = time.monotonic() + self.halt_timeout
+        while time.monotonic() < min(t_quiet, t_end):
+            if ser.read(max(1, ser.in_waiting)):
+                t_quiet = time.monotonic() + self.halt_timeout
+
+    def sample_count(self):
+        """The number of samples received by this controller"""
+        return self.metrics.samples
+
+    def dropped_count(self):
+        """The number of samples sent by the board but not received"""
+        return self.metrics.dropped
+
+    def T_N(self):
+        """The number of sample inter-arrival intervals measured"""
+        return self.metrics.interarrival.n
+
+    def T_mean(self):
+        """The mean sample inter-arrival time (us)"""
+        return self.metrics.interarrival.mean
+
+    def T_variance(self):
+        """The variance of the sample inter-arrival time (us^2)"""
+        return self.metrics.interarrival.variance
+
+    def T_min(self):
+        """The minimum sample inter-arrival time (us)"""
+        return self.metrics.interarrival.min
+
+    def T_max(self):
+        """The maximum sample inter-arrival time (us)"""
+        return self.metrics.interarrival.max
+
     def set_debug_level(self, lvl):
         """Set the board debug level.
 
@@ -239,9 +704,7 @@ class Controller:
         ilvl = int(lvl)
         if ilvl < 0 or ilvl > 2:
             raise ValueError("Debug level out of range")
-        with self.comm as ser:
-            msg = bytes("CD",'utf-8')+struct.pack('<b',ilvl)
-            ser.write(msg)
+        self._send(bytes("CD",'utf-8')+struct.pack('<b',ilvl))
 
     def set_P_poly_coeffs(self, ch, ai):
         """Set the polynomial coefficients for the pressure conversion on a channel
@@ -261,10 +724,11 @@ class Controller:
         ich = self._validate_ch(ch)
         if len(ai) > 3:
             raise ValueError("Polynomial coefficient array size exceeded")
-        with self.comm as ser:
-            for ii, a in enumerate(ai):
-                msg = bytes("CP","utf-8")+bytearray([ich,ii])+struct.pack('<f',a)
-                ser.write(msg)
+        self.metadata.invalidate("P{}".format(ich))
+        msg = bytearray()
+        for ii, a in enumerate(ai):
+            msg += bytes("CP","utf-8")+bytearray([ich,ii])+struct.pack('<f',a)
+        self._send(bytes(msg))
     
     def set_board_id(self, board_id):
         """Set the board identifier
@@ -276,9 +740,48 @@ class Controller:
             Use the :py:meth:`store_board_config` method to save the board ID
             to Flash storage such that it will persist if the board is reset.
         """
-        with self.comm as ser:
-            msg = bytes("CB","utf-8")+struct.pack('<I',board_id)
-            ser.write(msg)
+        self._unbind_board_id()
+        self.metadata.invalidate("board_id")
+        self._send(bytes("CB","utf-8")+struct.pack('<I',board_id))
+
+    def configure(self, board_id=None, P_coeffs=None, debug_level=None):
+        """Send several configuration commands to the board in one write
+
+        :param board_id: The integer board ID (unchanged if None)
+        :type board_id: int
+        :param P_coeffs: The pressure polynomial coefficients [a0, a1, a2]
+            keyed by channel ID (unchanged if None)
+        :type P_coeffs: dict
+        :param debug_level: The debug level (unchanged if None)
+        :type debug_level: int
+
+        .. note::
+            Use the :py:meth:`store_board_config` method to save the
+            configuration to Flash storage.
+        """
+        msg = bytearray()
+        if board_id is not None:
+            msg += bytes("CB","utf-8")+struct.pack('<I',board_id)
+        for ch, ai in (P_coeffs or {}).items():
+            ich = self._validate_ch(ch)
+            if len(ai) > 3:
+                raise ValueError("Polynomial coefficient array size exceeded")
+            for ii, a in enumerate(ai):
+                msg += bytes("CP","utf-8")+bytearray([ich,ii])+struct.pack('<f',a)
+        if debug_level is not None:
+            ilvl = int(debug_level)
+            if ilvl < 0 or ilvl > 2:
+                raise ValueError("Debug level out of range")
+            msg += bytes("CD",'utf-8')+struct.pack('<b',ilvl)
+
+        with self.metadata.batch():
+            if board_id is not None:
+                self.metadata.invalidate("board_id")
+                self._unbind_board_id()
+            for ch in (P_coeffs or {}):
+                self.metadata.invalidate("P{}".format(int(ch)))
+        if msg:
+            self._send(bytes(msg))
 
     def store_board_config(self, confirm):
         """Store the current configuration (board ID, debug level, polynomial coefficients) to Flash
@@ -293,13 +796,32 @@ class Controller:
         """
         if not confirm:
             raise ValueError("Confirmation must be supplied to write board config to flash")
-        with self.comm as ser:
-            ser.write(bytes("CW","utf-8"))
+        self.metadata.invalidate()
+        self._unbind_board_id()
+        self._send(bytes("CW","utf-8"))
 
     def reset_board(self):
         """Trigger a software reset of the board"""
-        with self.comm as ser:
-            ser.write(bytes("Z","utf-8"))
+        self.metadata.invalidate()
+        self._unbind_board_id()
+        self._send(bytes("Z","utf-8"))
+
+    def _board_identity(self):
+        """[Internal] The key of the board in the metadata file
+
+        :returns: 'usb:<serial number>' of the port, or 'id:<board ID>' for
+            a port without USB information
+        """
+        from serial.tools import list_ports
+        for info in list_ports.comports():
+            if info.device == self.comm.port and info.serial_number:
+                return "usb:{}".format(info.serial_number)
+        return "id:{}".format(self.board_id())
+
+    def _unbind_board_id(self):
+        """[Internal] Unbind the metadata of a board identified by a board ID that may change"""
+        if self.metadata.identity is not None and self.metadata.identity.startswith("id:"):
+            self.metadata.bind(None)
 
     def _ask_resp(self,lbl,ch,resp_type):
         """[Internal] Send a packet asking for a response (T, ref T, P, etc.)
@@ -314,22 +836,178 @@ class Controller:
         :returns: a tuple (value, error code). The value will be -9999.9 if
             the error code is non-zero
         """
+        hdr, buf = self._transact(bytes("A{}{}\n".format(lbl,ch),'utf-8'), ch, resp_type)
+        if hdr[0] & 0x01:
+            return (-9999.9, struct.unpack('>I',buf)[0])
+        else:
+            return (struct.unpack('>f',buf)[0], 0)
+
+    def _transact(self, msg, ch, resp_type):
+        """[Internal] Send a request and read its response packet
+
+        If a collection is running, the request is written to the open port
+        and the response is taken from the collection loop; otherwise the
+        port is opened for the exchange.
+
+        :param msg: The request
+        :type msg: bytes
+        :param ch: The expected channel ID in the response header
+        :type ch: int
+        :param resp_type: The expected response type from :py:class:`ResponseType`
+        :type resp_type: :py:class:`ResponseType` value
+        :raises BoardTimeout: if the response does not arrive in time
+        :returns: a tuple (header, body)
+        """
+        with self._mux_lock:
+            streaming = self._streaming
+            if streaming:
+                request = _PendingResponse(ch, resp_type)
+                self._pending.append(request)
+                self.comm.write(msg)
+        if streaming:
+            try:
+                return request.wait(self.response_timeout)
+            except BoardTimeout:
+                # a late response must not be taken for the next request
+                with self._mux_lock:
+                    if request in self._pending:
+                        self._pending.remove(request)
+                raise
+
         with self.comm as ser:
-            ser.write(bytes("A{}{}\n".format(lbl,ch),'utf-8'))  
+            ser.write(msg)
             hdr = ser.read(size=1)
-            err_bit = self._validate_resp_hdr(hdr, ch, resp_type)
-            buf = ser.read(size=4)
-            if err_bit:   
-                return (-9999.9, struct.unpack('>I',buf)[0])
-            else:
-                return (struct.unpack('>f',buf)[0], 0)
+            if len(hdr) == 0:
+                raise BoardTimeout("No response to request {}".format(msg))
+            self._validate_resp_hdr(hdr, ch, resp_type)
+            nbody = self._resp_body_len(hdr)
+            body = ser.read(size=nbody)
+            if len(body) != nbody:
+                raise BoardTimeout("Incomplete response to request {}".format(msg))
+        return (hdr, body)
+
+    def _send(self, msg):
+        """[Internal] Send a command that has no response
+
+        :param msg: The command
+        :type msg: bytes
+        """
+        with self._mux_lock:
+            if self._streaming:
+                self.comm.write(msg)
+                return
+        with self.comm as ser:
+            ser.write(msg)
+
+    def _route_resp(self, hdr, body):
+        """[Internal] Pass a response read by the collection loop to its requester
+
+        The board answers requests in order, so the response belongs to the
+        oldest pending request of the same response type and channel. A
+        response that matches no pending request (e.g. one that arrived after
+        its request timed out) is counted as a header error and dropped.
+        """
+        with self._mux_lock:
+            request = next((r for r in self._pending if r.matches(hdr)), None)
+            if request is not None:
+                self._pending.remove(request)
+        if request is None:
+            self.metrics.header_errors += 1     # unsolicited
+            return
+        request.done(hdr, body)
+
+    def _decode_full(self, buf, pos, record):
+        """[Internal] Decode the body of a full DATA frame into a sample record
+
+        :param buf: The receive buffer
+        :type buf: bytearray
+        :param pos: The offset of the frame body (after the header byte)
+        :type pos: int
+        :param record: The sample, updated in place (see :py:meth:`collect_samples`)
+        :type record: list
+        """
+        active_T = record[1]
+        fault_T = record[2]
+        temperature = record[3]
+        ref_temperature = record[4]
+        pressure = record[5]
+
+        t_hdr = buf[pos+4]
+        p_hdr = buf[pos+21]
+        tr_hdr = buf[pos+38]
+        for ich in range(4):
+            active_T[ich] = False
+            fault_T[ich] = 0
+            temperature[ich] = 0
+            if t_hdr & (1 << (ich+4)):   # active
+                active_T[ich] = True
+                if t_hdr & (1 << ich):   # error bit
+                    fault_T[ich] = _U32.unpack_from(buf, pos+5+4*ich)[0]
+                else: 
+                    temperature[ich] = _F32.unpack_from(buf, pos+5+4*ich)[0]
+            pressure[ich] = _F32.unpack_from(buf, pos+22+4*ich)[0] if p_hdr & (1 << (ich+4)) else 0
+            ref_temperature[ich] = _F32.unpack_from(buf, pos+39+4*ich)[0] if tr_hdr & (1 << (ich+4)) else 0
+
+    def _decode_compact(self, buf, pos, record):
+        """[Internal] Decode the body of a compact DATA frame into a sample record
+
+        The frame length and the timestamp are checked by :py:class:`FrameReader`.
+
+        :param buf: The receive buffer
+        :type buf: bytearray
+        :param pos: The offset of the frame body (after the header byte)
+        :type pos: int
+        :param record: The sample, updated in place (see :py:meth:`collect_samples`)
+        :type record: list
+        """
+        active_T = record[1]
+        fault_T = record[2]
+        temperature = record[3]
+        ref_temperature = record[4]
+        pressure = record[5]
+
+        t_hdr = buf[pos]
+        p_hdr = buf[pos+1]
+        pos += 4 if p_hdr & 0x01 else 6   # delta or absolute timestamp
+        for ich in range(4):
+            active_T[ich] = False
+            fault_T[ich] = 0
+            temperature[ich] = 0
+            ref_temperature[ich] = 0
+            if t_hdr & (1 << (ich+4)):   # active
+                active_T[ich] = True
+                if t_hdr & (1 << ich):   # error bit
+                    fault_T[ich] = _U32.unpack_from(buf, pos)[0]
+                else:
+                    temperature[ich] = _F32.unpack_from(buf, pos)[0]
+                ref_temperature[ich] = _F32.unpack_from(buf, pos+4)[0]
+                pos += 8
+        for ich in range(4):
+            pressure[ich] = 0
+            if p_hdr & (1 << (ich+4)):
+                pressure[ich] = _F32.unpack_from(buf, pos)[0]
+                pos += 4
+
+    def _resp_body_len(self, hdr):
+        """[Internal] The number of bytes following a response header
+
+        :param hdr: The header byte
+        :type hdr: byte
+        :returns: the body length
+        """
+        resp_type = (hdr[0] & 0x38) >> 3
+        if resp_type == self.ResponseType.STATUS_T:
+            return 1 if hdr[0] & 0x01 else 10
+        if resp_type == self.ResponseType.STATUS_P:
+            return 13
+        return 4
 
     def _validate_resp_hdr(self, hdr, ch, resp_type):
         """[Internal] Validate the header byte for a response packet
 
         :param hdr: The header byte
         :type hdr: byte
-        :param ch: The channel ID
+        :param ch: The channel ID, None to accept any channel
         :type ch: int
         :param resp_type: The response type code from :py:class:`ResponseType`
         :type resp_type: :py:class:`ResponseType` value
@@ -340,7 +1018,7 @@ class Controller:
             raise BadHeader("Unexpected header type: 0x{:x}".format(hdr[0]))
         if (hdr[0] & 0x38) >> 3 != resp_type:
             raise BadHeader("Unexpected response type: 0x{:x}".format(hdr[0]))
-        if (hdr[0] & 0x06) >> 1 != ch:
+        if ch is not None and (hdr[0] & 0x06) >> 1 != ch:
             raise BadHeader("Channel {} mismatch): 0x{:x}".format(ch, hdr[0]))
 
         return (hdr[0] & 0x01) != 0
@@ -358,3 +1036,275 @@ class Controller:
         if ich < 0 or ich > 3:
             raise ValueError("Channel ID out of range")
         return ich
+
+class _PendingResponse:
+    """[Internal] A request waiting for its response from the collection loop"""
+
+    def __init__(self, ch, resp_type):
+        self.ch = ch
+        self.resp_type = resp_type
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+    def matches(self, hdr):
+        """True if a response header has the type and channel of this request"""
+        if (hdr[0] & 0xC0) >> 6 != Controller.PacketType.RESP:
+            return False
+        if (hdr[0] & 0x38) >> 3 != self.resp_type:
+            return False
+        return self.ch is None or (hdr[0] & 0x06) >> 1 == self.ch
+
+    def done(self, hdr, body):
+        self.result = (hdr, body)
+        self.event.set()
+
+    def fail(self, error):
+        self.error = error
+        self.event.set()
+
+    def wait(self, timeout):
+        if not self.event.wait(timeout):
+            raise BoardTimeout("No response within {}s".format(timeout))
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+def _new_batch(np, size):
+    """[Internal] Allocate the arrays of a sample batch"""
+    return {
+        "timestamp": np.zeros(size, dtype=np.int64),
+        "active_T": np.zeros((size, 4), dtype=bool),
+        "fault_T": np.zeros((size, 4), dtype=np.int64),
+        "temperature": np.zeros((size, 4)),
+        "ref_temperature": np.zeros((size, 4)),
+        "pressure": np.zeros((size, 4)),
+    }
+
+class ReadInterrupted(Exception):
+    """A blocked read of a :py:class:`FrameReader` was interrupted
+
+    Raised by the idle callback, e.g. on a stop request, and passed on by
+    :py:meth:`FrameReader.next_frame`.
+    """
+    pass
+
+class FrameReader:
+    """Split the serial stream into validated frames
+
+    Frames are read into a preallocated buffer and checked (byte count, active and error
+    flags, timestamp continuity) before they are passed on. With resync
+    enabled, an invalid frame is not fatal: the reader drops one byte at a
+    time until the buffer starts with a valid frame again.
+
+    After a resync, compact frames with a delta timestamp cannot be placed
+    in time and are dropped until the next frame with an absolute
+    timestamp (the board sends one at least every 64 frames). A HALT frame
+    ends the stream only if it is read in sync or when a halt is expected,
+    and if its sample count is plausible; otherwise it is noise as well.
+
+    The reader is shared by the controllers of the boards that use this
+    serial protocol. A reader for another DATA frame layout (e.g. the
+    blocks of :py:class:`accel.AccelController`) overrides
+    :py:meth:`next_frame` and :py:meth:`restart`, and builds on the helpers
+    ``_fill`` (read ahead), ``_body_len`` and ``_validate`` (frame checks)
+    and ``_reject`` (resync); :py:attr:`data_frames` then counts what the
+    HALT count counts.
+    """
+
+    # largest accepted forward step of the board clock between frames (ms)
+    MAX_JUMP_MS = 120000
+    # largest plausible sample rate, bounds the sample count of a HALT frame (Hz)
+    MAX_RATE = 10000
+    BUFFER_SIZE = 4096
+
+    def __init__(self, ser, resp_body_len, resync=True, resp_pending=None, metrics=None,
+            idle=None, halt_expected=None):
+        """Construct a reader
+
+        :param ser: The open serial port
+        :type ser: serial.Serial
+        :param resp_body_len: Returns the body length of a response header
+            (see :py:meth:`Controller._resp_body_len`)
+        :type resp_body_len: callable
+        :param resync: Skip invalid bytes instead of raising
+        :type resync: bool
+        :param resp_pending: Returns True while a request waits for its
+            response, so that a response header is accepted out of sync
+        :type resp_pending: callable
+        :param metrics: The :py:class:`metrics.AcquisitionMetrics` updated
+            with header errors, resyncs and skipped bytes
+        :param idle: Called when a read returns no data; may raise
+            :py:class:`ReadInterrupted` or :py:class:`BoardTimeout`
+        :type idle: callable
+        :param halt_expected: Called with the count of a HALT frame read out
+            of sync, returns True if the frame ends the stream
+        :type halt_expected: callable
+        """
+        self.ser = ser
+        self.resp_body_len = resp_body_len
+        self.resync = resync
+        self.resp_pending = resp_pending
+        self.halt_expected = halt_expected
+        self.metrics = metrics
+        self.idle = idle
+        self.deadline = None
+        self.ticks = False
+        self.timed = False      # record t_read for tracing
+        self.t_read = 0.0
+        self.buf = bytearray(self.BUFFER_SIZE)
+        self.view = memoryview(self.buf)
+        self.restart()
+
+    def restart(self):
+        """Discard buffered data and timestamps, e.g. after the port was reopened"""
+        self.head = 0   # start of the unread data in buf
+        self.tail = 0   # end of the data in buf
+        self.last_timestamp = None
+        self.delta_ref = None
+        self.in_sync = True
+        self.t_last_rx = time.monotonic()
+        self.t_start = self.t_last_rx
+        self.data_frames = 0    # DATA frames passed on since the restart
+
+    def next_frame(self):
+        """Read the next valid frame
+
+        The frame is not copied: the body is at an offset in :py:attr:`buf`
+        and stays valid until the next call.
+
+        :raises BadHeader: on an invalid header, if resync is disabled
+        :raises BadPacket: on an invalid frame, if resync is disabled
+        :raises BoardTimeout: if the read times out and there is no idle 
+            callback (or the callback raises it)
+        :returns: a tuple (header byte, body offset, body length, timestamp),
+            where the timestamp is None for frames other than DATA
+        """
+        buf = self.buf
+        while True:
+            self._fill(1)
+            hdr = buf[self.head]
+            nbody = self._body_len(hdr)
+            if nbody is None:
+                self._reject(BadHeader("Unexpected header: 0x{:x}".format(hdr)))
+                continue
+            self._fill(1 + nbody)
+            if self.timed:
+                self.t_read = time.perf_counter()
+            pos = self.head + 1
+            try:
+                timestamp = self._validate(hdr, pos, nbody)
+            except BadPacket as e:
+                self._reject(e)
+                continue
+            self.head = pos + nbody
+            if (hdr & 0xC0) >> 6 == Controller.PacketType.DATA:
+                if timestamp is None:   # delta without reference
+                    self._skipped(1 + nbody)
+                    continue
+                self.last_timestamp = timestamp
+                self.delta_ref = timestamp
+                self.data_frames += 1
+            self.in_sync = True
+            return (hdr, pos, nbody, timestamp)
+
+    def _fill(self, n):
+        """[Internal] Read until the buffer holds at least n unread bytes"""
+        while self.tail - self.head < n:
+            size = len(self.buf)
+            if self.head + n > size or self.tail == size:
+                # move the unread bytes to the front
+                count = self.tail - self.head
+                self.view[:count] = self.view[self.head:self.tail]
+                self.head = 0
+                self.tail = count
+            want = max(n - (self.tail - self.head), self.ser.in_waiting)
+            nread = self.ser.readinto(self.view[self.tail:min(size, self.tail + want)])
+            if nread:
+                self.tail += nread
+                self.t_last_rx = time.monotonic()
+            elif self.idle is not None:
+                self.idle()
+            else:
+                raise BoardTimeout("No data from board")
+
+    def _body_len(self, hdr):
+        """[Internal] The body length for a header byte, None if implausible"""
+        ptype = (hdr & 0xC0) >> 6
+        if ptype == Controller.PacketType.DATA:
+            nbody = hdr & 0x3F
+            return nbody if nbody >= 4 else None
+        if ptype == Controller.PacketType.HALT:
+            return 4 if hdr == 0xC0 else None
+        if ptype == Controller.PacketType.RESP:
+            if not self.in_sync and not (self.resp_pending and self.resp_pending()):
+                return None
+            return self.resp_body_len(bytes([hdr]))
+        return None
+
+    def _validate(self, hdr, pos, nbody):
+        """[Internal] Check a frame
+
+        :raises BadPacket: if the frame is not plausible
+        :returns: the board timestamp of a DATA frame, None otherwise or if
+            a delta timestamp cannot be resolved
+        """
+        buf = self.buf
+        ptype = (hdr & 0xC0) >> 6
+        if ptype == Controller.PacketType.HALT:
+            # the board cannot have sent fewer samples than were received,
+            # nor more than its fastest rate allows
+            count = _U32.unpack_from(buf, pos)[0]
+            limit = self.data_frames + self.MAX_RATE*(time.monotonic() - self.t_start + 1.0)
+            if count < self.data_frames or count > limit:
+                raise BadPacket("Implausible HALT count {} after {} samples".format(
+                        count, self.data_frames))
+            # out of sync, a 0xC0 is more likely noise than the end of the stream
+            if not self.in_sync and not (self.halt_expected and self.halt_expected(count)):
+                raise BadPacket("Unexpected HALT out of sync")
+            return None
+        if ptype != Controller.PacketType.DATA:
+            return None
+        if nbody == 55:
+            t_hdr, p_hdr, tr_hdr = buf[pos+4], buf[pos+21], buf[pos+38]
+            if (t_hdr & 0x0F) & ~(t_hdr >> 4) or p_hdr & 0x0F or tr_hdr != t_hdr & 0xF0:
+                raise BadPacket("Inconsistent channel flags (data)")
+            timestamp = _U32.unpack_from(buf, pos)[0]
+        else:
+            t_hdr, p_hdr = buf[pos], buf[pos+1]
+            if (t_hdr & 0x0F) & ~(t_hdr >> 4) or p_hdr & 0x0E:
+                raise BadPacket("Inconsistent channel flags (compact data)")
+            delta = p_hdr & 0x01
+            expected = 2 + (2 if delta else 4) + 8*_NBITS[t_hdr >> 4] + 4*_NBITS[p_hdr >> 4]
+            if nbody != expected:
+                raise BadPacket("Compact frame length {} != {}".format(nbody, expected))
+            if delta:
+                if self.delta_ref is None:
+                    return None
+                return (self.delta_ref + _U16.unpack_from(buf, pos+2)[0]) & 0xFFFFFFFF
+            timestamp = _U32.unpack_from(buf, pos+2)[0]
+        if (self.last_timestamp is not None 
+                and (timestamp - self.last_timestamp) & 0xFFFFFFFF > self.MAX_JUMP_MS):
+            raise BadPacket("Timestamp {} out of sequence after {}".format(
+                    timestamp, self.last_timestamp))
+        return timestamp
+
+    def _reject(self, error):
+        """[Internal] Drop the first buffered byte, or raise if not resyncing"""
+        if not self.resync:
+            if self.metrics is not None:
+                self.metrics.header_errors += 1
+            raise error
+        if self.in_sync:
+            self.in_sync = False
+            if self.metrics is not None:
+                self.metrics.header_errors += 1
+                self.metrics.resyncs += 1
+        self.head += 1
+        self._skipped(1)
+        self.delta_ref = None
+
+    def _skipped(self, n):
+        """[Internal] Count bytes dropped without decoding"""
+        if self.metrics is not None:
+            self.metrics.skipped_bytes += n
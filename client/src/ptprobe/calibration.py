@@ -0,0 +1,266 @@
+import json
+import logging
+import math
+import os
+
+import numpy as np
+
+ADC_COUNTS = 4095       # the full scale of the 12 bit pressure ADC
+
+def apply(x, coeffs):
+    """Convert raw ADC values to pressure as the firmware does
+
+    ``P = a0 + x*(a1 + x*a2)``, evaluated on whole arrays.
+
+    :param x: The raw ADC values (0-1)
+    :type x: array_like
+    :param coeffs: The coefficients (a0, a1, a2), or arrays of them
+        broadcast against x
+    :type coeffs: tuple
+    :returns: the pressures, same shape as x
+    """
+    a0, a1, a2 = coeffs
+    x = np.asarray(x, dtype=np.float64)
+    return a0 + x*(a1 + x*a2)
+
+def invert(p, coeffs, counts=ADC_COUNTS):
+    """Recover the raw ADC values from pressures converted with known coefficients
+
+    Of the two roots of the quadratic, the one that tends to the root of
+    the linear part as a2 goes to zero is taken (the coefficients of a
+    transducer are close to linear over the ADC range). With ``counts``, the
+    values are rounded to the nearest ADC count, which removes the float32
+    rounding of the pressures sent by the board, so reapplying the same
+    coefficients gives the recorded pressures back.
+
+    :param p: The pressures
+    :type p: array_like
+    :param coeffs: The coefficients (a0, a1, a2) the pressures were converted
+        with, or arrays of them broadcast against p
+    :type coeffs: tuple
+    :param counts: The ADC full scale in counts, None to keep the exact roots
+    :type counts: int
+    :returns: the raw ADC values (0-1), same shape as p; NaN where a pressure
+        has no real root
+    """
+    a0, a1, a2 = coeffs
+    c = a0 - np.asarray(p, dtype=np.float64)
+    # the numerically stable root c/q of a2*x^2 + a1*x + c, -c/a1 if a2 is 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = c/(-0.5*(a1 + np.copysign(np.sqrt(a1*a1 - 4.0*a2*c), a1)))
+    if counts is not None:
+        x = np.round(x*counts)/counts
+    return x
+
+def recalibrate(p, old, new, counts=ADC_COUNTS):
+    """Convert pressures recorded with one set of coefficients to another
+
+    :param p: The recorded pressures
+    :type p: array_like
+    :param old: The coefficients the pressures were converted with
+    :type old: tuple
+    :param new: The coefficients to apply
+    :type new: tuple
+    :param counts: The ADC full scale (see :py:func:`invert`)
+    :type counts: int
+    :returns: the pressures with the new coefficients
+    """
+    return apply(invert(p, old, counts), new)
+
+class CoefficientHistory:
+    """Versioned pressure coefficients per board and channel
+
+    Each entry is a set of coefficients (a0, a1, a2) for a board channel,
+    effective from a time until an optional end time. Entries added later
+    get a higher version and take precedence where their ranges overlap
+    earlier entries, so a recalibration can be recorded for a past range
+    without rewriting the history. Times are in one time base, by convention
+    UTC as POSIX seconds (e.g. from :py:meth:`clock.ClockModel.to_utc`).
+
+    Two histories describe a recording: the coefficients that were on the
+    board (what the recorded pressures were converted with), and the current
+    best calibration. See :py:meth:`reprocess`.
+    """
+
+    def __init__(self, path=None):
+        """Construct a history
+
+        :param path: An optional JSON file to load from and save to
+        :type path: str
+        """
+        self.path = path
+        self.entries = []
+        if path is not None:
+            self.load()
+
+    def add(self, board_id, ch, coeffs, valid_from, valid_to=None, note=""):
+        """Add a coefficient set and save the history if it has a file
+
+        :param board_id: The board ID
+        :type board_id: int
+        :param ch: The pressure channel (0-3)
+        :type ch: int
+        :param coeffs: The coefficients (a0, a1, a2)
+        :type coeffs: tuple
+        :param valid_from: The start of the effective range
+        :type valid_from: float
+        :param valid_to: The end of the effective range, None for open-ended
+        :type valid_to: float
+        :param note: A free-form note, e.g. the calibration certificate
+        :type note: str
+        :returns: the version of the entry
+        """
+        version = 1 + max([e["version"] for e in self._select(board_id, ch)] or [0])
+        self.entries.append({"board_id": int(board_id), "channel": int(ch),
+                "version": version, "coeffs": [float(a) for a in coeffs],
+                "valid_from": float(valid_from),
+                "valid_to": None if valid_to is None else float(valid_to), "note": note})
+        self.save()
+        return version
+
+    def track(self, board_id, P_status, t):
+        """Add the coefficients read from a board where they changed
+
+        :param board_id: The board ID
+        :type board_id: int
+        :param P_status: The pressure sensor status by channel, as in
+            ``Controller.board_info()['P']`` (maps with 'channel' and 'ai')
+        :type P_status: list
+        :param t: The time from which the coefficients are in effect
+        :type t: float
+        :returns: the channels with a new entry
+        """
+        changed = []
+        for status in P_status:
+            ch = status["channel"]
+            current = self.lookup(board_id, ch, t)
+            if current is None or not np.allclose(current, status["ai"], rtol=1e-7, atol=0):
+                self.add(board_id, ch, status["ai"], t, note="from board")
+                changed.append(ch)
+        return changed
+
+    def lookup(self, board_id, ch, t):
+        """The coefficients in effect at a time
+
+        :returns: the coefficients (a0, a1, a2), None if there are none
+        """
+        best = None
+        for e in self._select(board_id, ch):
+            if e["valid_from"] <= t and (e["valid_to"] is None or t < e["valid_to"]):
+                if best is None or e["version"] > best["version"]:
+                    best = e
+        return None if best is None else tuple(best["coeffs"])
+
+    def timeline(self, board_id, ch):
+        """The coefficients in effect over time, resolved by version
+
+        :returns: a tuple (breakpoints, coeffs): breakpoints is an increasing
+            array of n+1 times; coeffs an (n, 3) array of the coefficients in
+            effect from breakpoints[i] to breakpoints[i+1], NaN where none are
+        """
+        entries = self._select(board_id, ch)
+        edges = sorted(set([e["valid_from"] for e in entries]
+                + [e["valid_to"] for e in entries if e["valid_to"] is not None] + [math.inf]))
+        coeffs = np.full((len(edges) - 1, 3), np.nan)
+        for i, t in enumerate(edges[:-1]):
+            found = self.lookup(board_id, ch, t)
+            if found is not None:
+                coeffs[i] = found
+        return (np.array(edges), coeffs)
+
+    def apply(self, board_id, ch, times, x):
+        """Convert raw ADC values with the coefficients in effect at each sample
+
+        :param times: The sample times
+        :type times: array_like
+        :param x: The raw ADC values (0-1), same length as times
+        :type x: array_like
+        :returns: the pressures, NaN where no coefficients are in effect
+        """
+        x = np.asarray(x, dtype=np.float64)
+        out = np.full(x.shape, np.nan)
+        for index, coeffs in self._pieces(board_id, ch, times):
+            out[index] = apply(x[index], coeffs)
+        return out
+
+    def invert(self, board_id, ch, times, p, counts=ADC_COUNTS):
+        """Recover the raw ADC values of pressures converted with this history
+
+        :param times: The sample times
+        :type times: array_like
+        :param p: The pressures, same length as times
+        :type p: array_like
+        :returns: the raw ADC values (see :py:func:`invert`), NaN where no
+            coefficients are in effect
+        """
+        p = np.asarray(p, dtype=np.float64)
+        out = np.full(p.shape, np.nan)
+        for index, coeffs in self._pieces(board_id, ch, times):
+            out[index] = invert(p[index], coeffs, counts)
+        return out
+
+    def reprocess(self, calibration, board_id, times, pressure, counts=ADC_COUNTS):
+        """Convert recorded pressures of a board to another calibration
+
+        This history gives the coefficients the pressures were converted
+        with on the board; the other history the coefficients to apply.
+
+        :param calibration: The calibration to apply
+        :type calibration: :py:class:`CoefficientHistory`
+        :param board_id: The board ID
+        :type board_id: int
+        :param times: The sample times, shape (n,)
+        :type times: array_like
+        :param pressure: The recorded pressures, shape (n, 4) as in the
+            sample arrays of :py:meth:`board.Controller.iter_batches`
+        :type pressure: array_like
+        :returns: the pressures with the new calibration, shape (n, 4)
+        """
+        pressure = np.asarray(pressure, dtype=np.float64)
+        out = np.empty_like(pressure)
+        for ich in range(pressure.shape[1]):
+            x = self.invert(board_id, ich, times, pressure[:,ich], counts)
+            out[:,ich] = calibration.apply(board_id, ich, times, x)
+        return out
+
+    def load(self):
+        """Load the entries from the history file, if it exists"""
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as hf:
+                self.entries = json.load(hf)
+        except (ValueError, OSError) as e:
+            logging.warning("Ignoring coefficient history {}: {}".format(self.path, e))
+            self.entries = []
+
+    def save(self):
+        """Write the entries to the history file"""
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = "{}.tmp".format(self.path)
+        with open(tmp, "w") as hf:
+            json.dump(self.entries, hf, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def _pieces(self, board_id, ch, times):
+        """[Internal] Split sample times by the coefficients in effect
+
+        :returns: a generator of (index into times, coefficients)
+        """
+        edges, coeffs = self.timeline(board_id, ch)
+        times = np.asarray(times, dtype=np.float64)
+        if np.all(times[1:] >= times[:-1]):
+            bounds = np.searchsorted(times, edges, side="left")
+            pieces = [slice(bounds[i], bounds[i+1]) for i in range(len(coeffs))]
+        else:
+            piece = np.searchsorted(edges, times, side="right") - 1
+            pieces = [np.nonzero(piece == i)[0] for i in range(len(coeffs))]
+        for index, a in zip(pieces, coeffs):
+            if not np.isnan(a[0]):
+                yield (index, tuple(a))
+
+    def _select(self, board_id, ch):
+        """[Internal] The entries of a board channel"""
+        return [e for e in self.entries if e["board_id"] == board_id and e["channel"] == ch]
@@ -0,0 +1,175 @@
+import time
+from collections import deque
+
+import numpy as np
+
+WRAP = 1 << 32      # the board timestamp is a uint32 millisecond counter
+
+class ClockModel:
+    """A linear mapping from the board millisecond counter to host time
+
+    The model is fitted continuously from (board timestamp, host arrival time)
+    pairs over a sliding window. USB transfer and host scheduling only ever
+    delay the arrival of a packet, so the fit is refined on the lower half of
+    the residuals: the line tracks the earliest arrivals and ignores latency
+    outliers. The slope gives the drift of the board oscillator relative to
+    the host clock.
+
+    Once fitted, whole arrays of board timestamps can be converted without
+    reading the host clock, which gives consistent stamps across a batch.
+    """
+
+    def __init__(self, window=512, refit_every=16):
+        """Construct a clock model
+
+        :param window: The number of recent (board, host) pairs used in the fit
+        :type window: int
+        :param refit_every: The number of updates between fits
+        :type refit_every: int
+        """
+        self.window = window
+        self.refit_every = refit_every
+        self.offset = None      # host seconds at board time 0 (unwrapped)
+        self.slope = 1e-3       # host seconds per board ms
+        self._pairs = deque(maxlen=window)
+        self._pending = 0
+        self._last_raw = None
+        self._wraps = 0
+        # offset from the monotonic clock to UTC, taken once
+        self.utc_offset = time.time() - time.monotonic()
+
+    @property
+    def drift_ppm(self):
+        """The board clock drift relative to the host (parts per million)"""
+        return (self.slope*1e3 - 1.0)*1e6
+
+    def unwrap(self, board_ms):
+        """Unwrap a timestamp from the live stream across counter rollover
+
+        :param board_ms: The raw uint32 board timestamp (ms)
+        :type board_ms: int
+        :returns: the timestamp extended past 2^32 ms
+        """
+        if self._last_raw is not None and board_ms < self._last_raw - WRAP//2:
+            self._wraps += 1
+        self._last_raw = board_ms
+        return board_ms + self._wraps*WRAP
+
+    def update(self, board_ms, host_time=None):
+        """Add a (board timestamp, host arrival time) pair
+
+        :param board_ms: The raw board timestamp (ms)
+        :type board_ms: int
+        :param host_time: The host monotonic time at arrival (s). Defaults
+            to :py:func:`time.monotonic` now.
+        :type host_time: float
+        """
+        if host_time is None:
+            host_time = time.monotonic()
+        self._pairs.append((self.unwrap(board_ms), host_time))
+        self._pending += 1
+        if self.offset is None or self._pending >= self.refit_every:
+            self.fit()
+
+    def fit(self):
+        """Refit the model to the current window"""
+        self._pending = 0
+        pairs = np.array(self._pairs, dtype=float)
+        x = pairs[:,0] - pairs[0,0]
+        y = pairs[:,1]
+        if len(pairs) < 8 or x[-1] <= 0:
+            # too little history for a slope: assume a nominal clock
+            slope = 1e-3
+            intercept = np.min(y - slope*x)
+        else:
+            slope, intercept = np.polyfit(x, y, 1)
+            resid = y - (intercept + slope*x)
+            keep = resid <= np.median(resid)
+            slope, intercept = np.polyfit(x[keep], y[keep], 1)
+            # shift onto the lower envelope of the arrivals
+            intercept += np.min(y - (intercept + slope*x))
+        self.slope = slope
+        self.offset = intercept - slope*pairs[0,0]
+
+    def to_host(self, board_ms):
+        """Convert board timestamps to host monotonic time
+
+        Raw uint32 timestamps are unwrapped to the rollover period nearest
+        to the most recent live timestamp.
+
+        :param board_ms: The board timestamps (ms)
+        :type board_ms: int or array_like
+        :returns: the host monotonic time (s), same shape as the input
+        """
+        if self.offset is None:
+            raise RuntimeError("Clock model has no samples")
+        t = np.asarray(board_ms, dtype=np.int64)
+        ref = self._last_raw + self._wraps*WRAP
+        t = t + np.round((ref - t)/WRAP).astype(np.int64)*WRAP
+        return self.offset + self.slope*t
+
+    def to_utc(self, board_ms):
+        """Convert board timestamps to UTC
+
+        :param board_ms: The board timestamps (ms)
+        :type board_ms: int or array_like
+        :returns: the UTC time as POSIX seconds, same shape as the input
+        """
+        return self.to_host(board_ms) + self.utc_offset
+
+    def to_datetime64(self, board_ms):
+        """Convert board timestamps to UTC as NumPy datetimes
+
+        :param board_ms: The board timestamps (ms)
+        :type board_ms: int or array_like
+        :returns: an array of datetime64[us]
+        """
+        us = np.round(self.to_utc(board_ms)*1e6).astype(np.int64)
+        return us.astype('datetime64[us]')
+
+class RecordingClock:
+    """A fixed mapping from the board timestamps of a recording to UTC
+
+    For samples read back from a recording, where there are no arrival
+    times to fit: the first board timestamp is placed at a known UTC time
+    and later timestamps follow at the nominal rate of the board clock.
+    It can be passed as the clock of a sink, like a :py:class:`ClockModel`.
+    """
+
+    def __init__(self, utc_start, board_start, slope=1e-3):
+        """Construct a clock
+
+        :param utc_start: The UTC time of the first sample (POSIX s)
+        :type utc_start: float
+        :param board_start: The board timestamp of the first sample (ms)
+        :type board_start: int
+        :param slope: The seconds per board ms
+        :type slope: float
+        """
+        self.utc_start = utc_start
+        self.board_start = board_start
+        self.slope = slope
+
+    def to_utc(self, board_ms):
+        """Convert board timestamps to UTC
+
+        Timestamps are taken to follow the first sample, so a recording
+        shorter than the counter period (about 49 days) is mapped across
+        the rollover.
+
+        :param board_ms: The board timestamps (ms)
+        :type board_ms: int or array_like
+        :returns: the UTC time as POSIX seconds, same shape as the input
+        """
+        t = (np.asarray(board_ms, dtype=np.int64) - self.board_start) % WRAP
+        return self.utc_start + self.slope*t
+
+    def to_datetime64(self, board_ms):
+        """Convert board timestamps to UTC as NumPy datetimes
+
+        :param board_ms: The board timestamps (ms)
+        :type board_ms: int or array_like
+        :returns: an array of datetime64[us]
+        """
+        us = np.round(self.to_utc(board_ms)*1e6).astype(np.int64)
+        return us.astype('datetime64[us]')
@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import serial
+from serial.tools import list_ports
+
+from .board import Controller, BadHeader, BoardTimeout
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "ptprobe", "ports.json")
+
+def candidate_ports(vid=None):
+    """List the USB serial ports that may have a board connected
+
+    :param vid: Only include ports with this USB vendor ID (default: any USB port)
+    :type vid: int
+    :returns: a list of :py:class:`serial.tools.list_ports_common.ListPortInfo`
+    """
+    return [p for p in list_ports.comports()
+            if p.vid is not None and (vid is None or p.vid == vid)]
+
+def probe(port, timeout=0.5, baudrate=115200):
+    """Ask the board on a port for its ID
+
+    :param port: The serial port
+    :type port: str
+    :param timeout: The read timeout (s)
+    :type timeout: float
+    :param baudrate: The baudrate for the serial connection
+    :type baudrate: int
+    :returns: the integer board ID, or None if no board answered
+    """
+    pt = Controller(port, baudrate=baudrate)
+    pt.comm.timeout = timeout
+    pt.comm.write_timeout = timeout
+    try:
+        return pt.board_id()
+    except (serial.SerialException, BadHeader, BoardTimeout, struct.error) as e:
+        logging.debug("No board on {}: {}".format(port, e))
+        return None
+
+class PortCache:
+    """A persistent map from USB serial number to board ID
+
+    Serial numbers survive re-plugging, while port names (ttyACM0, COM3)
+    are reassigned on every enumeration.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE):
+        """Construct a cache backed by a JSON file
+
+        :param path: The cache file
+        :type path: str
+        """
+        self.path = path
+        self.entries = {}
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as hf:
+                    self.entries = {k: int(v) for k, v in json.load(hf).items()}
+            except (ValueError, OSError) as e:
+                logging.warning("Ignoring port cache {}: {}".format(path, e))
+
+    def get(self, serial_number):
+        return self.entries.get(serial_number)
+
+    def set(self, serial_number, board_id):
+        self.entries[serial_number] = board_id
+
+    def forget(self, serial_number=None):
+        """Drop one entry, or all entries if no serial number is given"""
+        if serial_number is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(serial_number, None)
+
+    def save(self):
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = "{}.tmp".format(self.path)
+        with open(tmp, "w") as hf:
+            json.dump(self.entries, hf, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+
+def discover(ports=None, timeout=0.5, cache=None, refresh=False, vid=None):
+    """Find the connected boards and map board IDs to serial ports
+
+    Ports whose USB serial number is in the cache are not probed. All other
+    ports are probed concurrently, so the search takes about one timeout
+    regardless of the number of boards.
+
+    :param ports: The port names to consider (default: all USB serial ports)
+    :type ports: list
+    :param timeout: The probe timeout per port (s)
+    :type timeout: float
+    :param cache: The port cache (default: the cache in the user's home
+        directory). Pass False to disable caching.
+    :type cache: :py:class:`PortCache`
+    :param refresh: Probe every port, ignoring cached entries
+    :type refresh: bool
+    :param vid: Only consider ports with this USB vendor ID
+    :type vid: int
+    :returns: a map {board_id: port}
+    """
+    if cache is None:
+        cache = PortCache()
+    infos = candidate_ports(vid)
+    if ports is not None:
+        wanted = set(ports)
+        known = set(p.device for p in infos)
+        infos = [p for p in infos if p.device in wanted]
+        # explicitly named ports without USB info (e.g. ptys) are probed
+        infos += [_PlainPort(dev) for dev in ports if dev not in known]
+
+    found = {}
+    to_probe = []
+    for info in infos:
+        board_id = None
+        if cache and info.serial_number and not refresh:
+            board_id = cache.get(info.serial_number)
+        if board_id is None:
+            to_probe.append(info)
+        else:
+            found[board_id] = info.device
+
+    if to_probe:
+        with ThreadPoolExecutor(max_workers=len(to_probe)) as pool:
+            ids = list(pool.map(lambda info: probe(info.device, timeout), to_probe))
+        for info, board_id in zip(to_probe, ids):
+            if board_id is None:
+                continue
+            if board_id in found:
+                logging.warning("Board ID {} found on {} and {}".format(
+                        board_id, found[board_id], info.device))
+            found[board_id] = info.device
+            if cache and info.serial_number:
+                cache.set(info.serial_number, board_id)
+        if cache:
+            cache.save()
+
+    return found
+
+class _PlainPort:
+    """[Internal] Port info for a device not reported by the enumeration"""
+
+    def __init__(self, device):
+        self.device = device
+        self.serial_number = None
@@ -0,0 +1,109 @@
+from functools import lru_cache
+
+import numpy as np
+from scipy import signal
+
+@lru_cache(maxsize=32)
+def butter_sos(fs, cutoff, order, btype='highpass'):
+    """Design a Butterworth filter as second-order sections
+
+    Designs are cached on (sample rate, cutoff, order, type), so repeated
+    calls from a refresh callback do not redo the design.
+
+    :param fs: The sample rate (Hz)
+    :type fs: float
+    :param cutoff: The cutoff frequency (Hz), or a (low, high) tuple for
+        band filters
+    :type cutoff: float
+    :param order: The filter order
+    :type order: int
+    :param btype: The filter type ('highpass', 'lowpass', 'bandpass', 'bandstop')
+    :type btype: str
+    :returns: the second-order sections as an array of shape (n, 6)
+    """
+    return signal.butter(order, cutoff, btype=btype, output='sos', fs=fs)
+
+class StreamingFilter:
+    """A causal IIR filter applied to a stream of sample chunks
+
+    The filter state is carried over from one chunk to the next, so filtering
+    a recording chunk by chunk gives the same result as filtering it in one
+    pass. Each sample is touched once, regardless of the history length.
+    """
+
+    def __init__(self, fs, cutoff, order=3, btype='highpass', axis=-1):
+        """Construct a filter stage
+
+        :param fs: The sample rate (Hz)
+        :type fs: float
+        :param cutoff: The cutoff frequency (Hz)
+        :type cutoff: float
+        :param order: The filter order (default 3)
+        :type order: int
+        :param btype: The filter type (default 'highpass')
+        :type btype: str
+        :param axis: The time axis of the chunks (default -1)
+        :type axis: int
+        """
+        self.sos = butter_sos(float(fs), _hashable(cutoff), int(order), btype)
+        self.axis = axis
+        self.zi = None
+
+    def reset(self):
+        """Clear the filter state. The next chunk restarts the filter."""
+        self.zi = None
+
+    def process(self, chunk):
+        """Filter the next chunk of samples
+
+        On the first chunk the state is initialized to the steady-state
+        response of the first sample, which avoids a start-up transient.
+
+        :param chunk: The new samples
+        :type chunk: array_like
+        :returns: the filtered samples, same shape as the input
+        """
+        x = np.asarray(chunk, dtype=float)
+        if x.shape[self.axis] == 0:
+            return x
+        if self.zi is None:
+            self.zi = self._initial_state(x)
+        y, self.zi = signal.sosfilt(self.sos, x, axis=self.axis, zi=self.zi)
+        return y
+
+    def _initial_state(self, x):
+        """[Internal] Scale the steady-state state by the first sample of each signal"""
+        zi = signal.sosfilt_zi(self.sos)        # (n_sections, 2)
+        x0 = np.take(x, [0], axis=self.axis)
+        x0 = np.moveaxis(x0, self.axis, 0)      # (1, ...)
+        zi = zi.reshape(zi.shape + (1,)*(x.ndim - 1)) * x0
+        return np.moveaxis(zi, 1, self.axis % x.ndim + 1)
+
+def zero_phase(x, fs, cutoff, order=3, btype='highpass', axis=-1):
+    """Apply a forward-backward (zero-phase) filter to a whole recording
+
+    This is the batch mode for archived data; it needs the complete signal
+    and is not suitable for live streams (use :py:class:`StreamingFilter`).
+
+    :param x: The samples
+    :type x: array_like
+    :param fs: The sample rate (Hz)
+    :type fs: float
+    :param cutoff: The cutoff frequency (Hz)
+    :type cutoff: float
+    :param order: The filter order (default 3)
+    :type order: int
+    :param btype: The filter type (default 'highpass')
+    :type btype: str
+    :param axis: The time axis (default -1)
+    :type axis: int
+    :returns: the filtered samples
+    """
+    sos = butter_sos(float(fs), _hashable(cutoff), int(order), btype)
+    return signal.sosfiltfilt(sos, np.asarray(x, dtype=float), axis=axis)
+
+def _hashable(cutoff):
+    """[Internal] Normalize a cutoff frequency for use as a cache key"""
+    if np.ndim(cutoff) == 0:
+        return float(cutoff)
+    return tuple(float(c) for c in cutoff)
@@ -0,0 +1,222 @@
+import json
+
+WRAP = 1 << 32      # the board timestamp is a uint32 millisecond counter
+
+class GapIndex:
+    """An index of the gaps in a sample stream
+
+    Gaps are detected while streaming from the board timestamps: a step of
+    more than (1 + tolerance) sample intervals between consecutive samples
+    is a gap of round(step/interval) - 1 missing samples. The interval is
+    the configured sample interval if set, otherwise it is estimated from the
+    first samples, and it follows slow changes of the sample rate. When the
+    board is halted, its sample count is compared with the samples received:
+    losses that the timestamps cannot place (e.g. at a constant rate but
+    with an unknown interval) are counted in :py:attr:`unlocated`.
+
+    Each gap is stored as (start, end, missing), where start and end are
+    the board timestamps (ms) of the samples on either side, unwrapped
+    across the rollover of the counter as by :py:func:`unwrap`. The index can
+    be saved next to a recording (see :py:meth:`sinks.SampleSink.write_gaps`)
+    and used to mask or fill the gaps of the recorded arrays.
+    """
+
+    WARMUP = 8      # samples used to estimate the interval
+
+    def __init__(self, interval_ms=0, tolerance=0.5):
+        """Construct an empty index
+
+        :param interval_ms: The expected sample interval (ms), 0 to estimate
+        :type interval_ms: int
+        :param tolerance: The fraction of an interval by which a step may
+            exceed the interval before it is a gap
+        :type tolerance: float
+        """
+        self.tolerance = tolerance
+        self.reset(interval_ms)
+
+    def reset(self, interval_ms=0):
+        """Clear the index for a new recording
+
+        :param interval_ms: The expected sample interval (ms), 0 to estimate
+        :type interval_ms: int
+        """
+        self.interval_ms = float(interval_ms) if interval_ms > 0 else None
+        self.gaps = []
+        self.received = 0
+        self.board_count = None
+        self.unlocated = 0
+        self._last = None
+        self._warmup = []
+        self._session_received = 0
+        self._session_missing = 0
+
+    def restart(self):
+        """Start a new board session (e.g. after a reconnect) in the same recording
+
+        The board restarts its sample count, so only the samples received
+        since the restart are compared with the count at the halt.
+        """
+        self._session_received = 0
+        self._session_missing = 0
+
+    @property
+    def missing(self):
+        """The total number of missing samples"""
+        return sum(g[2] for g in self.gaps) + self.unlocated
+
+    def observe(self, timestamp):
+        """Add a received sample
+
+        :param timestamp: The board timestamp (ms)
+        :type timestamp: int
+        """
+        self.received += 1
+        self._session_received += 1
+        last = self._last
+        if last is None:
+            self._last = timestamp
+            return
+        step = (timestamp - last) & (WRAP - 1)
+        timestamp = last + step
+        self._last = timestamp
+        if self.interval_ms is None:
+            self._warmup.append((last, timestamp, step))
+            if len(self._warmup) == self.WARMUP:
+                self._flush()
+            return
+        self._check(last, timestamp, step)
+
+    def halt(self, board_count):
+        """Compare the sample count of the HALT packet with the samples received
+
+        :param board_count: The number of samples sent by the board
+        :type board_count: int
+        """
+        self._flush()
+        self.board_count = board_count
+        lost = board_count - self._session_received - self._session_missing
+        if lost > 0:
+            self.unlocated += lost
+
+    def _check(self, start, end, step):
+        """[Internal] Record a gap if a step is too long, else track the interval"""
+        interval = self.interval_ms
+        if step > (1.0 + self.tolerance)*interval:
+            missing = int(step/interval + 0.5) - 1
+            if missing > 0:
+                self.gaps.append((start, end, missing))
+                self._session_missing += missing
+        else:
+            self.interval_ms += (step - interval)/16.0
+
+    def _flush(self):
+        """[Internal] Estimate the interval from the warm-up steps and check them"""
+        if self._warmup:
+            steps = sorted(s for _, _, s in self._warmup)
+            self.interval_ms = float(max(1, steps[len(steps)//2]))
+            for start, end, s in self._warmup:
+                self._check(start, end, s)
+            self._warmup = []
+
+    def to_array(self):
+        """The gaps as a structured array with int64 fields start, end, missing"""
+        import numpy as np
+        self._flush()
+        return np.array(self.gaps, dtype=[("start", np.int64), ("end", np.int64),
+                ("missing", np.int64)]).reshape(-1)
+
+    def mask(self, timestamps):
+        """Mark the samples that follow a gap
+
+        The step to such a sample spans the gap, e.g. it should be left out
+        of a rate or a difference.
+
+        :param timestamps: The recorded board timestamps (ms), in order
+        :type timestamps: numpy.ndarray
+        :returns: a boolean array, True for the first sample after each gap
+        """
+        import numpy as np
+        timestamps = unwrap(timestamps)
+        out = np.zeros(len(timestamps), dtype=bool)
+        gaps = self.to_array()
+        if len(gaps) == 0 or len(timestamps) == 0:
+            return out
+        idx = np.searchsorted(timestamps, gaps["end"])
+        idx = idx[idx < len(timestamps)]
+        out[idx[timestamps[idx] == gaps["end"][:len(idx)]]] = True
+        return out
+
+    def fill(self, timestamps, values):
+        """Insert the missing samples as NaN, e.g. to get an evenly spaced array
+
+        The inserted timestamps are spread evenly over each gap.
+
+        :param timestamps: The recorded board timestamps (ms), in order
+        :type timestamps: numpy.ndarray
+        :param values: The recorded values, one row per sample
+        :type values: numpy.ndarray
+        :returns: a tuple (timestamps, values) with float arrays
+        """
+        import numpy as np
+        timestamps = unwrap(timestamps).astype(np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        gaps = self.to_array()
+        if len(gaps) == 0:
+            return (timestamps, values)
+        after = np.searchsorted(timestamps, gaps["end"])
+        keep = (after < len(timestamps)) & (after > 0)
+        after = after[keep]
+        missing = gaps["missing"][keep]
+        start = gaps["start"][keep].astype(np.float64)
+        step = (gaps["end"][keep] - gaps["start"][keep])/(missing + 1.0)
+        # positions and times of the inserted samples, gap by gap
+        pos = np.repeat(after, missing)
+        k = np.arange(missing.sum()) - np.repeat(np.cumsum(missing) - missing, missing) + 1
+        t_fill = np.repeat(start, missing) + k*np.repeat(step, missing)
+        v_fill = np.full((len(pos),) + values.shape[1:], np.nan)
+        return (np.insert(timestamps, pos, t_fill), np.insert(values, pos, v_fill, axis=0))
+
+    def save(self, path):
+        """Write the index to a JSON file
+
+        :param path: The output path, e.g. the recording name + '.gaps.json'
+        :type path: str
+        """
+        self._flush()
+        with open(path, "w") as hf:
+            json.dump({"interval_ms": self.interval_ms, "received": self.received,
+                    "board_count": self.board_count, "unlocated": self.unlocated,
+                    "gaps": [list(g) for g in self.gaps]}, hf)
+
+    @classmethod
+    def load(cls, path):
+        """Read an index written by :py:meth:`save`
+
+        :param path: The index file
+        :type path: str
+        :returns: the index
+        """
+        with open(path, "r") as hf:
+            raw = json.load(hf)
+        index = cls()
+        index.interval_ms = raw["interval_ms"]
+        index.received = raw["received"]
+        index.board_count = raw["board_count"]
+        index.unlocated = raw["unlocated"]
+        index.gaps = [tuple(g) for g in raw["gaps"]]
+        return index
+
+def unwrap(timestamps):
+    """Unwrap recorded board timestamps across the rollover of the counter
+
+    :param timestamps: The board timestamps (ms) of a recording, in order
+    :type timestamps: array_like
+    :returns: an int64 array, increasing past 2^32 ms
+    """
+    import numpy as np
+    t = np.asarray(timestamps, dtype=np.int64)
+    if len(t) < 2:
+        return t
+    wraps = np.concatenate(([0], np.cumsum(np.diff(t) < -(WRAP//2))))
+    return t + wraps*WRAP
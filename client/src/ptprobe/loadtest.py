@@ -0,0 +1,385 @@
+import logging
+import multiprocessing
+import os
+import queue
+import resource
+import threading
+import time
+
+import numpy as np
+
+from . import sinks as sinks_module
+from .board import Controller
+from .simulator import SimulatedBoard
+from .sinks import SampleSink
+
+RING = 1 << 16          # send times kept per board, by board timestamp (ms)
+BOARDS_PER_PROCESS = 8  # simulated boards per simulator process
+RESULT_TIMEOUT = 30.0   # time a collection process may take after the run (s)
+
+class TimedBoard (SimulatedBoard):
+    """A simulated board that records the host time at which each frame is sent
+
+    The send time (:py:func:`time.monotonic`) of the frame with board
+    timestamp t is stored at ``send_times[t % RING]``, which a receiving
+    process compares with the time the sample reaches the sinks. Timestamps
+    are in ms, so at rates above 1 kHz frames in the same ms share a slot.
+    """
+
+    def __init__(self, send_times, **kwargs):
+        """Construct a board
+
+        :param send_times: The send time slots of this board (RING doubles)
+        :type send_times: numpy.ndarray
+        :param kwargs: The arguments of :py:class:`simulator.SimulatedBoard`
+        """
+        self.send_times = send_times
+        super().__init__(**kwargs)
+
+    def full_frame(self, timestamp):
+        frame = super().full_frame(timestamp)
+        self.send_times[timestamp % RING] = time.monotonic()
+        return frame
+
+    def compact_frame(self, timestamp, last_timestamp=None):
+        frame = super().compact_frame(timestamp, last_timestamp)
+        self.send_times[timestamp % RING] = time.monotonic()
+        return frame
+
+class LatencySink (SampleSink):
+    """Measure the serial-to-sink latency of the samples of a :py:class:`TimedBoard`
+
+    The latency of a sample is the time from the send of its frame by the
+    board to its write to this sink, after the sinks listed before it. The
+    samples are passed on to the wrapped sinks. Samples written before
+    :py:attr:`t_start` (the warm-up) are passed on but not measured.
+    """
+
+    def __init__(self, send_times, sinks=None):
+        """Construct a sink
+
+        :param send_times: The send time slots of the board (RING doubles)
+        :type send_times: numpy.ndarray
+        :param sinks: Sinks to pass the samples on to
+        :type sinks: list
+        """
+        self.send_times = send_times
+        self.sinks = sinks if sinks is not None else []
+        self.t_start = 0.0
+        self.latencies = []
+        self.samples = 0
+
+    def write(self, sample, *args):
+        for sink in self.sinks:
+            sink.write(sample, *args)
+        now = time.monotonic()
+        if now >= self.t_start:
+            self.latencies.append(now - self.send_times[sample[0] % RING])
+            self.samples += 1
+
+def run_load(n_boards, rate=5.0, duration=10.0, warmup=2.0, frame_format=None,
+        sinks=(), processes=False, boards_per_process=BOARDS_PER_PROCESS):
+    """Stream N simulated boards through the acquisition stack and measure it
+
+    The boards (:py:class:`TimedBoard`) run on pseudo-terminals in separate
+    simulator processes, so their cost is not counted in the acquisition
+    process. Each board is collected by its own :py:class:`board.Controller`,
+    in a thread of this process or in a process of its own, for the warm-up
+    and then the measured duration, and halted.
+
+    Per board, the result has:
+
+    - 'samples': samples received in the measured duration, 'throughput' (Hz)
+    - 'latency_ms': serial-to-sink latency percentiles ('p50', 'p99', 'p99.9', 'max')
+    - 'cpu_s': the CPU time of the collection thread (or process)
+    - 'dropped': samples the board sent but the controller did not receive,
+      from the HALT count, and 'resyncs'
+    - 'rss_growth_kb': the RSS growth over the measured duration, of the
+      acquisition process (shared by all boards with threads)
+
+    A board whose collection raises, or whose process dies or does not
+    report within :py:data:`RESULT_TIMEOUT` of the end, is listed in
+    'failed' with its 'board', 'port' and 'error' instead.
+
+    :param n_boards: The number of boards
+    :type n_boards: int
+    :param rate: The sample rate per board (Hz)
+    :type rate: float
+    :param duration: The measured duration (s)
+    :type duration: float
+    :param warmup: The time before the measurement starts (s)
+    :type warmup: float
+    :param frame_format: Optional keyword arguments for
+        :py:meth:`board.Controller.set_frame_format`
+    :type frame_format: dict
+    :param sinks: Sinks written by each controller, as (name, args) pairs
+        for :py:func:`sinks.create_sink`; '{board}' in a string argument is
+        replaced by the board number, e.g. ('csv', ('load-{board}.csv',))
+    :type sinks: list
+    :param processes: Collect each board in its own process instead of a thread
+    :type processes: bool
+    :param boards_per_process: The number of boards per simulator process
+    :type boards_per_process: int
+    :returns: a map with 'boards' (the per-board results), 'failed' (the
+        failed boards), 'cpu_percent' (acquisition CPU time over wall time,
+        all boards) and 'rss_growth_kb'
+    """
+    send_times = multiprocessing.RawArray('d', n_boards*RING)
+    ctx = multiprocessing.get_context()
+    stop = ctx.Event()
+    ports = ctx.Queue()
+    sims = []
+    for first in range(0, n_boards, boards_per_process):
+        ids = list(range(first, min(n_boards, first + boards_per_process)))
+        p = ctx.Process(target=_simulate, args=(ids, rate, send_times, ports, stop), daemon=True)
+        p.start()
+        sims.append(p)
+    port_of = {}
+    for _ in range(n_boards):
+        ib, port = ports.get(timeout=30)
+        port_of[ib] = port
+
+    t_start = time.monotonic() + warmup
+    t_stop = t_start + duration
+    try:
+        if processes:
+            results = ctx.Queue()
+            workers = [ctx.Process(target=_collect_process,
+                    args=(ib, port_of[ib], send_times, sinks, frame_format, t_start, t_stop, results))
+                    for ib in range(n_boards)]
+            for w in workers:
+                w.start()
+            boards = _process_results(workers, results, port_of, t_stop + RESULT_TIMEOUT)
+            host_cpu = sum(b.get("cpu_s", 0.0) for b in boards)
+            rss_growth = sum(b.get("rss_growth_kb", 0) for b in boards)
+        else:
+            boards = [None]*n_boards
+            cpu0 = time.process_time()
+            threads = [threading.Thread(target=_collect_thread,
+                    args=(ib, port_of[ib], send_times, sinks, frame_format, t_start, t_stop, boards))
+                    for ib in range(n_boards)]
+            for t in threads:
+                t.start()
+            time.sleep(max(0.0, t_start - time.monotonic()))
+            cpu_start = time.process_time()
+            rss_start = _rss_kb()
+            time.sleep(max(0.0, t_stop - time.monotonic()))
+            rss_growth = _rss_kb() - rss_start
+            host_cpu = time.process_time() - cpu_start
+            for t in threads:
+                t.join()
+            for b in boards:
+                if "error" not in b:
+                    b["rss_growth_kb"] = rss_growth
+            logging.debug("Setup CPU {:.2f} s".format(cpu_start - cpu0))
+    finally:
+        stop.set()
+        for p in sims:
+            p.join(timeout=10)
+    boards = sorted(boards, key=lambda b: b["board"])
+    failed = [b for b in boards if "error" in b]
+    for b in failed:
+        logging.error("Board {} ({}) failed: {}".format(b["board"], b["port"], b["error"]))
+    return {"boards": [b for b in boards if "error" not in b], "failed": failed,
+            "cpu_percent": 100.0*host_cpu/duration, "rss_growth_kb": rss_growth}
+
+def sweep(counts, rate=5.0, duration=10.0, max_drop=1e-3, max_p99_ms=100.0, **kwargs):
+    """Run :py:func:`run_load` for increasing numbers of boards
+
+    A run is saturated when a board fails, drops more than ``max_drop`` of
+    its samples, receives less than (1 - max_drop) of the nominal rate, or
+    its p99 latency exceeds ``max_p99_ms``. The sweep stops at the first
+    saturated run.
+
+    :param counts: The numbers of boards, ascending
+    :type counts: list
+    :param max_drop: The tolerated fraction of lost samples
+    :type max_drop: float
+    :param max_p99_ms: The tolerated p99 serial-to-sink latency (ms)
+    :type max_p99_ms: float
+    :param kwargs: Further arguments of :py:func:`run_load`
+    :returns: a tuple (list of (N, result, summary), largest unsaturated N
+        or 0)
+    """
+    runs = []
+    capacity = 0
+    for n in counts:
+        logging.info("Running {} boards at {} Hz for {} s".format(n, rate, duration))
+        result = run_load(n, rate=rate, duration=duration, **kwargs)
+        summary = summarize(result, rate, duration)
+        runs.append((n, result, summary))
+        logging.info(format_summary(n, summary))
+        saturated = (summary["failed"] > 0
+                or summary["drop_fraction"] > max_drop
+                or summary["min_throughput"] < (1.0 - max_drop)*rate*_nominal(rate, kwargs)
+                or summary["p99_ms"] > max_p99_ms)
+        if saturated:
+            logging.info("Saturated at {} boards".format(n))
+            break
+        capacity = n
+    return (runs, capacity)
+
+def summarize(result, rate, duration):
+    """Aggregate the per-board results of a run
+
+    :param result: The result of :py:func:`run_load`
+    :type result: dict
+    :returns: a map with the worst board's 'min_throughput', the pooled
+        latency percentiles 'p50_ms', 'p99_ms', 'p999_ms', the mean
+        'cpu_ms_per_board_s' (CPU ms per board per second), 'cpu_percent',
+        'rss_growth_kb', 'dropped', 'drop_fraction' and the number of
+        'failed' boards
+    """
+    boards = result["boards"]
+    lat = np.concatenate([b["latencies"] for b in boards]) if boards else np.zeros(0)
+    p50, p99, p999 = (np.percentile(lat, [50, 99, 99.9])*1e3).tolist() if len(lat) else (0.0, 0.0, 0.0)
+    dropped = sum(b["dropped"] for b in boards)
+    sent = sum(b["board_count"] for b in boards)
+    return {"min_throughput": min((b["throughput"] for b in boards), default=0.0),
+            "p50_ms": p50, "p99_ms": p99, "p999_ms": p999,
+            "cpu_ms_per_board_s": 1e3*sum(b["cpu_s"] for b in boards)/max(1, len(boards))/duration,
+            "cpu_percent": result["cpu_percent"], "rss_growth_kb": result["rss_growth_kb"],
+            "dropped": dropped, "drop_fraction": dropped/sent if sent else 0.0,
+            "failed": len(result.get("failed", ()))}
+
+def format_summary(n, summary):
+    """Format the summary of a run as one line"""
+    return ("N={:3d}: min {:.2f} Hz/board, latency p50 {:.2f} p99 {:.2f} p99.9 {:.2f} ms, "
+            "CPU {:.2f} ms/board/s ({:.1f}%), RSS +{} kB, dropped {} ({:.3%}), failed {}").format(
+            n, summary["min_throughput"], summary["p50_ms"], summary["p99_ms"], summary["p999_ms"],
+            summary["cpu_ms_per_board_s"], summary["cpu_percent"], summary["rss_growth_kb"],
+            summary["dropped"], summary["drop_fraction"], summary["failed"])
+
+def _nominal(rate, kwargs):
+    """[Internal] The fraction of the rate expected with a sample interval"""
+    interval_ms = (kwargs.get("frame_format") or {}).get("interval_ms", 0)
+    if interval_ms and 1e3/interval_ms < rate:
+        return 1e3/interval_ms/rate
+    return 1.0
+
+def _simulate(ids, rate, send_times, ports, stop):
+    """[Internal] Run simulated boards until stopped (simulator process)"""
+    times = np.frombuffer(send_times, dtype=np.float64)
+    boards = []
+    for ib in ids:
+        sim = TimedBoard(times[ib*RING:(ib+1)*RING], board_id=ib + 1, rate=rate)
+        ports.put((ib, sim.start()))
+        boards.append(sim)
+    stop.wait()
+    for sim in boards:
+        sim.close()
+
+def _collect(ib, port, send_times, sink_specs, frame_format, t_start, t_stop, on_measured=None):
+    """[Internal] Collect one board from now to t_stop and return its result"""
+    times = np.frombuffer(send_times, dtype=np.float64)[ib*RING:(ib+1)*RING]
+    inner = [sinks_module.create_sink(name, *[a.format(board=ib) if isinstance(a, str) else a
+            for a in args]) for name, args in sink_specs]
+    for sink in inner:
+        sink.open()
+    latency = LatencySink(times, inner)
+    latency.t_start = t_start
+    pt = Controller(port, sinks=[latency])
+    timer = threading.Timer(max(0.0, t_stop - time.monotonic()), pt.stop_collection)
+    timer.start()
+    cpu = [0.0, 0.0]
+    errors = []
+
+    def run():
+        cpu[0] = time.thread_time()
+        try:
+            pt.collect_samples(frame_format=frame_format)
+        except Exception as e:
+            errors.append(e)
+        cpu[1] = time.thread_time()
+    # the CPU time of the collection is that of the thread it runs in
+    worker = threading.Thread(target=run)
+    worker.start()
+    if on_measured is not None:
+        on_measured(t_start, t_stop)
+    worker.join()
+    timer.cancel()
+    for sink in inner:
+        sink.close()
+    if errors:
+        raise errors[0]
+    duration = t_stop - t_start
+    lat = np.array(latency.latencies)
+    pct = (np.percentile(lat, [50, 99, 99.9])*1e3).tolist() if len(lat) else [0.0]*3
+    return {"board": ib, "port": port, "samples": latency.samples,
+            "throughput": latency.samples/duration,
+            "latency_ms": {"p50": pct[0], "p99": pct[1], "p99.9": pct[2],
+                    "max": float(lat.max())*1e3 if len(lat) else 0.0},
+            "latencies": lat, "cpu_s": cpu[1] - cpu[0],
+            "dropped": pt.metrics.dropped, "resyncs": pt.metrics.resyncs,
+            "board_count": pt.metrics.samples + pt.metrics.dropped}
+
+def _collect_thread(ib, port, send_times, sink_specs, frame_format, t_start, t_stop, out):
+    """[Internal] Collect one board in a thread of the acquisition process"""
+    try:
+        out[ib] = _collect(ib, port, send_times, sink_specs, frame_format, t_start, t_stop)
+    except Exception as e:
+        logging.debug("Board {} collection failed".format(ib), exc_info=True)
+        out[ib] = _failed(ib, port, e)
+
+def _collect_process(ib, port, send_times, sink_specs, frame_format, t_start, t_stop, results):
+    """[Internal] Collect one board in a process of its own"""
+    rss = {}
+
+    def measured(t_start, t_stop):
+        time.sleep(max(0.0, t_start - time.monotonic()))
+        rss["start"] = _rss_kb()
+        time.sleep(max(0.0, t_stop - time.monotonic()))
+        rss["stop"] = _rss_kb()
+    cpu0 = time.process_time()
+    try:
+        result = _collect(ib, port, send_times, sink_specs, frame_format, t_start, t_stop, measured)
+    except Exception as e:
+        logging.debug("Board {} collection failed".format(ib), exc_info=True)
+        results.put(_failed(ib, port, e))
+        return
+    result["cpu_s"] = time.process_time() - cpu0
+    result["rss_growth_kb"] = rss.get("stop", 0) - rss.get("start", 0)
+    results.put(result)
+
+def _process_results(workers, results, port_of, deadline):
+    """[Internal] Gather the results of the collection processes
+
+    A process that exits without a result, or has none by the deadline
+    (monotonic time), gets a failed result.
+    """
+    boards = []
+    pending = dict(enumerate(workers))
+    while pending:
+        try:
+            result = results.get(timeout=1.0)
+        except queue.Empty:
+            for ib, w in list(pending.items()):
+                if not w.is_alive() and w.exitcode != 0:
+                    # a process that returned normally has put its result
+                    boards.append(_failed(ib, port_of[ib],
+                            "collection process exited with code {}".format(w.exitcode)))
+                    del pending[ib]
+            if time.monotonic() > deadline:
+                for ib, w in pending.items():
+                    w.terminate()
+                    boards.append(_failed(ib, port_of[ib], "no result from the collection process"))
+                pending.clear()
+            continue
+        if pending.pop(result["board"], None) is not None:
+            boards.append(result)
+    for w in workers:
+        w.join()
+    return boards
+
+def _failed(ib, port, error):
+    """[Internal] The result of a board whose collection failed"""
+    return {"board": ib, "port": port, "error": str(error) or repr(error)}
+
+def _rss_kb():
+    """[Internal] The resident set size of this process (kB)"""
+    try:
+        with open("/proc/self/statm") as hf:
+            return int(hf.read().split()[1])*os.sysconf("SC_PAGE_SIZE")//1024
+    except (OSError, ValueError):
+        # peak, not current, where /proc is not available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
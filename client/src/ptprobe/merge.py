@@ -0,0 +1,183 @@
+import heapq
+import threading
+from collections import deque
+
+from .gaps import WRAP
+from .sinks import SampleSink
+
+class TimeMerger:
+    """Merge the sample streams of several boards into one time-ordered stream
+
+    Each board's samples arrive in timestamp order, so the merger keeps one
+    FIFO per source and a heap holding only the head of each FIFO. Pushing
+    or emitting a sample costs O(log k) for k sources.
+
+    A sample is emitted once every source has reached its time, or once the
+    newest time seen on any source is more than the reorder window ahead of
+    it (a silent or lagging board cannot hold the others back indefinitely).
+    Samples that arrive after later samples have already been emitted are
+    counted in ``late_count`` and discarded.
+
+    Times are the board timestamps (ms), unwrapped per source across the
+    rollover of the uint32 counter, shifted by a per-source offset, so that
+    boards with different counter origins can be aligned.
+    """
+
+    def __init__(self, sources, window_ms=1000, offsets=None, output=None):
+        """Construct a merger
+
+        :param sources: The source keys (e.g. port names or board IDs)
+        :type sources: list
+        :param window_ms: The reorder window (ms)
+        :type window_ms: int
+        :param offsets: Offsets (ms) added to the timestamps of each source,
+            keyed by source (default 0 for all)
+        :type offsets: dict
+        :param output: Called as ``output(t, source, sample)`` for each
+            merged sample, in time order
+        :type output: callable
+        """
+        self.window_ms = window_ms
+        self.offsets = dict(offsets) if offsets else {}
+        self.output = output
+        self.late_count = 0
+        self.last_time = None
+        self._fifo = {src: deque() for src in sources}
+        self._latest = {src: None for src in sources}
+        self._last_raw = {src: None for src in sources}
+        self._wraps = {src: 0 for src in sources}
+        self._heap = []
+        self._newest = None
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def source(self, key):
+        """Get a sink that feeds samples from one source into the merger
+
+        :param key: The source key
+        :returns: a :py:class:`SampleSink` to pass to a :py:class:`board.Controller`
+        """
+        return _MergeSourceSink(self, key)
+
+    def push(self, key, sample):
+        """Add a sample from a source and emit any samples that are ready
+
+        :param key: The source key
+        :param sample: The sample, with the board timestamp (ms) as the first entry
+        :type sample: list
+        """
+        with self._lock:
+            t = self._unwrap(key, sample[0]) + self.offsets.get(key, 0)
+            if self.last_time is not None and t < self.last_time:
+                self.late_count += 1
+                return
+            fifo = self._fifo[key]
+            if not fifo:
+                heapq.heappush(self._heap, (t, self._seq, key))
+                self._seq += 1
+            fifo.append((t, sample))
+            self._latest[key] = t
+            if self._newest is None or t > self._newest:
+                self._newest = t
+            self._drain(self._watermark())
+
+    def flush(self):
+        """Emit all buffered samples, e.g. at the end of a collection"""
+        with self._lock:
+            self._drain(None)
+
+    def _unwrap(self, key, board_ms):
+        """[Internal] Unwrap a timestamp of a source across counter rollover"""
+        last = self._last_raw[key]
+        if last is not None and board_ms < last - WRAP//2:
+            self._wraps[key] += 1
+        self._last_raw[key] = board_ms
+        return board_ms + self._wraps[key]*WRAP
+
+    def _watermark(self):
+        """[Internal] The time up to which no earlier sample can still arrive"""
+        if None in self._latest.values():
+            complete = None
+        else:
+            complete = min(self._latest.values())
+        stale = self._newest - self.window_ms
+        return stale if complete is None else max(complete, stale)
+
+    def _drain(self, watermark):
+        """[Internal] Emit heads in time order up to the watermark (None for all)"""
+        heap = self._heap
+        while heap and (watermark is None or heap[0][0] <= watermark):
+            t, _, key = heapq.heappop(heap)
+            fifo = self._fifo[key]
+            _, sample = fifo.popleft()
+            if fifo:
+                heapq.heappush(heap, (fifo[0][0], self._seq, key))
+                self._seq += 1
+            self.last_time = t
+            if self.output is not None:
+                self.output(t, key, sample)
+
+class _MergeSourceSink (SampleSink):
+    """[Internal] Adapter from a controller sink to one merger source"""
+
+    def __init__(self, merger, key):
+        self.merger = merger
+        self.key = key
+
+    def write(self, sample, *args):
+        self.merger.push(self.key, sample)
+
+def merge_streams(streams, offsets=None):
+    """Merge already time-ordered sample iterables into one stream
+
+    The times are the board timestamps unwrapped per source across the
+    rollover of the uint32 counter, plus the source offset.
+
+    :param streams: The sample iterables, keyed by source
+    :type streams: dict
+    :param offsets: Offsets (ms) added to the timestamps of each source
+    :type offsets: dict
+    :returns: a generator of (time, source, sample) tuples in time order
+    """
+    offsets = offsets or {}
+    def keyed(key, it):
+        off = offsets.get(key, 0)
+        last = None
+        wraps = 0
+        for sample in it:
+            if last is not None and sample[0] < last - WRAP//2:
+                wraps += 1
+            last = sample[0]
+            yield (sample[0] + wraps*WRAP + off, key, sample)
+    return heapq.merge(*[keyed(k, it) for k, it in streams.items()],
+            key=lambda entry: entry[0])
+
+def resample(merged, period_ms, sources, start=None):
+    """Resample a merged stream onto a common time grid
+
+    Each grid point carries the most recent sample of every source at or
+    before that time (sample-and-hold), or None if a source has not yet
+    reported.
+
+    :param merged: The merged stream of (time, source, sample) tuples
+    :type merged: iterable
+    :param period_ms: The grid period (ms)
+    :type period_ms: int
+    :param sources: The source keys
+    :type sources: list
+    :param start: The first grid time (ms). Defaults to the first sample time
+        rounded up to the grid period.
+    :type start: int
+    :returns: a generator of (grid time, {source: sample}) tuples
+    """
+    held = {src: None for src in sources}
+    t_grid = start
+    for t, key, sample in merged:
+        if t_grid is None:
+            t_grid = -(-t // period_ms) * period_ms
+        while t > t_grid:
+            yield (t_grid, dict(held))
+            t_grid += period_ms
+        held[key] = sample
+    if t_grid is not None:
+        yield (t_grid, dict(held))
@@ -0,0 +1,158 @@
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+class MetadataCache:
+    """A time-limited cache of board metadata (ID, sensor status)
+
+    Entries are keyed by name ('board_id', 'P0'..'P3', 'T0'..'T3') and
+    expire after the time-to-live. Entries are stamped with wall-clock time,
+    so a cache saved to disk keeps its expiry across restarts.
+
+    The file holds the entries of several boards, each under an identity
+    such as the USB serial number or the board ID (see :py:meth:`bind`).
+    Until an identity is bound, the entries are only kept in memory, so a
+    board replaced on the same port is never served the metadata of the
+    one before. Updates inside :py:meth:`batch` are saved once at its end.
+    """
+
+    def __init__(self, ttl=300.0, path=None):
+        """Construct a cache
+
+        :param ttl: The time-to-live of an entry (s). None for no expiry.
+        :type ttl: float
+        :param path: An optional JSON file to load from and save to
+        :type path: str
+        """
+        self.ttl = ttl
+        self.path = path
+        self.identity = None
+        self.entries = {}
+        self.boards = {}    # the entries in the file, by board identity
+        self._depth = 0
+        self._dirty = False
+        if path is not None:
+            self.load()
+
+    def bind(self, identity):
+        """Select the board whose entries are loaded from and saved to the file
+
+        Entries set before binding are kept, as they were read from the
+        connected board; the stored entries of the board fill in the rest.
+
+        :param identity: The board identity, e.g. 'usb:<serial number>', or
+            None to keep the entries in memory only
+        :type identity: str
+        """
+        if identity == self.identity:
+            return
+        self.identity = identity
+        if identity is None:
+            return
+        changed = bool(self.entries)
+        self.entries = dict(self.boards.get(identity, {}), **self.entries)
+        if changed:
+            self._changed()
+
+    def get(self, key):
+        """Get an entry
+
+        :param key: The entry name
+        :type key: str
+        :returns: the value, or None if missing or expired
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        stamp, value = entry
+        if self._expired(stamp):
+            del self.entries[key]
+            return None
+        return value
+
+    def put(self, key, value):
+        """Set an entry and save the cache if it has a file (at the end of a batch)
+
+        :param key: The entry name
+        :type key: str
+        :param value: The value
+        """
+        self.entries[key] = (time.time(), value)
+        self._changed()
+
+    def invalidate(self, *keys):
+        """Drop the named entries, or all entries if none are named"""
+        if keys:
+            for key in keys:
+                self.entries.pop(key, None)
+        else:
+            self.entries.clear()
+        self._changed()
+
+    @contextmanager
+    def batch(self):
+        """Save the cache once after a group of updates, not after each one"""
+        self._depth += 1
+        try:
+            yield self
+        finally:
+            self._depth -= 1
+            if self._depth == 0 and self._dirty:
+                self.save()
+
+    def load(self):
+        """Load the entries of all boards from the cache file, if it exists"""
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as hf:
+                raw = json.load(hf)
+            self.boards = {identity: {k: (stamp, _decode(k, v)) for k, (stamp, v) in entries.items()}
+                    for identity, entries in raw.items()}
+        except (ValueError, TypeError, AttributeError, OSError) as e:
+            logging.warning("Ignoring metadata cache {}: {}".format(self.path, e))
+            self.boards = {}
+        if self.identity is not None:
+            self.entries = dict(self.boards.get(self.identity, {}))
+
+    def save(self):
+        """Write the unexpired entries of all boards to the cache file"""
+        self._dirty = False
+        if self.path is None or self.identity is None:
+            return
+        self.boards[self.identity] = dict(self.entries)
+        raw = {}
+        for identity, entries in self.boards.items():
+            kept = {k: (stamp, _encode(k, v)) for k, (stamp, v) in entries.items()
+                    if not self._expired(stamp)}
+            if kept:
+                raw[identity] = kept
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = "{}.tmp".format(self.path)
+        with open(tmp, "w") as hf:
+            json.dump(raw, hf, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def _changed(self):
+        """[Internal] Save now, or at the end of the batch in progress"""
+        self._dirty = True
+        if self._depth == 0:
+            self.save()
+
+    def _expired(self, stamp):
+        """[Internal] Whether an entry stamped at a time has expired"""
+        return self.ttl is not None and time.time() - stamp > self.ttl
+
+def _encode(key, value):
+    """[Internal] Make an entry JSON-serializable (ROM addresses as hex)"""
+    if key.startswith("T"):
+        value = dict(value, address=bytes(value["address"]).hex())
+    return value
+
+def _decode(key, value):
+    """[Internal] Restore an entry read from JSON"""
+    if key.startswith("T"):
+        value = dict(value, address=bytes.fromhex(value["address"]))
+    return value
@@ -0,0 +1,310 @@
+import math
+import os
+from bisect import bisect_left
+
+class RunningStats:
+    """Running mean, variance, minimum and maximum (Welford's method)"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, x):
+        """Add an observation
+
+        :param x: The observed value
+        :type x: float
+        """
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta/self.n
+        self.m2 += delta*(x - self.mean)
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+
+    def add_batch(self, n, mean, m2, xmin, xmax):
+        """Merge the statistics of a batch of observations (Chan's method)
+
+        :param n: The number of observations in the batch
+        :type n: int
+        :param mean: The batch mean
+        :type mean: float
+        :param m2: The sum of squared deviations from the batch mean
+        :type m2: float
+        :param xmin: The batch minimum
+        :type xmin: float
+        :param xmax: The batch maximum
+        :type xmax: float
+        """
+        if n == 0:
+            return
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta*n/total
+        self.m2 += m2 + delta*delta*self.n*n/total
+        self.n = total
+        if xmin < self.min:
+            self.min = xmin
+        if xmax > self.max:
+            self.max = xmax
+
+    @property
+    def variance(self):
+        """The sample variance (0 with fewer than two observations)"""
+        return self.m2/(self.n - 1) if self.n > 1 else 0.0
+
+class Histogram:
+    """A fixed-bucket histogram (cumulative buckets as in Prometheus)"""
+
+    # 10us to 1s, roughly 3 buckets per decade
+    DEFAULT_BOUNDS = (1e-5, 2e-5, 5e-5, 1e-4, 2e-4, 5e-4,
+            1e-3, 2e-3, 5e-3, 1e-2, 2e-2, 5e-2, 0.1, 0.2, 0.5, 1.0)
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        """Construct a histogram
+
+        :param bounds: The ascending upper bounds of the buckets (s). A final
+            +Inf bucket is implied.
+        :type bounds: tuple
+        """
+        self.bounds = tuple(bounds)
+        self.counts = [0]*(len(self.bounds) + 1)
+        self.sum = 0.0
+        self.n = 0
+
+    def observe(self, x):
+        """Add an observation
+
+        :param x: The observed value (s)
+        :type x: float
+        """
+        self.counts[bisect_left(self.bounds, x)] += 1
+        self.sum += x
+        self.n += 1
+
+    def cumulative(self):
+        """The cumulative counts per upper bound, ending with +Inf
+
+        :returns: a list of (bound, count) tuples
+        """
+        out = []
+        total = 0
+        for bound, count in zip(self.bounds + (math.inf,), self.counts):
+            total += count
+            out.append((bound, total))
+        return out
+
+class AcquisitionMetrics:
+    """Health counters for one controller's sample collection
+
+    Updating the metrics costs a few additions per frame, so they are always
+    enabled. Inter-arrival and decode times are in microseconds, sink write
+    latencies in seconds.
+    """
+
+    def __init__(self, labels=None):
+        """Construct a metrics object
+
+        :param labels: Labels attached to every exported metric, e.g.
+            ``{'port': '/dev/ttyACM0'}``
+        :type labels: dict
+        """
+        self.labels = dict(labels) if labels else {}
+        self.on_snapshot = None
+        self.snapshot_interval = 10.0
+        self.reset()
+
+    def reset(self):
+        """Clear all counters"""
+        self.bytes_read = 0
+        self.frames_decoded = 0
+        self.header_errors = 0
+        self.resyncs = 0
+        self.skipped_bytes = 0
+        self.reconnects = 0
+        self.samples = 0
+        self.dropped = 0
+        self.interarrival = RunningStats()
+        self.decode = RunningStats()
+        self.sink_latency = {}
+        self._run_start = 0
+        self._t_last = None
+        self._t_snapshot = None
+
+    def start_run(self):
+        """Mark the start of a collection run"""
+        self._run_start = self.samples
+        self._t_last = None
+
+    def data_frame(self, t_arrival, nbytes):
+        """Record the arrival of a DATA frame
+
+        :param t_arrival: The host time of arrival (s, :py:func:`time.perf_counter`)
+        :type t_arrival: float
+        :param nbytes: The frame length including the header
+        :type nbytes: int
+        """
+        self.bytes_read += nbytes
+        self.frames_decoded += 1
+        self.samples += 1
+        if self._t_last is not None:
+            self.interarrival.add((t_arrival - self._t_last)*1e6)
+        self._t_last = t_arrival
+
+    def halt_frame(self, board_count, nbytes):
+        """Record the HALT frame, which reports the board's sample count
+
+        :param board_count: The number of samples sent by the board in this run
+        :type board_count: int
+        :param nbytes: The frame length including the header
+        :type nbytes: int
+        """
+        self.bytes_read += nbytes
+        self.frames_decoded += 1
+        received = self.samples - self._run_start
+        if board_count > received:
+            self.dropped += board_count - received
+
+    def sink_write(self, key, dt):
+        """Record the latency of a sink write
+
+        :param key: The sink label
+        :type key: str
+        :param dt: The write duration (s)
+        :type dt: float
+        """
+        hist = self.sink_latency.get(key)
+        if hist is None:
+            hist = self.sink_latency[key] = Histogram()
+        hist.observe(dt)
+
+    def maybe_snapshot(self, now):
+        """Call the snapshot callback if the snapshot interval has elapsed
+
+        :param now: The current host time (s, :py:func:`time.perf_counter`)
+        :type now: float
+        """
+        if self.on_snapshot is None:
+            return
+        if self._t_snapshot is None:
+            self._t_snapshot = now
+        elif now - self._t_snapshot >= self.snapshot_interval:
+            self._t_snapshot = now
+            self.on_snapshot(self.snapshot())
+
+    def snapshot(self):
+        """Get a copy of the current values
+
+        :returns: a map of metric names to values
+        """
+        return {
+            "labels": dict(self.labels),
+            "bytes_read": self.bytes_read,
+            "frames_decoded": self.frames_decoded,
+            "header_errors": self.header_errors,
+            "resyncs": self.resyncs,
+            "skipped_bytes": self.skipped_bytes,
+            "reconnects": self.reconnects,
+            "samples": self.samples,
+            "dropped": self.dropped,
+            "interarrival_us": _stats_dict(self.interarrival),
+            "decode_us": _stats_dict(self.decode),
+            "sink_latency_s": {k: {"count": h.n, "sum": h.sum,
+                    "buckets": h.cumulative()} for k, h in list(self.sink_latency.items())},
+        }
+
+    def to_prometheus(self):
+        """Format the metrics in the Prometheus text exposition format
+
+        :returns: the metrics as text
+        """
+        return format_prometheus([self])
+
+def format_prometheus(metrics):
+    """Format the metrics of several controllers as one Prometheus text document
+
+    :param metrics: The metrics objects
+    :type metrics: list of :py:class:`AcquisitionMetrics`
+    :returns: the document as text
+    """
+    groups = {}
+    for m in metrics:
+        for name, line in _prometheus_samples(m):
+            groups.setdefault(name, []).append(line)
+    out = []
+    for name, lines in groups.items():
+        kind, help_text = _PROM_META[name]
+        out.append("# HELP ptprobe_{} {}\n".format(name, help_text))
+        out.append("# TYPE ptprobe_{} {}\n".format(name, kind))
+        out.extend(lines)
+    return "".join(out)
+
+def write_prometheus(path, metrics):
+    """Write the metrics of several controllers to a Prometheus text file
+
+    The file is replaced atomically, so a collector never reads a partial file.
+
+    :param path: The output path (e.g. for the node_exporter textfile collector)
+    :type path: str
+    :param metrics: The metrics objects
+    :type metrics: list of :py:class:`AcquisitionMetrics`
+    """
+    tmp = "{}.tmp".format(path)
+    with open(tmp, "w") as hf:
+        hf.write(format_prometheus(metrics))
+    os.replace(tmp, path)
+
+_PROM_META = {
+    "bytes_read_total": ("counter", "Bytes read from the serial port"),
+    "frames_decoded_total": ("counter", "Frames decoded"),
+    "header_errors_total": ("counter", "Frames rejected for a bad header"),
+    "resyncs_total": ("counter", "Losses of framing followed by a resynchronization"),
+    "skipped_bytes_total": ("counter", "Bytes dropped while resynchronizing"),
+    "reconnects_total": ("counter", "Port reopened after the board went silent"),
+    "samples_total": ("counter", "Samples received"),
+    "dropped_total": ("counter", "Samples reported by the board but not received"),
+    "interarrival_us": ("gauge", "Sample inter-arrival time statistics (us)"),
+    "decode_us": ("gauge", "Frame decode time statistics (us)"),
+    "sink_write_seconds": ("histogram", "Sink write latency (s)"),
+}
+
+def _stats_dict(stats):
+    """[Internal] Running statistics as a map"""
+    return {"n": stats.n, "mean": stats.mean, "variance": stats.variance,
+            "min": stats.min if stats.n else 0.0, "max": stats.max if stats.n else 0.0}
+
+def _labels(labels, **extra):
+    """[Internal] Format a Prometheus label set"""
+    items = list(labels.items()) + list(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace('"', '\\"')) for k, v in items) + "}"
+
+def _prometheus_samples(m):
+    """[Internal] Generate (metric name, sample line) pairs"""
+    snap = m.snapshot()
+    lbl = snap["labels"]
+    for name in ("bytes_read", "frames_decoded", "header_errors", "resyncs", "skipped_bytes",
+            "reconnects", "samples", "dropped"):
+        yield ("{}_total".format(name),
+                "ptprobe_{}_total{} {}\n".format(name, _labels(lbl), snap[name]))
+    for name in ("interarrival_us", "decode_us"):
+        for stat, val in snap[name].items():
+            yield (name, "ptprobe_{}{} {}\n".format(name, _labels(lbl, stat=stat), val))
+    for key, hist in snap["sink_latency_s"].items():
+        for bound, count in hist["buckets"]:
+            le = "+Inf" if bound == math.inf else repr(bound)
+            yield ("sink_write_seconds", "ptprobe_sink_write_seconds_bucket{} {}\n".format(
+                    _labels(lbl, sink=key, le=le), count))
+        yield ("sink_write_seconds", "ptprobe_sink_write_seconds_sum{} {}\n".format(
+                _labels(lbl, sink=key), hist["sum"]))
+        yield ("sink_write_seconds", "ptprobe_sink_write_seconds_count{} {}\n".format(
+                _labels(lbl, sink=key), hist["count"]))
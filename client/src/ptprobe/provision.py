@@ -0,0 +1,251 @@
+import argparse
+import json
+import logging
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import serial
+
+from .board import Controller, BadHeader, BadPacket, BoardTimeout
+from . import discovery
+
+_COMM_ERRORS = (serial.SerialException, OSError, BadHeader, BadPacket, BoardTimeout,
+        struct.error, IndexError)
+
+# boards are provisioned in threads that share the port cache file
+_cache_lock = threading.Lock()
+
+def load_manifest(filename):
+    """Load a provisioning manifest
+
+    The manifest is a JSON list with one entry per board::
+
+        [{"port": "/dev/ttyACM0", "id": 1001,
+          "coefficients": [-97.35308, 920.6867, -14.86687], "debug_level": 0},
+         {"board_id": 1002, "id": 2002,
+          "coefficients": [[0, 1, 0], [0, 1, 0], [0, 1, 0], [0, 1, 0]]}]
+
+    Boards are addressed by 'port' or by their current 'board_id'. The
+    coefficients are either one [a0, a1, a2] list for all channels or one
+    list per channel. 'id', 'coefficients' and 'debug_level' are optional.
+
+    :param filename: The manifest file
+    :type filename: str
+    :returns: the list of entries
+    """
+    with open(filename) as hf:
+        entries = json.load(hf)
+    for entry in entries:
+        if ("port" in entry) == ("board_id" in entry):
+            raise ValueError("Manifest entry needs one of 'port' or 'board_id': {}".format(entry))
+    return entries
+
+def _channel_coeffs(coefficients):
+    """[Internal] Expand the manifest coefficients to a map by channel"""
+    if coefficients is None:
+        return None
+    if all(isinstance(a, (int, float)) for a in coefficients):
+        return {ich: list(coefficients) for ich in range(4)}
+    if len(coefficients) != 4:
+        raise ValueError("Expected coefficients for 4 channels")
+    return {ich: list(ai) for ich, ai in enumerate(coefficients)}
+
+def _f32(x):
+    """[Internal] Round to the single precision stored on the board"""
+    return struct.unpack('<f', struct.pack('<f', x))[0]
+
+def wait_for_board(port, timeout=20.0, poll=0.25, expect_id=None, serial_number=None,
+        quiet=False):
+    """Poll until the board answers a board ID request
+
+    After a reset the USB device disappears and is enumerated again, 
+    possibly under another port name, so open and read errors are expected
+    while polling. With a USB serial number the board is looked up by it on
+    every attempt rather than on the given port.
+
+    :param port: The serial port
+    :type port: str
+    :param timeout: The maximum wait (s)
+    :type timeout: float
+    :param poll: The read timeout and delay between attempts (s)
+    :type poll: float
+    :param expect_id: If set, keep polling until the board reports this ID
+    :type expect_id: int
+    :param serial_number: The USB serial number of the board
+    :type serial_number: str
+    :param quiet: Set the debug level to 0 before each request, for boards
+        that start with debug messages enabled
+    :type quiet: bool
+    :returns: a tuple (board ID, port), (None, None) on timeout
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if serial_number is not None:
+            port = next((p.device for p in discovery.candidate_ports()
+                    if p.serial_number == serial_number), None)
+        if port is not None:
+            if quiet:
+                try:
+                    Controller(port).set_debug_level(0)
+                except (serial.SerialException, OSError) as e:
+                    logging.debug("No board on {}: {}".format(port, e))
+            board_id = discovery.probe(port, timeout=poll)
+            if board_id is not None and (expect_id is None or board_id == expect_id):
+                return (board_id, port)
+        time.sleep(poll)
+    return (None, None)
+
+def provision_board(port, entry, store=True, reset_timeout=20.0, timeout=1.0, cache=None):
+    """Configure, verify and optionally store the configuration of one board
+
+    Debug messages would corrupt the readback, so the debug level is set to
+    0 before it, whatever the manifest says, and the manifest level is
+    applied after it. The port cache entry of the board is updated with a new
+    board ID: set if it was stored, dropped if the board will return to its
+    stored ID on reset.
+
+    :param port: The serial port
+    :type port: str
+    :param entry: The manifest entry
+    :type entry: dict
+    :param store: Write the configuration to Flash and reset the board
+    :type store: bool
+    :param reset_timeout: The maximum wait for the board after reset (s)
+    :type reset_timeout: float
+    :param timeout: The serial read timeout (s)
+    :type timeout: float
+    :param cache: The port cache to update (default: the cache in the
+        user's home directory). Pass False to leave it alone.
+    :type cache: :py:class:`discovery.PortCache`
+    :returns: a result map with 'port', 'board_id', 'ok' and 'errors'
+    """
+    result = {"port": port, "board_id": None, "ok": False, "errors": []}
+    coeffs = _channel_coeffs(entry.get("coefficients"))
+    new_id = entry.get("id")
+    debug_level = entry.get("debug_level")
+    serial_number = next((p.serial_number for p in discovery.candidate_ports()
+            if p.device == port), None)
+    pt = Controller(port)
+    pt.comm.timeout = timeout
+    pt.comm.write_timeout = timeout
+    try:
+        # quiet for the readback, also a board left at a debug level by
+        # earlier use; the manifest level is set once the readback passed
+        pt.configure(board_id=new_id, P_coeffs=coeffs, debug_level=0)
+
+        # commands are handled in order, so the readback sees the new values
+        result["board_id"] = pt.board_id()
+        if new_id is not None and result["board_id"] != new_id:
+            result["errors"].append("board ID {} != {}".format(result["board_id"], new_id))
+        for ich, ai in (coeffs or {}).items():
+            got = pt.sensor_status_P(ich)["ai"]
+            want = [_f32(a) for a in ai] + got[len(ai):]
+            if got != want:
+                result["errors"].append("ch{} coefficients {} != {}".format(ich, got, want))
+
+        if not result["errors"] and debug_level is not None:
+            pt.set_debug_level(debug_level)
+        if store and not result["errors"]:
+            pt.store_board_config(True)
+            pt.reset_board()
+            board_id, port = wait_for_board(port, reset_timeout, expect_id=new_id,
+                    serial_number=serial_number, quiet=bool(debug_level))
+            if board_id is None:
+                result["errors"].append("board did not come back after reset")
+            else:
+                result["port"] = port
+                if debug_level:
+                    Controller(port).set_debug_level(debug_level)
+        if new_id is not None and not result["errors"]:
+            _update_cache(cache, serial_number, new_id if store else None)
+    except _COMM_ERRORS as e:
+        result["errors"].append("{}: {}".format(type(e).__name__, e))
+
+    result["ok"] = not result["errors"]
+    return result
+
+def _update_cache(cache, serial_number, board_id):
+    """[Internal] Set the board ID of a USB serial number in the port cache, None to drop it"""
+    if cache is False or serial_number is None:
+        return
+    with _cache_lock:
+        if cache is None:
+            cache = discovery.PortCache()
+        if board_id is None:
+            cache.forget(serial_number)
+        else:
+            cache.set(serial_number, board_id)
+        cache.save()
+
+def provision(entries, store=True, reset_timeout=20.0, timeout=1.0, cache=None):
+    """Provision all boards of a manifest concurrently
+
+    :param entries: The manifest entries (see :py:func:`load_manifest`)
+    :type entries: list
+    :param store: Write the configurations to Flash and reset the boards
+    :type store: bool
+    :param reset_timeout: The maximum wait for a board after reset (s)
+    :type reset_timeout: float
+    :param timeout: The serial read timeout (s)
+    :type timeout: float
+    :param cache: The port cache used to find boards by ID and updated
+        with new IDs (default: the cache in the user's home directory). Pass
+        False to disable caching.
+    :type cache: :py:class:`discovery.PortCache`
+    :returns: a list of result maps (see :py:func:`provision_board`), in
+        manifest order
+    """
+    if cache is None:
+        cache = discovery.PortCache()
+    by_id = {}
+    if any("board_id" in entry for entry in entries):
+        by_id = discovery.discover(timeout=timeout, cache=cache)
+
+    jobs = []
+    results = [None]*len(entries)
+    for i, entry in enumerate(entries):
+        port = entry.get("port") or by_id.get(entry["board_id"])
+        if port is None:
+            results[i] = {"port": None, "board_id": entry["board_id"], "ok": False,
+                    "errors": ["board not found"]}
+        else:
+            jobs.append((i, port, entry))
+
+    if jobs:
+        with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+            futures = [(i, pool.submit(provision_board, port, entry, store, reset_timeout, timeout,
+                    cache)) for i, port, entry in jobs]
+            for i, future in futures:
+                results[i] = future.result()
+    return results
+
+def main(argv=None):
+    format = "%(asctime)s: %(message)s"
+    logging.basicConfig(format=format, level=logging.INFO, datefmt="%H:%M:%S")
+
+    parser = argparse.ArgumentParser(description='Configure a batch of PTProbe boards')
+    parser.add_argument('manifest', help='JSON manifest of board configurations')
+    parser.add_argument('--no-store', action='store_true',
+            help='Verify the configuration without writing it to flash')
+    parser.add_argument('--reset-timeout', type=float, default=20.0,
+            help='Maximum wait for a board to restart after reset (s). Default is 20s')
+    parser.add_argument('-t', '--timeout', type=float, default=1.0,
+            help='Serial read timeout (s). Default is 1s')
+    args = parser.parse_args(argv)
+
+    entries = load_manifest(args.manifest)
+    logging.info("Provisioning {} board(s)".format(len(entries)))
+    results = provision(entries, store=not args.no_store,
+            reset_timeout=args.reset_timeout, timeout=args.timeout)
+
+    for res in results:
+        status = "ok" if res["ok"] else "FAILED"
+        print("{}: board {} {}".format(res["port"], res["board_id"], status))
+        for err in res["errors"]:
+            print("  + {}".format(err))
+    return 0 if all(res["ok"] for res in results) else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
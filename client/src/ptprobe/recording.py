@@ -0,0 +1,258 @@
+import io
+import logging
+import os
+
+import numpy as np
+
+from .sinks import CSV_COLUMNS, ACCEL_CSV_COLUMNS
+
+CHUNK_BYTES = 1 << 24
+
+def column_dtype(name):
+    """The NumPy type of a recorded column
+
+    :param name: The column name, e.g. from :py:data:`sinks.CSV_COLUMNS`
+    :type name: str
+    :returns: the dtype
+    """
+    if name == "Time":
+        return np.dtype(np.int64)
+    if name.endswith("Active T"):
+        return np.dtype(bool)
+    if name.endswith("Error Code"):
+        return np.dtype(np.int32)
+    return np.dtype(np.float64)
+
+def csv_layout(ncols):
+    """The column names of a CSV recording with a number of columns
+
+    :param ncols: The number of values per line
+    :type ncols: int
+    :returns: :py:data:`sinks.CSV_COLUMNS` for PT Probe samples,
+        :py:data:`sinks.ACCEL_CSV_COLUMNS` for accelerometer readings,
+        otherwise 'c0', 'c1', ...
+    """
+    if ncols == len(CSV_COLUMNS):
+        return list(CSV_COLUMNS)
+    if ncols == len(ACCEL_CSV_COLUMNS):
+        return list(ACCEL_CSV_COLUMNS)
+    return ["c{}".format(i) for i in range(ncols)]
+
+def iter_csv(filename, columns=None, t_range=None, chunk_bytes=CHUNK_BYTES, start=0, stop=None):
+    """Parse a CSV recording in chunks of typed columns
+
+    The file is read in blocks of whole lines, each parsed by NumPy in one
+    call, so memory use is bounded by the chunk size. Only the selected
+    columns are converted. Files written by
+    :py:class:`sinks.CsvSampleSink` (", " separators, True/False flags) are
+    read as they are; a header line is skipped, and malformed lines (e.g.
+    a line cut off when a recording was interrupted) are dropped with a
+    warning.
+
+    :param filename: The CSV file
+    :type filename: str
+    :param columns: The names or indices of the columns to keep, None for all
+    :type columns: list
+    :param t_range: Keep the rows with ``t_range[0] <= Time < t_range[1]``
+        (board ms), either bound may be None
+    :type t_range: tuple
+    :param chunk_bytes: The approximate number of bytes parsed per chunk
+    :type chunk_bytes: int
+    :param start: Parse the lines starting at or after this byte offset
+    :type start: int
+    :param stop: Parse the lines starting before this byte offset, None for
+        the rest of the file. Consecutive ranges parse each line once.
+    :type stop: int
+    :returns: a generator of maps of column names to arrays
+    """
+    with open(filename, "rb") as hf:
+        if start > 0:
+            hf.seek(start - 1)
+            hf.readline()   # the line in progress belongs to the previous range
+        rest = b''
+        layout = None
+        at_stop = False
+        while True:
+            data = b'' if at_stop else hf.read(chunk_bytes)
+            if stop is not None and data:
+                over = hf.tell() - stop
+                if over >= 0:
+                    # end with the line in progress at the stop offset
+                    cut = data.find(b'\n', max(0, len(data) - over - 1))
+                    if cut >= 0:
+                        data = data[:cut+1]
+                        at_stop = True
+            if not data:
+                text = rest
+                rest = b''
+            else:
+                data = rest + data
+                end = data.rfind(b'\n') + 1
+                text, rest = data[:end], data[end:]
+            if layout is None:
+                text = _skip_header(text)
+                first = text[:text.find(b'\n')] if b'\n' in text else text
+                if first.strip():
+                    layout = csv_layout(first.count(b',') + 1)
+                    keep = _select(layout, columns)
+                    time_col = _time_column(layout, t_range)
+                    parsed = sorted(set(keep + ([time_col] if time_col else [])),
+                            key=layout.index)
+                    usecols = [layout.index(name) for name in parsed]
+                    flags = any(column_dtype(name) == bool for name in parsed)
+            if layout is not None and text.strip():
+                values = _parse(text, len(layout), usecols, flags)
+                yield _columns(values, parsed, keep, time_col, t_range)
+            if not data:
+                return
+
+def load_csv(filename, columns=None, t_range=None, chunk_bytes=CHUNK_BYTES, cache=False):
+    """Load a CSV recording into typed columns
+
+    With ``cache``, all columns are saved after parsing as a binary sidecar
+    (``<filename>.npy``), which later loads are served from while it is newer
+    than the CSV file. The sidecar is memory-mapped, so a later load only
+    reads the selected rows and columns.
+
+    :param filename: The CSV file
+    :type filename: str
+    :param columns: The names or indices of the columns to keep, None for all
+    :type columns: list
+    :param t_range: Keep the rows with ``t_range[0] <= Time < t_range[1]``
+        (board ms), either bound may be None
+    :type t_range: tuple
+    :param chunk_bytes: The approximate number of bytes parsed per chunk
+    :type chunk_bytes: int
+    :param cache: Use and create the binary sidecar
+    :type cache: bool
+    :returns: a map of column names to arrays, in file order
+    """
+    sidecar = filename + ".npy"
+    if cache:
+        if (os.path.exists(sidecar)
+                and os.path.getmtime(sidecar) >= os.path.getmtime(filename)):
+            table = np.load(sidecar, mmap_mode="r")
+        else:
+            table = _to_table(iter_csv(filename, chunk_bytes=chunk_bytes))
+            tmp = sidecar + ".tmp"
+            with open(tmp, "wb") as hf:
+                np.save(hf, table)
+            os.replace(tmp, sidecar)
+        layout = list(table.dtype.names)
+        time_col = _time_column(layout, t_range)
+        rows = slice(None)
+        if time_col is not None:
+            rows = _in_range(table[time_col], t_range)
+        return {name: np.asarray(table[name][rows]) for name in _select(layout, columns)}
+
+    chunks = list(iter_csv(filename, columns, t_range, chunk_bytes))
+    if not chunks:
+        return {}
+    return {name: np.concatenate([c[name] for c in chunks]) for name in chunks[0]}
+
+def _skip_header(text):
+    """[Internal] Drop a leading line that does not start with a number"""
+    first = text.lstrip()[:1]
+    if first and not (first.isdigit() or first in b'-+.'):
+        return text[text.find(b'\n') + 1:] if b'\n' in text else b''
+    return text
+
+def _select(layout, columns):
+    """[Internal] The names of the selected columns, in file order"""
+    if columns is None:
+        return list(layout)
+    names = set(layout[c] if isinstance(c, int) else c for c in columns)
+    missing = names.difference(layout)
+    if missing:
+        raise KeyError("Unknown columns: {}".format(", ".join(sorted(missing))))
+    return [name for name in layout if name in names]
+
+def _time_column(layout, t_range):
+    """[Internal] The column filtered by a time range, None for no filter"""
+    if t_range is None:
+        return None
+    if "Time" not in layout:
+        raise ValueError("Time range filter on a recording without a Time column")
+    return "Time"
+
+def _in_range(t, t_range):
+    """[Internal] A row mask for a time range"""
+    lo, hi = t_range
+    keep = np.ones(len(t), dtype=bool)
+    if lo is not None:
+        keep &= t >= lo
+    if hi is not None:
+        keep &= t < hi
+    return keep
+
+def _parse(text, ncols, usecols, flags=True):
+    """[Internal] Parse whole lines to a float array with one row per line
+
+    NumPy's C reader (1.23 and later) parses a chunk faster than
+    ``np.fromstring`` or splitting the lines. A chunk with malformed lines
+    is parsed again without them, in one call, and only a chunk with bad
+    values that still fails is parsed line by line.
+
+    :param flags: The parsed columns include True/False values
+    """
+    if flags:
+        text = _flags(text)
+    try:
+        return _loadtxt(text, usecols)
+    except ValueError:
+        pass
+    text = _flags(text)
+    # drop the lines with a wrong number of values, e.g. a line cut off when
+    # a recording was interrupted
+    lines = []
+    for line in text.splitlines():
+        if line.count(b',') == ncols - 1:
+            lines.append(line)
+        elif line.strip():
+            logging.warning("Dropped malformed line: {}".format(line[:80]))
+    try:
+        return _loadtxt(b'\n'.join(lines), usecols)
+    except ValueError:
+        pass
+    rows = []
+    for line in lines:
+        try:
+            row = np.array(line.split(b','), dtype=np.float64)
+        except ValueError:
+            logging.warning("Dropped malformed line: {}".format(line[:80]))
+            continue
+        rows.append(row[usecols])
+    return np.array(rows, dtype=np.float64).reshape(-1, len(usecols))
+
+def _flags(text):
+    """[Internal] Replace the True/False flags of a CsvSampleSink file by 1/0"""
+    return text.replace(b"True", b"1").replace(b"False", b"0")
+
+def _loadtxt(text, usecols):
+    """[Internal] Parse lines of comma separated numbers with NumPy"""
+    if not text.strip():
+        return np.zeros((0, len(usecols)))
+    return np.loadtxt(io.BytesIO(text), delimiter=',', usecols=usecols, ndmin=2)
+
+def _columns(values, parsed, keep, time_col, t_range):
+    """[Internal] Split a parsed chunk into typed, filtered columns
+
+    :param parsed: The names of the columns of values
+    :param keep: The names of the columns to return
+    """
+    rows = slice(None)
+    if time_col is not None:
+        rows = _in_range(values[:, parsed.index(time_col)], t_range)
+    return {name: values[rows, parsed.index(name)].astype(column_dtype(name)) for name in keep}
+
+def _to_table(chunks):
+    """[Internal] Concatenate parsed chunks into one structured array"""
+    chunks = list(chunks)
+    if not chunks:
+        return np.zeros(0, dtype=[("c0", np.float64)])
+    names = list(chunks[0])
+    table = np.empty(sum(len(c[names[0]]) for c in chunks),
+            dtype=[(name, column_dtype(name)) for name in names])
+    for name in names:
+        table[name] = np.concatenate([c[name] for c in chunks])
+    return table
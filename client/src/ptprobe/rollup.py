@@ -0,0 +1,207 @@
+import sqlite3
+import time
+
+from .metrics import RunningStats
+from .sinks import SampleSink
+
+# the tier resolutions (s), finest first
+TIERS = (1, 60, 3600)
+
+class _Bucket (RunningStats):
+    """[Internal] The statistics and the number of thermocouple faults of one interval"""
+
+    def reset(self):
+        super().reset()
+        self.faults = 0
+
+    @classmethod
+    def from_row(cls, row):
+        """A bucket from a stored (count, min, max, mean, variance, faults) row"""
+        b = cls()
+        n, xmin, xmax, mean, variance, faults = row
+        b.faults = faults
+        if n:
+            b.add_batch(n, mean, variance*(n - 1), xmin, xmax)
+        return b
+
+    def merge(self, other):
+        self.faults += other.faults
+        self.add_batch(other.n, other.mean, other.m2, other.min, other.max)
+
+class RollupSink (SampleSink):
+    """Maintain 1 s, 1 min and 1 h aggregates of the samples in an SQLite file
+
+    Per channel (P0-P3, T0-T3, Tref0-Tref3) and interval, the count, minimum,
+    maximum, mean, variance and the number of thermocouple faults are
+    updated as samples are written. Channels that are not active are 
+    skipped, as their values read 0. Only the 1 s buckets are updated per
+    sample: a closed bucket is merged into the bucket of the next tier, and
+    written to the file. Queries (see :py:class:`RollupStore`) then read a
+    few rows instead of the raw samples. Buckets still open are written
+    when their interval ends or the sink is closed; a bucket that is already
+    in the file (e.g. from an earlier collection in the same hour) is
+    merged with it.
+
+    If a :py:class:`clock.ClockModel` is supplied, samples are placed in
+    time by the board timestamp mapped to UTC; otherwise by the host time
+    at write.
+    """
+
+    def __init__(self, path, board_id=0, clock=None, P_channels=None):
+        """Construct a sink
+
+        :param path: The SQLite file, e.g. next to the raw recording
+        :type path: str
+        :param board_id: The board ID stored with the aggregates
+        :type board_id: int
+        :param clock: An optional :py:class:`clock.ClockModel`
+        :param P_channels: The pressure channels to aggregate, None for the
+            channels whose active flag is set. The samples have no pressure
+            flags: pass the channels selected with 
+            :py:meth:`board.Controller.set_frame_format` to aggregate 
+            pressure without thermocouples.
+        :type P_channels: list
+        """
+        self.path = path
+        self.board_id = board_id
+        self.clock = clock
+        self.P_channels = None if P_channels is None else set(P_channels)
+        self.client = None
+        self._open = {}     # tier -> (interval start, {channel: bucket})
+
+    def set_board_id(self, id):
+        self.board_id = id
+
+    def open(self):
+        self.close()
+        self.client = sqlite3.connect(self.path, check_same_thread=False)
+        _create(self.client)
+
+    def close(self):
+        """Write the open buckets and close the file"""
+        if self.client is None:
+            return
+        for tier in TIERS:
+            self._close_bucket(tier)
+        self.client.commit()
+        self.client.close()
+        self.client = None
+
+    def write(self, sample, *args):
+        if self.client is None:
+            raise RuntimeError("No sink initialized for write")
+        if self.clock is not None:
+            t = float(self.clock.to_utc(sample[0]))
+        else:
+            t = time.time()
+        start = int(t)
+        current = self._open.get(TIERS[0])
+        if current is None or current[0] != start:
+            if current is not None:
+                self._close_bucket(TIERS[0])
+                self.client.commit()
+            current = self._open[TIERS[0]] = (start, {})
+        buckets = current[1]
+        active_T, fault_T, temperature, ref_temperature, pressure = sample[1:6]
+        P_channels = self.P_channels
+        for ich in range(4):
+            if active_T[ich] if P_channels is None else ich in P_channels:
+                _bucket(buckets, "P{}".format(ich)).add(pressure[ich])
+            if not active_T[ich]:
+                continue
+            _bucket(buckets, "Tref{}".format(ich)).add(ref_temperature[ich])
+            if fault_T[ich]:
+                _bucket(buckets, "T{}".format(ich)).faults += 1
+            else:
+                _bucket(buckets, "T{}".format(ich)).add(temperature[ich])
+
+    def _close_bucket(self, tier):
+        """[Internal] Write the open bucket of a tier and merge it into the next tier"""
+        current = self._open.pop(tier, None)
+        if current is None:
+            return
+        start, buckets = current
+        rows = []
+        for channel, b in buckets.items():
+            row = self.client.execute("SELECT count, min, max, mean, variance, faults FROM rollup "
+                    "WHERE board_id = ? AND channel = ? AND tier = ? AND t_start = ?",
+                    (self.board_id, channel, tier, start)).fetchone()
+            stored = b
+            if row is not None:
+                # only the new samples are passed on to the next tier
+                stored = _Bucket.from_row(row)
+                stored.merge(b)
+            rows.append((self.board_id, channel, tier, start, stored.n,
+                    stored.min if stored.n else None, stored.max if stored.n else None,
+                    stored.mean if stored.n else None,
+                    stored.variance, stored.faults))
+        self.client.executemany("INSERT OR REPLACE INTO rollup VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        i = TIERS.index(tier)
+        if i + 1 == len(TIERS):
+            return
+        parent = TIERS[i + 1]
+        parent_start = start - start % parent
+        upper = self._open.get(parent)
+        if upper is not None and upper[0] != parent_start:
+            self._close_bucket(parent)
+            upper = None
+        if upper is None:
+            upper = self._open[parent] = (parent_start, {})
+        for channel, b in buckets.items():
+            _bucket(upper[1], channel).merge(b)
+
+class RollupStore:
+    """Query the aggregates written by :py:class:`RollupSink`"""
+
+    def __init__(self, path):
+        """Open an aggregate file
+
+        :param path: The SQLite file
+        :type path: str
+        """
+        self.client = sqlite3.connect(path)
+        _create(self.client)
+
+    def close(self):
+        self.client.close()
+
+    def query(self, channel, t_start, t_end, resolution=1, board_id=None):
+        """Get the aggregates of a channel over a time range
+
+        The coarsest tier that is not coarser than the requested resolution
+        is used, e.g. 1 min aggregates for a resolution of 5 min.
+
+        :param channel: The channel, e.g. 'P0', 'T2' or 'Tref2'
+        :type channel: str
+        :param t_start: The start of the range (UTC, POSIX s)
+        :type t_start: float
+        :param t_end: The end of the range (UTC, POSIX s)
+        :type t_end: float
+        :param resolution: The longest acceptable interval (s)
+        :type resolution: float
+        :param board_id: The board ID, None for any board
+        :type board_id: int
+        :returns: a tuple (tier (s), rows), where each row is a tuple
+            (interval start, count, min, max, mean, variance, faults)
+        """
+        tier = max([t for t in TIERS if t <= resolution] or [TIERS[0]])
+        sql = ("SELECT t_start, count, min, max, mean, variance, faults FROM rollup "
+                "WHERE channel = ? AND tier = ? AND t_start >= ? AND t_start < ?")
+        params = [channel, tier, int(t_start) - int(t_start) % tier, t_end]
+        if board_id is not None:
+            sql += " AND board_id = ?"
+            params.append(board_id)
+        return (tier, self.client.execute(sql + " ORDER BY t_start", params).fetchall())
+
+def _create(client):
+    """[Internal] Create the aggregate table"""
+    client.execute("CREATE TABLE IF NOT EXISTS rollup(board_id, channel, tier, t_start, "
+            "count, min, max, mean, variance, faults, "
+            "PRIMARY KEY (board_id, channel, tier, t_start))")
+
+def _bucket(buckets, channel):
+    """[Internal] The bucket of a channel, created on first use"""
+    b = buckets.get(channel)
+    if b is None:
+        b = buckets[channel] = _Bucket()
+    return b
@@ -0,0 +1,455 @@
+import math
+import os
+import struct
+import threading
+import time
+
+from .board import Controller
+
+class SimulatedBoard:
+    """A simulated PT Probe board on a pseudo-terminal (POSIX only)
+
+    The simulator speaks the serial protocol of the firmware (version 0.10):
+    streaming with full or compact frames, HALT frames, value and status
+    requests (also while streaming), configuration and reset. A
+    :py:class:`board.Controller` opened on :py:attr:`port` cannot tell it
+    from a board, which allows the client to be exercised without hardware.
+
+    Thermocouple temperatures and pressures follow slow sine waves around
+    fixed values, distinct per channel. Disconnected thermocouples are
+    reported as inactive.
+    """
+
+    FW_VERSION = (0, 10)
+
+    # the pressure coefficients of the firmware (raw 0-1 to kPa)
+    DEFAULT_AI = (-97.35308, 920.6867, -14.86687)
+
+    # compact frames with delta timestamps send an absolute timestamp this often
+    ABS_TIMESTAMP_EVERY = 64
+
+    def __init__(self, board_id=1, rate=5.0, T_channels=(0,1,2,3), T_faults=None):
+        """Construct a simulated board
+
+        :param board_id: The initial board ID
+        :type board_id: int
+        :param rate: The sample rate (Hz) when no sample interval is set
+        :type rate: float
+        :param T_channels: The connected thermocouple channels
+        :type T_channels: list
+        :param T_faults: Optional fault codes by thermocouple channel
+        :type T_faults: dict
+        """
+        self.rate = rate
+        self.T_channels = list(T_channels)
+        self.T_faults = dict(T_faults) if T_faults else {}
+        self.flash = {"board_id": board_id, "ai": [list(self.DEFAULT_AI) for ich in range(4)]}
+        self.port = None
+        self.count = 0
+        self._master = None
+        self._slave = None
+        self._wlock = threading.Lock()
+        self._reader = None
+        self._streamer = None
+        self._closed = threading.Event()
+        self._reset()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def start(self):
+        """Open the pseudo-terminal and start answering on :py:attr:`port`
+
+        :returns: the port name
+        """
+        import pty
+        import tty
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._t0 = time.monotonic()
+        self._closed.clear()
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+        return self.port
+
+    def close(self):
+        """Stop the board and close the pseudo-terminal"""
+        self._closed.set()
+        self.started = False
+        if self._streamer is not None:
+            self._streamer.join()
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+
+    def millis(self):
+        """The board clock (ms since start, wrapping at 32 bits)"""
+        return int((time.monotonic() - self._t0)*1000) & 0xFFFFFFFF
+
+    def values(self, t_ms):
+        """The simulated sensor values at a board time
+
+        :param t_ms: The board time (ms)
+        :type t_ms: int
+        :returns: a tuple (T, Tref, raw ADC) of lists by channel
+        """
+        t = t_ms/1000.0
+        T = [20.0 + 5.0*ich + math.sin(0.1*t + ich) for ich in range(4)]
+        Tref = [25.0 + 0.1*math.sin(0.01*t) for ich in range(4)]
+        # 12 bit ADC counts scaled to 0-1, as the firmware reads them
+        raw = [round(1000.0*(ich + 1) + 50.0*math.sin(2.0*t + ich))/4095.0 for ich in range(4)]
+        return (T, Tref, raw)
+
+    def pressure(self, raw):
+        """The converted pressure by channel from the raw ADC values"""
+        return [a[0] + a[1]*x + a[2]*x*x for a, x in zip(self.ai, raw)]
+
+    def _reset(self):
+        """[Internal] Restore the power-on state from the simulated flash"""
+        self.started = False
+        self.board_id = self.flash["board_id"]
+        self.ai = [list(a) for a in self.flash["ai"]]
+        self.debug_level = 0
+        self.format = Controller.FrameFlags.FULL
+        self.channel_mask = 0xFF
+        self.interval_ms = 0
+        self.max_packets = 0
+
+    def _write(self, buf):
+        """[Internal] Write a frame, whole frames are never interleaved"""
+        with self._wlock:
+            if self._master is not None:
+                os.write(self._master, buf)
+
+    def _read_loop(self):
+        """[Internal] Read and execute commands"""
+        buf = b''
+        while not self._closed.is_set():
+            try:
+                data = os.read(self._master, 256)
+            except OSError:
+                return
+            if not data:
+                return
+            buf = self._execute(buf + data)
+
+    def _execute(self, buf):
+        """[Internal] Execute the complete commands in the buffer
+
+        :returns: the unprocessed remainder
+        """
+        while buf:
+            cmd = buf[0:1]
+            if cmd == b'Z':
+                self._halt(send=False)
+                self._reset()
+                buf = buf[1:]
+            elif cmd == b'H':
+                self._halt()
+                buf = buf[1:]
+            elif cmd == b'R':
+                if len(buf) < 5:
+                    break
+                if not self.started:
+                    self.max_packets = struct.unpack('<I', buf[1:5])[0]
+                    self._start()
+                buf = buf[5:]
+            elif cmd == b'F':
+                if len(buf) < 5:
+                    break
+                if not self.started:
+                    self.format, self.channel_mask, self.interval_ms = struct.unpack('<BBH', buf[1:5])
+                self._write(bytes([(Controller.PacketType.RESP << 6)
+                        | (Controller.ResponseType.FMT << 3), self.format, self.channel_mask])
+                        + struct.pack('>H', self.interval_ms))
+                buf = buf[5:]
+            elif cmd == b'C':
+                n = self._configure(buf)
+                if n == 0:
+                    break
+                buf = buf[n:]
+            elif cmd == b'A':
+                end = buf.find(b'\n')
+                if end < 0:
+                    break
+                self._ask(buf[1:end].decode('utf-8', 'replace'))
+                buf = buf[end+1:]
+            else:
+                buf = buf[1:]   # ignored, as on the board
+        return buf
+
+    def _configure(self, buf):
+        """[Internal] Execute a configuration command
+
+        :returns: the command length, 0 if incomplete
+        """
+        if len(buf) < 2:
+            return 0
+        opt = buf[1:2]
+        if opt == b'D':
+            if len(buf) < 3:
+                return 0
+            if buf[2] < 3:
+                self.debug_level = buf[2]
+            return 3
+        if opt == b'P':
+            if len(buf) < 8:
+                return 0
+            ch, icoeff = buf[2], buf[3]
+            if ch < 4 and icoeff < 3:
+                self.ai[ch][icoeff] = struct.unpack('<f', buf[4:8])[0]
+            return 8
+        if opt == b'B':
+            if len(buf) < 6:
+                return 0
+            self.board_id = struct.unpack('<I', buf[2:6])[0]
+            return 6
+        if opt == b'W':
+            self.flash = {"board_id": self.board_id, "ai": [list(a) for a in self.ai]}
+        return 2
+
+    def _ask(self, msg):
+        """[Internal] Answer a value or status request"""
+        if self.debug_level > 0:
+            return
+        resp = Controller.PacketType.RESP << 6
+        if msg == 'B':
+            self._write(bytes([resp | (Controller.ResponseType.ID << 3)])
+                    + struct.pack('>I', self.board_id))
+            return
+        if len(msg) < 2 or not '0' <= msg[-1] <= '3':
+            return
+        ch = int(msg[-1])
+        T, Tref, raw = self.values(self.millis())
+        if msg[0] == 'S':
+            if msg[1] == 'T':
+                hdr = resp | (Controller.ResponseType.STATUS_T << 3) | (ch << 1)
+                if ch not in self.T_channels:
+                    self._write(bytes([hdr | 0x01, 0xFF]))
+                else:
+                    addr = bytes([0x3B, ch, 0, 0, 0, 0, 0, 0x10 + ch])
+                    self._write(bytes([hdr, ch, self.T_faults.get(ch, 0) & 0xFF]) + addr)
+            elif msg[1] == 'P':
+                hdr = resp | (Controller.ResponseType.STATUS_P << 3) | (ch << 1)
+                self._write(bytes([hdr, ch]) + struct.pack('>fff', *self.ai[ch]))
+            return
+        resp_type, val, fault = {
+            'T': (Controller.ResponseType.T, T[ch], self.T_faults.get(ch, 0)),
+            'R': (Controller.ResponseType.TREF, Tref[ch], 0),
+            'A': (Controller.ResponseType.ADC, raw[ch], 0),
+            'P': (Controller.ResponseType.P, self.pressure(raw)[ch], 0),
+        }.get(msg[0], (None, 0, 0))
+        if resp_type is None:
+            return
+        if msg[0] in 'TR' and ch not in self.T_channels:
+            fault = -1      # ERROR_NDX_OUT_OF_RANGE
+        hdr = resp | (resp_type << 3) | (ch << 1)
+        if fault:
+            self._write(bytes([hdr | 0x01]) + struct.pack('>i', fault))
+        else:
+            self._write(bytes([hdr]) + struct.pack('>f', val))
+
+    def _start(self):
+        """[Internal] Start streaming"""
+        self.count = 0
+        self.started = True
+        self._streamer = threading.Thread(target=self._stream_loop, daemon=True)
+        self._streamer.start()
+
+    def _halt(self, send=True):
+        """[Internal] Stop streaming and send the HALT frame"""
+        if not self.started:
+            return
+        self.started = False
+        if self._streamer is not None and self._streamer is not threading.current_thread():
+            self._streamer.join()
+        if send and self.debug_level == 0:
+            self._write(bytes([Controller.PacketType.HALT << 6]) + struct.pack('>I', self.count))
+
+    def _stream_loop(self):
+        """[Internal] Send samples until halted or the maximum count is reached"""
+        last_ts = 0
+        t_next = time.monotonic()
+        while self.started and not self._closed.is_set():
+            period = self.interval_ms/1000.0 if self.interval_ms > 0 else 1.0/self.rate
+            t_next += period
+            timestamp = self.millis()
+            if self.debug_level == 0:
+                if self.format & Controller.FrameFlags.COMPACT:
+                    absolute = self.count % self.ABS_TIMESTAMP_EVERY == 0
+                    frame = self.compact_frame(timestamp, None if absolute else last_ts)
+                else:
+                    frame = self.full_frame(timestamp)
+                self._write(frame)
+            last_ts = timestamp
+            self.count += 1
+            if self.max_packets > 0 and self.count >= self.max_packets:
+                self.started = False
+                self._write(bytes([Controller.PacketType.HALT << 6]) + struct.pack('>I', self.count))
+                return
+            time.sleep(max(0.0, t_next - time.monotonic()))
+
+    def full_frame(self, timestamp):
+        """Build a full (56 byte) DATA frame
+
+        :param timestamp: The board time (ms)
+        :type timestamp: int
+        :returns: the frame
+        """
+        T, Tref, raw = self.values(timestamp)
+        P = raw if self.format & Controller.FrameFlags.RAW_P else self.pressure(raw)
+        t_grp = 0
+        tr_grp = 0
+        T_vals = b''
+        Tref_vals = b''
+        for ich in range(4):
+            if ich in self.T_channels:
+                t_grp |= 1 << (ich+4)
+                tr_grp |= 1 << (ich+4)
+                fault = self.T_faults.get(ich, 0)
+                if fault:
+                    t_grp |= 1 << ich
+                    T_vals += struct.pack('>i', fault)
+                else:
+                    T_vals += struct.pack('>f', T[ich])
+                Tref_vals += struct.pack('>f', Tref[ich])
+            else:
+                T_vals += bytes(4)
+                Tref_vals += bytes(4)
+        return (bytes([(Controller.PacketType.DATA << 6) | 55]) + struct.pack('>I', timestamp)
+                + bytes([t_grp]) + T_vals
+                + bytes([0xF0]) + struct.pack('>ffff', *P)
+                + bytes([tr_grp]) + Tref_vals)
+
+    def compact_frame(self, timestamp, last_timestamp=None):
+        """Build a compact DATA frame for the selected channels
+
+        :param timestamp: The board time (ms)
+        :type timestamp: int
+        :param last_timestamp: The time of the previous frame (ms), None for
+            the first frame of a run
+        :type last_timestamp: int
+        :returns: the frame
+        """
+        T, Tref, raw = self.values(timestamp)
+        P = raw if self.format & Controller.FrameFlags.RAW_P else self.pressure(raw)
+        t_grp = 0
+        p_grp = 0
+        delta = None if last_timestamp is None else (timestamp - last_timestamp) & 0xFFFFFFFF
+        if (self.format & Controller.FrameFlags.DELTA_TS) and delta is not None and delta <= 0xFFFF:
+            p_grp |= 0x01
+            body = struct.pack('>H', delta)
+        else:
+            body = struct.pack('>I', timestamp)
+        for ich in range(4):
+            if (self.channel_mask & (0x10 << ich)) and ich in self.T_channels:
+                t_grp |= 1 << (ich+4)
+                fault = self.T_faults.get(ich, 0)
+                if fault:
+                    t_grp |= 1 << ich
+                    body += struct.pack('>i', fault)
+                else:
+                    body += struct.pack('>f', T[ich])
+                body += struct.pack('>f', Tref[ich])
+        for ich in range(4):
+            if self.channel_mask & (0x01 << ich):
+                p_grp |= 1 << (ich+4)
+                body += struct.pack('>f', P[ich])
+        body = bytes([t_grp, p_grp]) + body
+        return bytes([(Controller.PacketType.DATA << 6) | len(body)]) + body
+
+class SimulatedAccelBoard(SimulatedBoard):
+    """A simulated KX134 accelerometer board (see :py:class:`accel.AccelController`)
+
+    Readings are sent in blocks, with x, y, z following sine waves at a few
+    frequencies plus 1 g on z.
+    """
+
+    def __init__(self, board_id=1, rate=1000.0, g_range=1, block_size=64):
+        """Construct a simulated board
+
+        :param board_id: The initial board ID
+        :type board_id: int
+        :param rate: The output data rate (Hz)
+        :type rate: float
+        :param g_range: The range selector GSEL (0-3)
+        :type g_range: int
+        :param block_size: The readings per block
+        :type block_size: int
+        """
+        super().__init__(board_id=board_id, rate=rate)
+        self.g_range = g_range
+        self.block_size = block_size
+
+    def readings(self, t_us):
+        """The simulated readings at board times
+
+        :param t_us: The board times (us)
+        :type t_us: list
+        :returns: a list of (x, y, z) tuples of raw int16 values
+        """
+        lsb_per_g = 2**(15 - (3 + self.g_range))
+        out = []
+        for t in t_us:
+            s = t*1e-6
+            out.append((int(0.5*lsb_per_g*math.sin(2*math.pi*50*s)),
+                    int(0.2*lsb_per_g*math.sin(2*math.pi*120*s)),
+                    int(lsb_per_g*(1.0 + 0.1*math.sin(2*math.pi*7*s)))))
+        return out
+
+    def block_frame(self, t_us, intervals):
+        """Build a block frame of [interval, x, y, z] readings
+
+        :param t_us: The board time of the first reading (us)
+        :type t_us: int
+        :param intervals: The interval before each reading (us)
+        :type intervals: list
+        :returns: the frame
+        """
+        times = []
+        t = t_us
+        for i, dt in enumerate(intervals):
+            if i > 0:
+                t += dt
+            times.append(t)
+        body = b''.join(struct.pack('>Hhhh', dt, *xyz)
+                for dt, xyz in zip(intervals, self.readings(times)))
+        return (bytes([(Controller.PacketType.DATA << 6) | 0x3F])
+                + struct.pack('>HBI', len(intervals), 4, t_us & 0xFFFFFFFF) + body)
+
+    def _ask(self, msg):
+        """[Internal] Answer the ID and range requests"""
+        resp = Controller.PacketType.RESP << 6
+        if msg == 'B':
+            self._write(bytes([resp | (Controller.ResponseType.ID << 3) | (1 << 1)])
+                    + struct.pack('>I', self.board_id))
+        elif msg == 'G':
+            self._write(bytes([resp | (Controller.ResponseType.FMT << 3), self.g_range, 0])
+                    + struct.pack('>H', int(self.rate)))
+
+    def _stream_loop(self):
+        """[Internal] Send blocks until halted or the maximum count is reached"""
+        period_us = int(1e6/self.rate)
+        t_us = int((time.monotonic() - self._t0)*1e6)
+        t_next = time.monotonic()
+        while self.started and not self._closed.is_set():
+            n = self.block_size
+            if self.max_packets > 0:
+                n = min(n, self.max_packets - self.count)
+            t_next += n*period_us*1e-6
+            intervals = [period_us]*n
+            self._write(self.block_frame(t_us, intervals))
+            t_us += n*period_us
+            self.count += n
+            if self.max_packets > 0 and self.count >= self.max_packets:
+                self.started = False
+                self._write(bytes([Controller.PacketType.HALT << 6]) + struct.pack('>I', self.count))
+                return
+            time.sleep(max(0.0, t_next - time.monotonic()))
@@ -1,8 +1,107 @@
-from influxdb_client import InfluxDBClient, Point, WritePrecision
-from influxdb_client.client.write_api import SYNCHRONOUS
-from datetime import datetime
-
-import sqlite3
+import importlib
+
+# Database clients are imported when a sink is opened, not here: importing
+# this module (e.g. for a CSV-only run) must not require or load them.
+
+ENTRY_POINT_GROUP = "ptprobe.sinks"
+
+# the columns of a CsvSampleSink file (see recording.load_csv)
+CSV_COLUMNS = ["Time",
+        "CH_0 Active T", "CH_1 Active T", "CH_2 Active T", "CH_3 Active T",
+        "CH_0 Error Code", "CH_1 Error Code", "CH_2 Error Code", "CH_3 Error Code",
+        "CH_0 Temp", "CH_1 Temp", "CH_2 Temp", "CH_3 Temp",
+        "CH_0 Ref Temp", "CH_1 Ref Temp", "CH_2 Ref Temp", "CH_3 Ref Temp",
+        "CH_0 Pressure", "CH_1 Pressure", "CH_2 Pressure", "CH_3 Pressure"]
+
+# the columns of an accelerometer CsvSampleSink file (width 4)
+ACCEL_CSV_COLUMNS = ["Interval", "X", "Y", "Z"]
+
+INFLUXDB_URL = "https://us-west-2-1.aws.cloud2.influxdata.com"
+
+# an InfluxDB point per sample in line protocol: board ID, then T, Tref, P,
+# Tfault per channel, then the time (ms)
+_LINE = "board,board_id={} " + ",".join(
+        "T{0}={{}},Tref{0}={{}},P{0}={{}},Tfault{0}={{}}i".format(ich) for ich in range(4)) + " {}"
+
+_registry = {
+    "csv": "ptprobe.sinks:CsvSampleSink",
+    "list": "ptprobe.sinks:ListSampleSink",
+    "influxdb": "ptprobe.sinks:InfluxDBSampleSink",
+    "sqlite": "ptprobe.sinks:SQLiteSampleSink",
+    "rollup": "ptprobe.rollup:RollupSink",
+    "archive": "ptprobe.archive:ArchiveSampleSink",
+}
+
+def register_sink(name, target):
+    """Register a sink type under a name
+
+    :param name: The sink name, e.g. 'csv'
+    :type name: str
+    :param target: The sink class, or a 'module:attribute' string that is
+        imported when the sink is first created
+    :type target: class or str
+    """
+    _registry[name] = target
+
+def available_sinks():
+    """Get the names of the registered and plugin sink types
+
+    :returns: a sorted list of names
+    """
+    return sorted(set(_registry) | set(ep.name for ep in _entry_points()))
+
+def sink_class(name):
+    """Resolve a sink type by name, importing its module on first use
+
+    Names not registered with :py:func:`register_sink` are looked up in the
+    ``ptprobe.sinks`` entry-point group of the installed packages.
+
+    :param name: The sink name
+    :type name: str
+    :raises KeyError: if no sink type has this name
+    :returns: the sink class
+    """
+    target = _registry.get(name)
+    if target is None:
+        for ep in _entry_points():
+            if ep.name == name:
+                target = ep.value
+                break
+        else:
+            raise KeyError("Unknown sink type: {}".format(name))
+    if isinstance(target, str):
+        module, _, attr = target.partition(":")
+        target = getattr(importlib.import_module(module), attr)
+        _registry[name] = target
+    return target
+
+def create_sink(name, *args, **kwargs):
+    """Construct a sink by name
+
+    :param name: The sink name, e.g. 'csv'
+    :type name: str
+    :returns: the sink, constructed with the remaining arguments
+    """
+    return sink_class(name)(*args, **kwargs)
+
+def _entry_points():
+    """[Internal] The sink plugins advertised by installed packages"""
+    try:
+        from importlib import metadata
+    except ImportError:     # Python < 3.8
+        return []
+    eps = metadata.entry_points()
+    if hasattr(eps, "select"):
+        return list(eps.select(group=ENTRY_POINT_GROUP))
+    return list(eps.get(ENTRY_POINT_GROUP, []))
+
+def _plain(v):
+    """[Internal] Convert NumPy values to Python values, which print as plain numbers"""
+    if hasattr(v, "tolist"):
+        return v.tolist()
+    if isinstance(v, (list, tuple)):
+        return [x.tolist() if hasattr(x, "tolist") else x for x in v]
+    return v
 
 class SampleSink:
     """The abstract base class for sinks to record streaming sample data"""
@@ -16,32 +115,125 @@ class SampleSink:
         """
         raise NotImplementedError("Abstract method")
 
-class CsvSampleSink (SampleSink):
-    """Write sample data to a text file in comma separated value (CSV) format"""
+    def write_batch(self, samples, *args):
+        """Write a list of samples
+
+        The default writes them one by one; sinks with a faster bulk path
+        (e.g. one database request per batch) override it.
+
+        :param samples: The data samples
+        :type samples: list
+        """
+        for sample in samples:
+            self.write(sample, *args)
+
+    def write_gaps(self, gaps):
+        """Store the gap index of a finished recording (see :py:class:`gaps.GapIndex`)
+
+        The default is to discard it.
+
+        :param gaps: The gap index
+        :type gaps: :py:class:`gaps.GapIndex`
+        """
+        pass
+
+class NoConversionConverter:
+    """Pass accelerometer readings to a sink unchanged"""
+
+    def convert(self, block):
+        """Convert a block of readings
 
-    def __init__(self, filename):
+        :param block: The readings, one row per reading
+        :type block: numpy.ndarray
+        :returns: the block
+        """
+        return block
+
+class IntervalSignedInt16Converter:
+    """Scale blocks of [interval (us), x, y, z] readings
+
+    The interval is kept in microseconds; the signed 16 bit accelerations are
+    multiplied by the scaling, e.g. to g with
+    :py:meth:`accel.AccelController.g_scaling`.
+    """
+
+    def __init__(self, scaling=1.0):
+        """Construct a converter
+
+        :param scaling: The factor from a reading to the output unit
+        :type scaling: float
+        """
+        self.scaling = scaling
+
+    def convert(self, block):
+        """Convert a block of readings
+
+        :param block: The readings, one row per reading
+        :type block: numpy.ndarray
+        :returns: a float array of the same shape
+        """
+        import numpy as np
+        out = np.empty(block.shape, dtype=np.float64)
+        out[:,0] = block[:,0]
+        np.multiply(block[:,1:], self.scaling, out=out[:,1:])
+        return out
+
+class CsvSampleSink (SampleSink):
+    """Write sample data to a text file in comma separated value (CSV) format
+
+    With a width, each sample is a block of readings (see 
+    :py:meth:`accel.AccelController.collect_samples`), written one reading
+    per line. With a queue, a sample is also put on it as ``[port, sample,
+    index]`` while fewer than two are waiting; the index counts the samples
+    written since :py:meth:`open`, so a reader can tell when samples were
+    left out.
+    """
+
+    def __init__(self, filename, width=None, converter=None):
+        """Construct a sink
+
+        :param filename: The output file
+        :type filename: str
+        :param width: The values per reading of block samples, None for 
+            PT Probe samples
+        :type width: int
+        :param converter: A converter applied to each sample before it is
+            written (e.g. :py:class:`IntervalSignedInt16Converter`)
+        """
         self.filename = filename
+        self.width = width
+        self.converter = converter
         self.hf = None
+        self.written = 0
 
     def open(self): 
         self.close()
         self.hf = open(self.filename, "w")
+        self.written = 0
 
     def close(self):
         if self.hf is not None:
             self.hf.close()
         self.hf = None
 
-    # def write(self, sample):
+    def write_gaps(self, gaps):
+        """Write the gap index next to the file, as <filename>.gaps.json"""
+        gaps.save(self.filename + ".gaps.json")
+
     def write(self, sample, port = 0, queue = False):
+        if self.converter is not None:
+            sample = self.converter.convert(sample)
+        if queue and queue.qsize()<2:
+            queue.put([port, sample, self.written])
+        self.written += 1
+        if self.width is not None:
+            import numpy as np
+            np.savetxt(self.hf, np.reshape(sample, (-1, self.width)), fmt="%.6g", delimiter=", ")
+            return
         seps = [', ']*len(sample)
         seps[-1] = '\n'
-        # print(sample[4])
-        # queue.put([item, sample[4], sample[5]]
-        if queue.qsize()<2:
-            queue.put([port, sample])
         for v,s in zip(sample,seps):
-            self.hf.write("{}{}".format(v,s).replace("[","").replace("]",""))
+            self.hf.write("{}{}".format(_plain(v),s).replace("[","").replace("]",""))
 
 class ListSampleSink (SampleSink):
     """Write sample data to an array"""
@@ -49,25 +241,32 @@ class ListSampleSink (SampleSink):
     def __init__(self):
         self.data = []
 
-    def write(self, sample):
+    def write(self, sample, *args):
         self.data.append(sample)
 
 class InfluxDBSampleSink (SampleSink):
-    """Write sample data to InfluxDB Cloud"""
+    """Write sample data to InfluxDB Cloud
 
-    def __init__(self, token, org, bucket):
+    If a :py:class:`clock.ClockModel` is supplied, points are stamped with
+    the board timestamp mapped to UTC; otherwise with the host time at write.
+    """
+
+    def __init__(self, token, org, bucket, clock=None, url=INFLUXDB_URL):
         self.client = None
+        self.url = url
         self.token = token
         self.org = org
         self.bucket = bucket
         self.board_id = 0
+        self.clock = clock
 
     def set_board_id(self, id):
         self.board_id = id
 
     def open(self):
+        from influxdb_client import InfluxDBClient
         self.client = InfluxDBClient(
-                url="https://us-west-2-1.aws.cloud2.influxdata.com",
+                url=self.url,
                 token=self.token,
                 org=self.org)
 
@@ -75,77 +274,126 @@ class InfluxDBSampleSink (SampleSink):
         if self.client is not None:
             self.client.close()
 
-    def write(self, sample):
+    def write(self, sample, *args):
+        self.write_batch([sample])
+
+    def write_batch(self, samples, *args):
+        """Write a list of samples in one request
+
+        :param samples: The data samples
+        :type samples: list
+        """
         if self.client is None:
             raise RuntimeError("No sink initialized for write")
 
+        import math
+        from influxdb_client import Point, WritePrecision
+        from influxdb_client.client.write_api import SYNCHRONOUS
         write_api = self.client.write_api(write_options=SYNCHRONOUS)
 
-        pt = Point("board").tag("board_id", self.board_id)
-        for ich in range(4):
-            pt.field("T{}".format(ich), sample[3][ich])
-            pt.field("Tref{}".format(ich), sample[4][ich])
-            pt.field("P{}".format(ich), sample[5][ich])
-            pt.field("Tfault{}".format(ich), sample[2][ich])
-        pt.time(datetime.utcnow(), WritePrecision.MS)
-        #pt.time(sample[0], WritePrecision.MS)
-
-        write_api.write(self.bucket, self.org, pt)
+        if self.clock is not None:
+            times = self.clock.to_utc([sample[0] for sample in samples])
+            times = (times*1000).round().astype('int64').tolist()
+        else:
+            from datetime import datetime, timezone
+            now = datetime.now(timezone.utc)
+            times = [round(now.timestamp()*1000)]*len(samples)
+
+        # line protocol is formatted directly: building a Point per sample
+        # costs several times more than the request
+        lines = []
+        for sample, t in zip(samples, times):
+            values = []
+            for ich in range(4):
+                values.extend((sample[3][ich], sample[4][ich], sample[5][ich], int(sample[2][ich])))
+            if all(map(math.isfinite, values)):
+                lines.append(_LINE.format(self.board_id, *values, t))
+                continue
+            # Point drops the non-finite fields
+            pt = Point("board").tag("board_id", self.board_id)
+            for ich in range(4):
+                pt.field("T{}".format(ich), sample[3][ich])
+                pt.field("Tref{}".format(ich), sample[4][ich])
+                pt.field("P{}".format(ich), sample[5][ich])
+                pt.field("Tfault{}".format(ich), sample[2][ich])
+            pt.time(t, WritePrecision.MS)
+            lines.append(pt.to_line_protocol())
+
+        write_api.write(self.bucket, self.org, lines, write_precision=WritePrecision.MS)
 
 class SQLiteSampleSink (SampleSink):
+    """Write sample data to an SQLite database, one row per channel
+
+    If a :py:class:`clock.ClockModel` is supplied, rows are stamped with
+    the board timestamp mapped to UTC; otherwise with the host time at write.
+
+    The database is opened in write-ahead-log mode, and a write waits up to
+    ``timeout`` seconds for other writers (e.g. the workers of a
+    :py:mod:`backfill`, or other boards recording to the same file).
+    """
         
-    def __init__(self, url):
+    def __init__(self, url, clock=None, timeout=60.0):
         self.client = None
         self.url=url
         self.board_id = 0
+        self.clock = clock
+        self.timeout = timeout
 
     def create(self, com, date):
+        """Create the table of a recording, if it does not exist
+
+        Rows are unique by channel and timestamp, so samples written again
+        (e.g. by a resumed :py:mod:`backfill`) replace the earlier rows.
+        """
         if self.client is None:
             raise RuntimeError("No sink initialized for write")
         cursor = self.client.cursor()
         # cursor.execute("CREATE TABLE {}_{}(channel, timestamp, active_T, fault_T, temperature, ref_temperature, pressure)".format(com, date))
-        cursor.execute("CREATE TABLE {}_{}(channel, timestamp, fault_T, temperature, ref_temperature, pressure)".format(com, date))
+        cursor.execute("CREATE TABLE IF NOT EXISTS {}_{}(channel, timestamp, fault_T, temperature, "
+                "ref_temperature, pressure, UNIQUE(channel, timestamp))".format(com, date))
 
     def open(self):
-        self.client = sqlite3.connect(self.url)
+        import sqlite3
+        self.client = sqlite3.connect(self.url, timeout=self.timeout)
+        self.client.execute("PRAGMA journal_mode=WAL")
 
     def close(self):
         if self.client is not None:
             self.client.close()
 
     def write(self, sample, com, date):
-        if self.client is None:
-            raise RuntimeError("No sink initialized for write")
-        
-        #Table exist check?
-        
-        cursor = self.client.cursor()
+        self.write_batch([sample], com, date)
 
-        # pt = Point("board").tag("board_id", self.board_id)
-        # for ich in range(4):
-        #     pt.field("T{}".format(ich), sample[3][ich])
-        #     pt.field("Tref{}".format(ich), sample[4][ich])
-        #     pt.field("P{}".format(ich), sample[5][ich])
-        #     pt.field("Tfault{}".format(ich), sample[2][ich])
-        # pt.time(datetime.utcnow(), WritePrecision.MS)
-
-        #need to parse sample into table format?
-
-        for ich in range(4):
-            cursor.execute("""
-                    INSERT INTO {}_{} VALUES
-                        (Channel{}, {}, {}, {}, {}, {} )
-                """.format(
-                    #Table:
-                    com, 
-                    date, 
-
-                    ich, #channel
-                    datetime.utcnow(), #timestamp
-                    sample[2][ich], #fault_T
-                    sample[3][ich], #temperature
-                    sample[4][ich], #ref_temp
-                    sample[5][ich], #pressure
-                    ))
+    def write_batch(self, samples, com, date):
+        """Write a list of samples to the table of a recording in one transaction
 
+        :param samples: The data samples
+        :type samples: list
+        """
+        if self.client is None:
+            raise RuntimeError("No sink initialized for write")
 
+        import time
+        from datetime import datetime, timezone
+        board_ms = [sample[0] for sample in samples]
+        if self.clock is not None:
+            times = self.clock.to_utc(board_ms).tolist()
+        else:
+            # the last sample is stamped with the host time, earlier ones by the board clock
+            now = time.time()
+            times = [now - ((board_ms[-1] - t) % (1 << 32))*1e-3 for t in board_ms]
+        # naive UTC, as in the existing tables
+        times = [str(datetime.fromtimestamp(t, timezone.utc).replace(tzinfo=None)) for t in times]
+
+        rows = []
+        for sample, timestamp in zip(samples, times):
+            rows.extend(("Channel{}".format(ich),   #channel
+                    timestamp,                  #timestamp
+                    sample[2][ich],             #fault_T
+                    sample[3][ich],             #temperature
+                    sample[4][ich],             #ref_temp
+                    sample[5][ich])             #pressure
+                    for ich in range(4))
+        with self.client:
+            self.client.executemany("INSERT OR REPLACE INTO {}_{} VALUES (?, ?, ?, ?, ?, ?)".format(com, date),
+                    rows)
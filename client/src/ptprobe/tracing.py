@@ -0,0 +1,82 @@
+import json
+import os
+import threading
+import time
+
+class ChromeTracer:
+    """Record timing spans of the collection pipeline in Chrome trace format
+
+    The output file loads in Perfetto (ui.perfetto.dev) or chrome://tracing.
+    Only one in ``sample_every`` loop iterations is traced, which bounds the
+    overhead and the file size on long runs. One tracer can be shared by
+    several controllers; each collection thread appears as its own track.
+
+    Pass the tracer to :py:class:`board.Controller`; without a tracer the
+    collection loop skips all tracing code.
+    """
+
+    def __init__(self, path=None, sample_every=1, max_events=1000000):
+        """Construct a tracer
+
+        :param path: The output file, written by :py:meth:`save`
+        :type path: str
+        :param sample_every: Trace one in this many loop iterations
+        :type sample_every: int
+        :param max_events: Stop recording after this many events
+        :type max_events: int
+        """
+        self.path = path
+        self.sample_every = max(1, int(sample_every))
+        self.max_events = max_events
+        self.events = []
+        self._count = 0
+        self._t0 = time.perf_counter()
+        self._pid = os.getpid()
+
+    def sample(self):
+        """Advance the iteration counter
+
+        :returns: True if the current iteration should be traced
+        """
+        self._count += 1
+        return (self._count % self.sample_every == 0
+                and len(self.events) < self.max_events)
+
+    def name_thread(self, name):
+        """Label the track of the calling thread (e.g. with the port name)
+
+        :param name: The track label
+        :type name: str
+        """
+        self.events.append({"name": "thread_name", "ph": "M", "pid": self._pid,
+                "tid": threading.get_ident(), "args": {"name": name}})
+
+    def span(self, name, t_begin, t_end, **args):
+        """Record a completed span on the calling thread's track
+
+        :param name: The stage name
+        :type name: str
+        :param t_begin: The start time (s, :py:func:`time.perf_counter`)
+        :type t_begin: float
+        :param t_end: The end time (s, :py:func:`time.perf_counter`)
+        :type t_end: float
+        :param args: Extra values shown with the span
+        """
+        event = {"name": name, "ph": "X", "pid": self._pid,
+                "tid": threading.get_ident(),
+                "ts": (t_begin - self._t0)*1e6, "dur": (t_end - t_begin)*1e6}
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+    def save(self, path=None):
+        """Write the recorded events as a JSON trace file
+
+        :param path: The output file (default: the path given at construction)
+        :type path: str
+        """
+        path = path or self.path
+        if path is None:
+            raise ValueError("No trace file path")
+        with open(path, "w") as hf:
+            json.dump({"traceEvents": list(self.events), "displayTimeUnit": "ms"}, hf)
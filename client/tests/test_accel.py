@@ -0,0 +1,87 @@
+import os
+import struct
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from ptprobe import simulator
+from ptprobe.accel import AccelController, BLOCK_HEADER
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="the simulator needs pseudo-terminals")
+
+BLOCK = 64
+N = 12*BLOCK
+
+def _expected(sim, t_us, block):
+    """The readings the simulator sent in a block"""
+    times = t_us + np.concatenate(([0], np.cumsum(block[1:,0])))
+    return np.array(sim.readings(times.tolist()))
+
+class _NoisyAccelBoard (simulator.SimulatedAccelBoard):
+    """A simulated accelerometer board that sends a fake block before some blocks"""
+
+    def __init__(self, fakes, **kwargs):
+        """:param fakes: Maps a block index to a function building the fake
+            block from the board time of the real one"""
+        self.fakes = fakes
+        self.blocks = 0
+        super().__init__(**kwargs)
+
+    def _write(self, buf):
+        if buf[0] == BLOCK_HEADER:
+            fake = self.fakes.get(self.blocks)
+            self.blocks += 1
+            if fake is not None:
+                t_us = struct.unpack('>I', buf[4:8])[0]
+                buf = fake(t_us) + buf
+        super()._write(buf)
+
+def _block(n, width, t_us, words=None):
+    """A block frame with zero or given readings"""
+    body = struct.pack('>{}h'.format(n*width), *(words or [0]*(n*width)))
+    return bytes([BLOCK_HEADER]) + struct.pack('>HBI', n, width, t_us) + body
+
+def _collect(sim):
+    pt = AccelController(sim.port)
+    blocks = list(pt.iter_blocks(max_samples=N))
+    return pt, blocks
+
+def test_int16_decoding():
+    """Readings decode to the signed values the board sent, intervals unsigned"""
+    with simulator.SimulatedAccelBoard(rate=4000.0, g_range=0, block_size=BLOCK) as sim:
+        pt, blocks = _collect(sim)
+    assert sum(len(block) for _, block in blocks) == N
+    for t_us, block in blocks:
+        assert block.shape == (BLOCK, 4)
+        assert (block[:,0] == 250).all()
+        assert np.array_equal(block[:,1:], _expected(sim, t_us, block))
+    readings = np.concatenate([block[:,1:] for _, block in blocks])
+    assert readings.min() < 0 and readings.max() > 0
+    assert pt.metrics.resyncs == 0
+
+def test_big_intervals_are_unsigned():
+    """An interval above 0x7FFF us is not read as negative"""
+    with simulator.SimulatedAccelBoard(rate=25.0, block_size=4) as sim:
+        pt = AccelController(sim.port)
+        blocks = list(pt.iter_blocks(max_samples=8))
+    assert all((block[:,0] == 40000).all() for _, block in blocks)
+
+def test_implausible_blocks_are_rejected():
+    """Fake blocks are skipped, and every real block is decoded"""
+    fakes = {
+        2: lambda t: _block(0, 4, t),                       # no readings
+        4: lambda t: _block(2, 4, t),                       # zero intervals
+        6: lambda t: _block(2, 4, (t - 20000000) & 0xFFFFFFFF, [250, 1, 2, 3]*2),  # back in time
+        8: lambda t: _block(2, 3, t, [1, 2, 3]*2),          # another width
+        10: lambda t: _block(2, 4, (t + 30000000) & 0xFFFFFFFF, [250, 1, 2, 3]*2), # too far ahead
+    }
+    with _NoisyAccelBoard(fakes, rate=4000.0, block_size=BLOCK) as sim:
+        pt, blocks = _collect(sim)
+    assert len(blocks) == N // BLOCK
+    for t_us, block in blocks:
+        assert (block[:,0] == 250).all()
+        assert np.array_equal(block[:,1:], _expected(sim, t_us, block))
+    assert pt.metrics.resyncs == len(fakes)
+    assert pt.metrics.samples == N
+    assert pt.metrics.dropped == 0
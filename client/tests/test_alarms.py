@@ -0,0 +1,120 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from ptprobe import alarms
+from ptprobe.gaps import WRAP
+
+def _batch(t, pressure, temperature=None, fault=None, active=None):
+    """A batch in the layout of Controller.iter_batches"""
+    n = len(t)
+    return {
+        "timestamp": np.asarray(t, dtype=np.int64) % WRAP,
+        "active_T": np.ones((n, 4), dtype=bool) if active is None else np.asarray(active),
+        "fault_T": np.zeros((n, 4), dtype=np.int64) if fault is None else np.asarray(fault),
+        "temperature": np.zeros((n, 4)) if temperature is None else np.asarray(temperature),
+        "ref_temperature": np.full((n, 4), 25.0),
+        "pressure": np.asarray(pressure, dtype=np.float64),
+    }
+
+def _split(batch, sizes):
+    """Cut a batch into consecutive batches of the given sizes"""
+    start = 0
+    for size in sizes:
+        yield {k: v[start:start+size] for k, v in batch.items()}
+        start += size
+
+def _reference(rules, batch):
+    """The threshold events computed sample by sample, one rule and channel at a time"""
+    events = []
+    state = {}
+    for i, t in enumerate(batch["timestamp"]):
+        for rule in rules:
+            for ich in rule.channels:
+                x = batch[rule.field][i, ich]
+                was = state.get((rule.name, ich), False)
+                now = was
+                if x > rule.above or x < rule.below:
+                    now = True
+                elif rule.below + rule.hysteresis <= x <= rule.above - rule.hysteresis:
+                    now = False
+                if now != was:
+                    events.append((int(t), rule.name, ich, float(x), now))
+                state[(rule.name, ich)] = now
+    return sorted(events)
+
+RULES = [
+    alarms.Threshold("P high", "pressure", above=10.0, hysteresis=1.0),
+    alarms.Threshold("P band", "pressure", above=12.0, below=-8.0, hysteresis=0.5, channels=(1, 3)),
+    alarms.Threshold("P low", "pressure", below=-10.0),
+]
+
+@pytest.mark.parametrize("sizes", [[2000], [1]*2000, [7, 993, 1, 999], [500]*4])
+def test_threshold_hysteresis_matches_per_sample(sizes):
+    """Events of noisy signals near the limits equal the per-sample evaluation, in any batches"""
+    rng = np.random.default_rng(3)
+    n = 2000
+    pressure = np.cumsum(rng.normal(0, 0.8, (n, 4)), axis=0)
+    batch = _batch(WRAP - 1000 + 10*np.arange(n), pressure)
+    engine = alarms.AlarmEngine(RULES)
+    events = []
+    for part in _split(batch, sizes):
+        events.extend(engine.process(part, board="b"))
+    got = sorted((e.timestamp, e.rule, e.channel, e.value, e.raised) for e in events)
+    assert got == _reference(RULES, batch)
+    assert len(got) > 20
+
+def test_noise_inside_hysteresis_is_one_event():
+    """A value chattering around the limit is raised once and cleared once"""
+    p = np.zeros((40, 4))
+    p[:, 0] = [0, 0, 10.5, 9.5, 10.2, 9.1, 10.9, 9.4, 10.1] + [9.5]*20 + [8.9] + [0]*10
+    engine = alarms.AlarmEngine([alarms.Threshold("P0", "pressure", above=10.0,
+            hysteresis=1.0, channels=(0,))])
+    events = []
+    for part in _split(_batch(100*np.arange(40), p), [3, 4, 30, 3]):
+        events.extend(engine.process(part))
+    assert [(e.timestamp, e.raised) for e in events] == [(200, True), (2900, False)]
+
+def test_persisting_alarm_reported_once_per_board():
+    """An alarm that persists across batches is reported once, per board"""
+    collected = []
+    engine = alarms.AlarmEngine(RULES[:1], on_event=collected.append)
+    p = np.full((10, 4), 20.0)
+    for start in range(0, 50, 10):
+        for board in ("a", "b"):
+            engine.process(_batch(100*np.arange(start, start + 10), p), board=board)
+    assert sorted((e.board, e.channel) for e in collected) == [(b, c) for b in "ab" for c in range(4)]
+    assert all(e.raised for e in collected)
+    assert sorted(engine.active_alarms("a")) == [("P high", c) for c in range(4)]
+
+def test_temperature_ignores_faults_and_inactive():
+    """Faulty or inactive thermocouples neither raise nor clear a temperature threshold"""
+    t = np.zeros((6, 4))
+    t[:, 0] = [50, 0, 0, 50, 20, 20]
+    fault = np.zeros((6, 4), dtype=np.int64)
+    fault[1:3, 0] = 4
+    active = np.ones((6, 4), dtype=bool)
+    active[3, 0] = False
+    engine = alarms.AlarmEngine([alarms.Threshold("T0 hot", "temperature", above=40,
+            hysteresis=5, channels=(0,))])
+    events = engine.process(_batch(100*np.arange(6), np.zeros((6, 4)), t, fault, active))
+    assert [(e.timestamp, e.raised) for e in events] == [(0, True), (400, False)]
+
+def test_rate_and_fault_across_batches():
+    """Rates are measured over the window across batches and the counter wrap"""
+    n = 40
+    p = np.zeros((n, 4))
+    p[20:, 2] = 5.0 * np.arange(n - 20)     # 5 per 100 ms = 50/s
+    fault = np.zeros((n, 4), dtype=np.int64)
+    fault[30:35, 1] = 2
+    rules = [alarms.RateOfChange("P2 rate", "pressure", limit=20.0, window_ms=500, channels=(2,)),
+            alarms.FaultCode("open", codes=[2]), alarms.FaultCode("other", codes=[1])]
+    engine = alarms.AlarmEngine(rules)
+    events = []
+    for part in _split(_batch(WRAP - 1500 + 100*np.arange(n), p, fault=fault), [13, 13, 14]):
+        events.extend(engine.process(part))
+    assert [(e.rule, e.channel, e.raised) for e in events] == [
+            ("P2 rate", 2, True), ("open", 1, True), ("open", 1, False)]
+    # three steps of 5 within the 0.5 s window are the first rate above 20/s
+    assert events[0].timestamp == (WRAP - 1500 + 2300) % WRAP
+    assert events[0].value == pytest.approx(30.0)
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("scipy")
+
+from ptprobe import analysis
+from ptprobe.sinks import CSV_COLUMNS
+
+def test_summary_does_not_depend_on_task_size(tmp_path):
+    """Splitting a recording into ranges gives the statistics and PSD of one range"""
+    rng = np.random.default_rng(0)
+    path = str(tmp_path / "rec.csv")
+    with open(path, "w") as hf:
+        hf.write(", ".join(CSV_COLUMNS) + "\n")
+        for i in range(3000):
+            errors = list((rng.random(4) < 0.005).astype(int))
+            values = ([i*200] + [True]*4 + errors + list(20 + rng.normal(size=4))
+                    + list(21 + rng.normal(size=4)) + list(np.sin(0.3*i + rng.normal(size=4))))
+            hf.write(", ".join(str(v) for v in values) + "\n")
+    whole = analysis.analyse_files([path], str(tmp_path / "a.csv"), nperseg=64,
+            processes=1, task_bytes=1 << 30)[path]
+    for task_bytes in (20000, 5000):
+        parts = analysis.analyse_files([path], str(tmp_path / "b.csv"), nperseg=64,
+                processes=2, task_bytes=task_bytes)[path]
+        for name, summary in whole.items():
+            other = parts[name]
+            assert (other.stats.n, other.faults, other.nseg) == (summary.stats.n, summary.faults, summary.nseg)
+            assert np.isclose(other.stats.variance, summary.stats.variance)
+            assert np.allclose(other.psd()[1], summary.psd()[1])
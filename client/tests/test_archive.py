@@ -0,0 +1,93 @@
+import logging
+
+import numpy as np
+import pytest
+
+from ptprobe import archive
+
+def _batch(n, t0=1000, dt=200):
+    """A batch with temperatures on a 2^-7 grid, reference temperatures over
+    many magnitudes and pressures from a few levels"""
+    rng = np.random.default_rng(3)
+    levels = (rng.random(40)*100).astype(np.float32)
+    return {
+        "timestamp": (t0 + dt*np.arange(n)) % (1 << 32),
+        "active_T": np.ones((n, 4), dtype=bool),
+        "fault_T": np.zeros((n, 4), dtype=np.int64),
+        "temperature": np.round((20 + np.cumsum(rng.normal(size=(n, 4)), axis=0))*128)/128,
+        "ref_temperature": rng.lognormal(0, 3, size=(n, 4)).astype(np.float32),
+        "pressure": levels[rng.integers(0, len(levels), size=(n, 4))],
+    }
+
+def _assert_same(block, batch):
+    """The decoded block has the timestamps, flags and float32 bits of the batch"""
+    assert np.array_equal(block["timestamp"], batch["timestamp"])
+    assert np.array_equal(block["active_T"], batch["active_T"])
+    assert np.array_equal(block["fault_T"], batch["fault_T"])
+    for field in archive.FLOAT_FIELDS:
+        expected = np.asarray(batch[field], dtype=np.float32).view(np.uint32)
+        assert np.array_equal(block[field].astype(np.float32).view(np.uint32), expected), field
+
+def _coding(bits, fault=None):
+    return archive._encode_channel(np.asarray(bits, dtype=np.uint64), fault)[0] & ~archive.ZERO_ON_FAULT
+
+def test_channel_codings_round_trip():
+    """Each channel takes the coding that suits it, and all three are lossless"""
+    batch = _batch(1000)
+    bits = lambda field: np.asarray(batch[field], dtype=np.float32).view(np.uint32)[:,0]
+    assert _coding(bits("temperature")) == archive.FIXED
+    assert _coding(bits("ref_temperature")) == archive.XOR
+    assert _coding(bits("pressure")) == archive.TABLE
+    block, end = archive.decode_block(archive.encode_block(batch))
+    _assert_same(block, batch)
+
+def test_timestamps_across_the_counter_wrap():
+    """Delta-of-delta timestamps continue across the uint32 rollover"""
+    batch = _batch(500, t0=(1 << 32) - 200*250)
+    batch["timestamp"][300:] += 3   # jitter after the wrap
+    batch["timestamp"] %= 1 << 32
+    block, end = archive.decode_block(archive.encode_block(batch))
+    assert block["timestamp"].max() < 1 << 32
+    _assert_same(block, batch)
+
+def test_negative_zero_and_nan_keep_their_bits():
+    """-0.0 and NaN are not turned into 0.0 by the scaled-integer coding"""
+    batch = _batch(200)
+    batch["temperature"][50, 0] = -0.0
+    batch["ref_temperature"][10:20, 1] = np.nan
+    batch["pressure"][5, 2] = -0.0
+    block, end = archive.decode_block(archive.encode_block(batch))
+    _assert_same(block, batch)
+    assert np.signbit(block["temperature"][50, 0]) and np.isnan(block["ref_temperature"][10:20, 1]).all()
+
+def test_fault_flags_and_zero_temperatures():
+    """Fault codes and active flags come back, with the faulted temperatures 0.0"""
+    batch = _batch(300)
+    batch["fault_T"][100:150, 2] = 4
+    batch["fault_T"][:10, 3] = 1        # faulted from the start
+    batch["active_T"][200:, 1] = False
+    batch["temperature"][batch["fault_T"] != 0] = 0.0
+    data = archive.encode_block(batch)
+    block, end = archive.decode_block(data)
+    assert end == len(data)
+    _assert_same(block, batch)
+
+def test_truncated_last_block_is_dropped(tmp_path, caplog):
+    """A file cut off in its last block gives the complete blocks"""
+    path = str(tmp_path / "rec.ptz")
+    batch = _batch(250)
+    sink = archive.ArchiveSampleSink(path, block_size=100)
+    sink.open()
+    for i in range(250):
+        sink.write([batch["timestamp"][i], batch["active_T"][i], batch["fault_T"][i],
+                batch["temperature"][i], batch["ref_temperature"][i], batch["pressure"][i]])
+    sink.close()
+    assert len(archive.load_archive(path)["timestamp"]) == 250
+    with open(path, "rb") as hf:
+        data = hf.read()
+    with open(path, "wb") as hf:
+        hf.write(data[:-20])
+    with caplog.at_level(logging.WARNING):
+        out = archive.load_archive(path)
+    assert "incomplete block" in caplog.text
+    _assert_same(out, {k: v[:200] for k, v in batch.items()})
@@ -0,0 +1,135 @@
+import gzip
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import numpy as np
+import pytest
+
+from ptprobe import archive, backfill, sinks
+
+N = 600
+
+def _samples(n=N):
+    """Samples 200 ms apart, with fault codes and float32 values"""
+    rng = np.random.default_rng(5)
+    out = []
+    for i in range(n):
+        fault = [0, 0, 4 if 100 <= i < 120 else 0, 0]
+        out.append([1000 + 200*i, [True]*4, fault,
+                [0.0 if f else float(np.float32(20 + rng.normal())) for f in fault],
+                [float(np.float32(25 + 0.1*rng.normal())) for _ in range(4)],
+                [float(np.float32(90 + rng.normal())) for _ in range(4)]])
+    return out
+
+def _record(path, sink_class, samples):
+    sink = sink_class(path)
+    sink.open()
+    for sample in samples:
+        sink.write(sample)
+    sink.close()
+    return path
+
+@pytest.fixture(params=["csv", "ptz"])
+def recording(request, tmp_path):
+    """A recording as a CSV file and as an archive"""
+    samples = _samples()
+    path = str(tmp_path / "rec.{}".format(request.param))
+    sink_class = sinks.CsvSampleSink if request.param == "csv" else archive.ArchiveSampleSink
+    return _record(path, sink_class, samples), samples
+
+def _rows(db):
+    with sqlite3.connect(db) as con:
+        rows = con.execute("SELECT channel, timestamp, fault_T, temperature, pressure "
+                "FROM COM1_day ORDER BY timestamp, channel").fetchall()
+        distinct = con.execute("SELECT COUNT(*) FROM (SELECT DISTINCT channel, timestamp "
+                "FROM COM1_day)").fetchone()[0]
+    return rows, distinct
+
+def test_backfill_to_sqlite(recording, tmp_path):
+    """Every sample of a recording becomes one row per channel"""
+    path, samples = recording
+    db = str(tmp_path / "out.db")
+    count = backfill.backfill_file(path, "sqlite", (db,), write_args=("COM1", "day"),
+            checkpoint_dir=str(tmp_path / "ckpt"), utc_start=1.7e9, batch_size=128,
+            range_bytes=4096)
+    rows, distinct = _rows(db)
+    assert count == len(samples)
+    assert len(rows) == distinct == 4*len(samples)
+    assert [r[2] for r in rows if r[0] == "Channel2"] == [s[2][2] for s in samples]
+    assert np.allclose([r[4] for r in rows if r[0] == "Channel0"], [s[5][0] for s in samples])
+    # a finished file is not written again
+    assert backfill.backfill_file(path, "sqlite", (db,), write_args=("COM1", "day"),
+            checkpoint_dir=str(tmp_path / "ckpt")) == len(samples)
+
+class _FailingSink(sinks.SQLiteSampleSink):
+    """An SQLite sink that fails after a number of batches"""
+    batches_left = None
+
+    def write_batch(self, samples, *args):
+        if _FailingSink.batches_left is not None:
+            if _FailingSink.batches_left == 0:
+                raise KeyboardInterrupt
+            _FailingSink.batches_left -= 1
+        super().write_batch(samples, *args)
+
+def test_interrupted_backfill_resumes_without_duplicates(recording, tmp_path):
+    """A range written again on resume replaces its rows"""
+    path, samples = recording
+    db = str(tmp_path / "out.db")
+    sinks.register_sink("failing-sqlite", _FailingSink)
+    kwargs = dict(write_args=("COM1", "day"), checkpoint_dir=str(tmp_path / "ckpt"),
+            utc_start=1.7e9, batch_size=16, range_bytes=8192)
+    _FailingSink.batches_left = 7
+    try:
+        with pytest.raises(KeyboardInterrupt):
+            backfill.backfill_file(path, "failing-sqlite", (db,), **kwargs)
+    finally:
+        _FailingSink.batches_left = None
+    rows, distinct = _rows(db)
+    assert 0 < len(rows) < 4*len(samples)
+    assert backfill.backfill_file(path, "failing-sqlite", (db,), **kwargs) == len(samples)
+    rows, distinct = _rows(db)
+    assert len(rows) == distinct == 4*len(samples)
+
+class _InfluxStub(BaseHTTPRequestHandler):
+    """Accept InfluxDB v2 writes and keep the line protocol"""
+    lines = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        assert self.path.startswith("/api/v2/write")
+        assert "precision=ms" in self.path and "bucket=probes" in self.path
+        _InfluxStub.lines.extend(body.decode("utf-8").splitlines())
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+def test_backfill_to_influxdb_stub(recording, tmp_path):
+    """Batches are posted as line protocol, one point per sample at its board time"""
+    pytest.importorskip("influxdb_client")
+    path, samples = recording
+    _InfluxStub.lines = []
+    server = HTTPServer(("127.0.0.1", 0), _InfluxStub)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = "http://127.0.0.1:{}".format(server.server_address[1])
+        count = backfill.backfill_file(path, "influxdb", ("token", "org", "probes"),
+                {"url": url}, checkpoint_dir=str(tmp_path / "ckpt"), board_id=7,
+                utc_start=1.7e9, batch_size=250)
+    finally:
+        server.shutdown()
+        server.server_close()
+    lines = _InfluxStub.lines
+    assert count == len(lines) == len(samples)
+    times = [int(line.rsplit(" ", 1)[1]) for line in lines]
+    assert times == [1700000000000 + 200*i for i in range(len(samples))]
+    assert all(line.startswith("board,board_id=7 ") for line in lines)
+    fields = dict(f.split("=") for f in lines[110].split(" ")[1].split(","))
+    assert fields["Tfault2"] == "4i" and float(fields["T2"]) == 0.0
+    assert np.isclose(float(fields["P1"]), samples[110][5][1])
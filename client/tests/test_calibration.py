@@ -0,0 +1,103 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from ptprobe import calibration, simulator
+from ptprobe.board import Controller
+
+posix = pytest.mark.skipif(os.name != "posix", reason="the simulator needs pseudo-terminals")
+
+BOARD = 4
+NEW = [(-96.8, 918.2, -14.1), (-99.0, 930.0, 0.0), (-95.0, 905.5, -20.0), (-97.0, 921.0, -15.0)]
+
+def _collect(sim, raw_pressure, n=30):
+    """Timestamps and pressures of n samples in full frames"""
+    pt = Controller(sim.port)
+    info = pt.board_info()
+    batches = list(pt.iter_batches(size=n, max_samples=n,
+            frame_format={"compact": False, "raw_pressure": raw_pressure}))
+    t = np.concatenate([b["timestamp"] for b in batches])
+    p = np.concatenate([b["pressure"] for b in batches])
+    return info, t, p
+
+@posix
+def test_onboard_pressures_invert_to_raw_frames():
+    """Pressures converted on the board invert to the raw values the board sends with RAW_P"""
+    with simulator.SimulatedBoard(board_id=BOARD, rate=100.0) as sim:
+        info, t, p = _collect(sim, raw_pressure=False)
+        _, t_raw, x = _collect(sim, raw_pressure=True)
+    onboard = calibration.CoefficientHistory()
+    assert onboard.track(BOARD, info["P"], 0) == [0, 1, 2, 3]
+    assert onboard.track(BOARD, info["P"], 10) == []
+
+    raw = np.array([sim.values(int(ts))[2] for ts in t])
+    for ich in range(4):
+        recovered = onboard.invert(BOARD, ich, t, p[:,ich])
+        assert np.array_equal(recovered, raw[:,ich])
+        # and the pressures come back to float32 precision
+        assert np.allclose(onboard.apply(BOARD, ich, t, recovered), p[:,ich], rtol=1e-6, atol=1e-4)
+
+    # the raw frames carry the ADC values as float32, converted on the host
+    raw = np.array([sim.values(int(ts))[2] for ts in t_raw])
+    assert np.array_equal(x, raw.astype(np.float32))
+    expected = np.array([sim.pressure(r) for r in raw])
+    for ich in range(4):
+        assert np.allclose(onboard.apply(BOARD, ich, t_raw, x[:,ich]), expected[:,ich],
+                rtol=1e-6, atol=1e-4)
+
+@posix
+def test_reprocess_matches_raw_conversion():
+    """Reprocessed onboard pressures equal the raw values converted with the new calibration"""
+    with simulator.SimulatedBoard(board_id=BOARD, rate=100.0) as sim:
+        info, t, p = _collect(sim, raw_pressure=False)
+    onboard = calibration.CoefficientHistory()
+    onboard.track(BOARD, info["P"], 0)
+    cal = calibration.CoefficientHistory()
+    for ich, coeffs in enumerate(NEW):
+        cal.add(BOARD, ich, coeffs, valid_from=0)
+    out = onboard.reprocess(cal, BOARD, t, p)
+    raw = np.array([sim.values(int(ts))[2] for ts in t])
+    for ich, coeffs in enumerate(NEW):
+        assert np.allclose(out[:,ich], calibration.apply(raw[:,ich], coeffs), rtol=1e-12)
+
+def test_versions_and_ranges(tmp_path):
+    """A later version takes precedence over its range only, and the history persists"""
+    path = str(tmp_path / "cal" / "history.json")
+    history = calibration.CoefficientHistory(path)
+    assert history.add(BOARD, 0, NEW[0], valid_from=100) == 1
+    assert history.add(BOARD, 0, NEW[1], valid_from=200, valid_to=300, note="recal") == 2
+    assert history.add(BOARD, 1, NEW[2], valid_from=0) == 1
+    loaded = calibration.CoefficientHistory(path)
+    assert loaded.entries == history.entries
+    assert [loaded.lookup(BOARD, 0, t) for t in (50, 100, 250, 300)] == [
+            None, NEW[0], NEW[1], NEW[0]]
+    edges, coeffs = loaded.timeline(BOARD, 0)
+    assert list(edges) == [100, 200, 300, np.inf]
+    assert np.array_equal(coeffs, [NEW[0], NEW[1], NEW[0]])
+
+@pytest.mark.parametrize("shuffle", [False, True])
+def test_apply_invert_round_trip_across_versions(shuffle):
+    """Raw values converted by version survive inversion, in or out of time order"""
+    history = calibration.CoefficientHistory()
+    history.add(BOARD, 2, NEW[0], valid_from=100)
+    history.add(BOARD, 2, NEW[2], valid_from=200, valid_to=300)
+    t = np.arange(0, 400, 5, dtype=np.float64)
+    x = np.round(np.linspace(0.05, 0.95, len(t))*4095)/4095
+    if shuffle:
+        order = np.random.default_rng(1).permutation(len(t))
+        t, x = t[order], x[order]
+    p = history.apply(BOARD, 2, t, x)
+    assert np.isnan(p[t < 100]).all()
+    valid = t >= 100
+    assert np.array_equal(history.invert(BOARD, 2, t, p)[valid], x[valid])
+    p32 = p.astype(np.float32)     # as sent by the board
+    assert np.array_equal(history.invert(BOARD, 2, t, p32)[valid], x[valid])
+
+def test_invert_edge_cases():
+    """A linear polynomial inverts exactly, a pressure without a real root gives NaN"""
+    x = np.array([0.0, 0.25, 1.0])
+    assert np.allclose(calibration.invert(calibration.apply(x, NEW[1]), NEW[1], counts=None), x)
+    # the maximum of -96.8 + 918.2x - 14.1x^2 is far above any real pressure
+    assert np.isnan(calibration.invert([1e6], NEW[0]))[0]
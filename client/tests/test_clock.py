@@ -0,0 +1,51 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from ptprobe import clock
+
+def _arrivals(board_ms, offset=100.0, drift_ppm=50.0, seed=1):
+    """Host arrival times: a drifting board clock, USB jitter and some long delays"""
+    rng = np.random.default_rng(seed)
+    t = np.asarray(board_ms, dtype=float)
+    t = t - t[0]
+    host = offset + t*1e-3*(1 + drift_ppm*1e-6)
+    delay = rng.exponential(0.0005, len(t))
+    outliers = rng.random(len(t)) < 0.05
+    delay[outliers] += rng.uniform(0.02, 0.2, outliers.sum())
+    return host, host + delay
+
+def test_fit_ignores_latency_outliers():
+    """The fit follows the earliest arrivals, not the delayed ones"""
+    board = np.arange(0, 200*500, 200)
+    true_host, host = _arrivals(board)
+    model = clock.ClockModel(window=512)
+    for b, h in zip(board, host):
+        model.update(int(b), float(h))
+    model.fit()
+    assert model.drift_ppm == pytest.approx(50.0, abs=10.0)
+    err = np.abs(model.to_host(board) - true_host).max()
+    assert err < 0.001
+    # a least-squares line through all arrivals is pulled late by the outliers
+    slope, intercept = np.polyfit(board, host, 1)
+    assert np.abs(intercept + slope*board - true_host).max() > 3*err
+
+def test_fit_across_wrap():
+    """Timestamps rolling over 2^32 ms continue the line"""
+    board = (clock.WRAP - 50*200 + np.arange(0, 200*300, 200)) % clock.WRAP
+    unwrapped = clock.WRAP - 50*200 + np.arange(0, 200*300, 200)
+    true_host, host = _arrivals(unwrapped, seed=2)
+    model = clock.ClockModel(window=256)
+    for b, h in zip(board, host):
+        model.update(int(b), float(h))
+    model.fit()
+    assert model._wraps == 1
+    assert model.drift_ppm == pytest.approx(50.0, abs=10.0)
+    # raw timestamps before and after the rollover map onto one line
+    assert np.abs(model.to_host(board) - true_host).max() < 0.001
+    assert np.all(np.diff(model.to_host(board)) > 0)
+
+def test_recording_clock_across_wrap():
+    """A recording is mapped at the nominal rate across the rollover"""
+    rc = clock.RecordingClock(1.7e9, clock.WRAP - 1000)
+    assert rc.to_utc([clock.WRAP - 1000, 0, 1000]).tolist() == pytest.approx([1.7e9, 1.7e9 + 1, 1.7e9 + 2])
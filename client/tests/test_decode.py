@@ -0,0 +1,150 @@
+import copy
+import struct
+
+import pytest
+
+from ptprobe import sinks
+from ptprobe.board import Controller
+from ptprobe.simulator import SimulatedBoard
+
+class _ReplayPort:
+    """Serve a recorded byte stream through the serial port interface, ``chunk`` bytes per read"""
+
+    def __init__(self, data, chunk):
+        self.data = data
+        self.pos = 0
+        self.chunk = chunk
+        self.port = 'replay'
+        self.timeout = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    @property
+    def in_waiting(self):
+        return min(self.chunk, len(self.data) - self.pos)
+
+    def readinto(self, b):
+        n = min(len(b), self.chunk, len(self.data) - self.pos)
+        b[:n] = self.data[self.pos:self.pos+n]
+        self.pos += n
+        return n
+
+    def write(self, msg):
+        return len(msg)
+
+class _CopySink (sinks.ListSampleSink):
+    """Keep a copy of each sample, for records that are reused"""
+
+    def write(self, sample, *args):
+        self.data.append(copy.deepcopy(sample))
+
+def _stream():
+    """Full frames, then compact frames with several channel masks, ended by HALT"""
+    sim = SimulatedBoard(T_channels=(0,2,3), T_faults={2: 1})
+    frames = []
+    t = 0xFFFFFFFF - 30000    # the clock wraps in the compact part
+    for i in range(100):
+        frames.append(sim.full_frame(t))
+        t += 200
+    for mask, flags in [(0xFF, 0), (0x31, Controller.FrameFlags.DELTA_TS), (0x0C, Controller.FrameFlags.DELTA_TS)]:
+        sim.format = Controller.FrameFlags.COMPACT | flags
+        sim.channel_mask = mask
+        for i in range(100):
+            absolute = i % sim.ABS_TIMESTAMP_EVERY == 0
+            frames.append(sim.compact_frame(t, None if absolute else t - 200))
+            t = (t + 200) & 0xFFFFFFFF
+    frames.append(bytes([Controller.PacketType.HALT << 6]) + struct.pack('>I', len(frames)))
+    return b''.join(frames)
+
+def _decode_full(body):
+    """The per-frame decoding of a full frame body, before frames were decoded in place"""
+    active_T = [False]*4
+    fault_T = [0]*4
+    temperature = [0]*4
+    ref_temperature = [0]*4
+    pressure = [0]*4
+    t_hdr = body[4]
+    p_hdr = body[21]
+    tr_hdr = body[38]
+    for ich in range(4):
+        if t_hdr & (1 << (ich+4)):
+            active_T[ich] = True
+            if t_hdr & (1 << ich):
+                fault_T[ich] = struct.unpack_from('>I',body,5+4*ich)[0]
+            else:
+                temperature[ich] = struct.unpack_from('>f',body,5+4*ich)[0]
+        if p_hdr & (1 << (ich+4)):
+            pressure[ich] = struct.unpack_from('>f',body,22+4*ich)[0]
+        if tr_hdr & (1 << (ich+4)):
+            ref_temperature[ich] = struct.unpack_from('>f',body,39+4*ich)[0]
+    return [active_T, fault_T, temperature, ref_temperature, pressure]
+
+def _decode_compact(body):
+    """The per-frame decoding of a compact frame body, before frames were decoded in place"""
+    t_hdr = body[0]
+    p_hdr = body[1]
+    active_T = [bool(t_hdr & (1 << (ich+4))) for ich in range(4)]
+    pos = 4 if p_hdr & 0x01 else 6
+    fault_T = [0]*4
+    temperature = [0]*4
+    ref_temperature = [0]*4
+    pressure = [0]*4
+    for ich in range(4):
+        if active_T[ich]:
+            if t_hdr & (1 << ich):
+                fault_T[ich] = struct.unpack_from('>I',body,pos)[0]
+            else:
+                temperature[ich] = struct.unpack_from('>f',body,pos)[0]
+            ref_temperature[ich] = struct.unpack_from('>f',body,pos+4)[0]
+            pos += 8
+    for ich in range(4):
+        if p_hdr & (1 << (ich+4)):
+            pressure[ich] = struct.unpack_from('>f',body,pos)[0]
+            pos += 4
+    return [active_T, fault_T, temperature, ref_temperature, pressure]
+
+def _reference(data):
+    """Split the stream into frames and decode each from a copy of its bytes"""
+    samples = []
+    pos = 0
+    timestamp = None
+    while data[pos] != Controller.PacketType.HALT << 6:
+        body = bytes(data[pos+1:pos+1+(data[pos] & 0x3F)])
+        pos += 1 + len(body)
+        if len(body) == 55:
+            timestamp = struct.unpack_from('>I', body)[0]
+            samples.append([timestamp] + _decode_full(body))
+        else:
+            if body[1] & 0x01:
+                timestamp = (timestamp + struct.unpack_from('>H', body, 2)[0]) & 0xFFFFFFFF
+            else:
+                timestamp = struct.unpack_from('>I', body, 2)[0]
+            samples.append([timestamp] + _decode_compact(body))
+    return samples
+
+@pytest.mark.parametrize("chunk", [1, 7, 56, 5000])
+@pytest.mark.parametrize("reuse_records", [False, True])
+def test_decoding_matches_per_frame_decoding(chunk, reuse_records):
+    """Frames decoded in place, across reads of any size, equal the per-frame decoding"""
+    data = _stream()
+    expected = _reference(data)
+    sink = _CopySink() if reuse_records else sinks.ListSampleSink()
+    pt = Controller('replay', sinks=[sink])
+    pt.comm = _ReplayPort(data, chunk)
+    assert pt.collect_samples(reuse_records=reuse_records) == len(expected)
+    assert sink.data == expected
+    assert pt.metrics.skipped_bytes == 0 and pt.metrics.header_errors == 0
+
+def test_new_records_without_reuse():
+    """Without reuse_records each sample is a list of its own"""
+    data = _stream()
+    sink = sinks.ListSampleSink()
+    pt = Controller('replay', sinks=[sink])
+    pt.comm = _ReplayPort(data, 4096)
+    pt.collect_samples()
+    assert len({id(s) for s in sink.data}) == len(sink.data)
+    assert len({id(s[5]) for s in sink.data}) == len(sink.data)
@@ -0,0 +1,75 @@
+import json
+import os
+
+import pytest
+
+from ptprobe import discovery, simulator
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="the simulator needs pseudo-terminals")
+
+class _UsbPort:
+    """Port info of a USB serial port"""
+
+    def __init__(self, device, serial_number):
+        self.device = device
+        self.serial_number = serial_number
+        self.vid = 0x2E8A
+
+@pytest.fixture
+def boards(monkeypatch):
+    """Two simulated boards enumerated as USB ports, and a probe counter"""
+    sims = [simulator.SimulatedBoard(board_id=7), simulator.SimulatedBoard(board_id=8)]
+    infos = [_UsbPort(sim.start(), "SN{}".format(i)) for i, sim in enumerate(sims)]
+    monkeypatch.setattr(discovery, "candidate_ports", lambda vid=None: list(infos))
+    probed = []
+    probe = discovery.probe
+
+    def counting_probe(port, timeout=0.5):
+        probed.append(port)
+        return probe(port, timeout)
+    monkeypatch.setattr(discovery, "probe", counting_probe)
+    yield sims, probed
+    for sim in sims:
+        sim.close()
+
+def test_probe_fills_cache(boards, tmp_path):
+    """Unknown ports are probed and cached, known ones are not probed again"""
+    sims, probed = boards
+    cache = discovery.PortCache(str(tmp_path / "ports.json"))
+    assert discovery.discover(cache=cache) == {7: sims[0].port, 8: sims[1].port}
+    assert len(probed) == 2
+    assert json.load(open(cache.path)) == {"SN0": 7, "SN1": 8}
+    del probed[:]
+    again = discovery.PortCache(cache.path)
+    assert discovery.discover(cache=again) == {7: sims[0].port, 8: sims[1].port}
+    assert probed == []
+
+def test_stale_cache(boards, tmp_path):
+    """A cached ID is trusted until a refresh, which probes and rewrites the cache"""
+    sims, probed = boards
+    path = str(tmp_path / "ports.json")
+    # SN0 was re-provisioned elsewhere, SN9 is unplugged
+    with open(path, "w") as hf:
+        json.dump({"SN0": 3, "SN9": 4}, hf)
+    cache = discovery.PortCache(path)
+    assert discovery.discover(cache=cache) == {3: sims[0].port, 8: sims[1].port}
+    assert probed == [sims[1].port]
+    assert discovery.discover(cache=cache, refresh=True) == {7: sims[0].port, 8: sims[1].port}
+    assert json.load(open(path)) == {"SN0": 7, "SN1": 8, "SN9": 4}
+
+def test_corrupt_cache(boards, tmp_path, caplog):
+    """An unreadable cache file is ignored with a warning and rewritten"""
+    sims, probed = boards
+    path = str(tmp_path / "ports.json")
+    with open(path, "w") as hf:
+        hf.write("{not json")
+    assert discovery.discover(cache=discovery.PortCache(path)) == {7: sims[0].port, 8: sims[1].port}
+    assert "Ignoring port cache" in caplog.text
+    assert json.load(open(path)) == {"SN0": 7, "SN1": 8}
+
+def test_silent_port(boards, tmp_path):
+    """A port without a board is left out and not cached"""
+    sims, probed = boards
+    sims[1].debug_level = 1     # does not answer requests
+    found = discovery.discover(cache=discovery.PortCache(str(tmp_path / "ports.json")), timeout=0.2)
+    assert found == {7: sims[0].port}
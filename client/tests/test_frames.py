@@ -0,0 +1,86 @@
+import os
+import struct
+
+import pytest
+
+from ptprobe import simulator
+from ptprobe.board import Controller
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="the simulator needs pseudo-terminals")
+
+N = 20
+
+def _f32(x):
+    return struct.unpack('>f', struct.pack('>f', x))[0]
+
+class _Board (simulator.SimulatedBoard):
+    """A simulated board that keeps the timestamp and size of each DATA frame
+
+    The clock starts shortly before the 32 bit wrap, and absolute timestamps
+    are sent every few frames, so delta frames follow both.
+    """
+    ABS_TIMESTAMP_EVERY = 7
+
+    def __init__(self, **kwargs):
+        self.frames = []
+        super().__init__(rate=100.0, **kwargs)
+
+    def millis(self):
+        return (super().millis() + 0xFFFFFFFF - 50) & 0xFFFFFFFF
+
+    def full_frame(self, timestamp):
+        frame = super().full_frame(timestamp)
+        self.frames.append((timestamp, len(frame)))
+        return frame
+
+    def compact_frame(self, timestamp, last_timestamp=None):
+        frame = super().compact_frame(timestamp, last_timestamp)
+        self.frames.append((timestamp, len(frame)))
+        return frame
+
+@pytest.mark.parametrize("frame_format, T_channels, P_channels, size", [
+    (None, (0,1), (0,1,2,3), 56),
+    ({"compact": True, "delta_timestamp": True, "T_channels": (0,2), "P_channels": (1,3)},
+            (0,), (1,3), 1+2+2+8+8),
+    ({"compact": True, "delta_timestamp": False, "T_channels": (), "P_channels": (0,)},
+            (), (0,), 1+2+4+4),
+    ({"compact": True, "delta_timestamp": True, "T_channels": (0,1,2,3), "P_channels": ()},
+            (0,1), (), 1+2+2+16),
+])
+def test_frames_decode(frame_format, T_channels, P_channels, size):
+    """Full and compact frames decode to the values the board sent, unselected channels as zero"""
+    with _Board(T_channels=(0,1), T_faults={1: 4}) as sim:
+        pt = Controller(sim.port)
+        samples = list(pt.iter_samples(max_samples=N, frame_format=frame_format))
+        frames = sim.frames[:N]
+
+    assert len(samples) == N
+    assert [s[0] for s in samples] == [ts for ts, _ in frames]
+    assert any(ts < 0x1000 for ts, _ in frames)     # the clock wrapped
+    if frame_format is not None and frame_format["delta_timestamp"]:
+        assert {n for _, n in frames} == {size, size + 2}
+    else:
+        assert {n for _, n in frames} == {size}
+
+    for sample in samples:
+        T, Tref, raw = sim.values(sample[0])
+        P = sim.pressure(raw)
+        for ich in range(4):
+            T_sent = ich in T_channels
+            assert sample[1][ich] == T_sent
+            assert sample[2][ich] == (4 if T_sent and ich == 1 else 0)
+            assert sample[3][ich] == (_f32(T[ich]) if T_sent and ich != 1 else 0)
+            assert sample[4][ich] == (_f32(Tref[ich]) if T_sent else 0)
+            assert sample[5][ich] == (_f32(P[ich]) if ich in P_channels else 0)
+
+def test_frame_format_reported():
+    """The board reports the format and channel mask it was set to"""
+    with _Board() as sim:
+        pt = Controller(sim.port)
+        fmt = pt.set_frame_format(T_channels=(3,), P_channels=(0,2), interval_ms=250)
+        assert fmt == {"compact": True, "delta_timestamp": True, "T_channels": [3],
+                "P_channels": [0,2], "interval_ms": 250, "raw_pressure": False}
+        assert pt.sample_interval_ms == 250
+        assert sim.channel_mask == 0x85
+        with pytest.raises(ValueError):
+            pt.set_frame_format(interval_ms=0x10000)
@@ -0,0 +1,81 @@
+import pytest
+
+from ptprobe import gaps, sinks
+from ptprobe.gaps import WRAP, GapIndex
+
+np = pytest.importorskip("numpy")
+
+def _stream(t0, n, interval, dropped):
+    """Board timestamps (wrapped at 32 bits) of n samples, without the dropped indices"""
+    return [(t0 + interval*i) % WRAP for i in range(n) if i not in dropped]
+
+@pytest.mark.parametrize("interval_ms", [100, 0])
+def test_gaps_across_wrap(interval_ms):
+    """Gaps on either side of the counter rollover are found at unwrapped times"""
+    t0 = WRAP - 2000
+    timestamps = _stream(t0, 60, 100, dropped={3, 18, 19, 20, 21, 40})
+    index = GapIndex(interval_ms)
+    for t in timestamps:
+        index.observe(t)
+    index.halt(60)
+    assert index.gaps == [(t0 + 200, t0 + 400, 1), (t0 + 1700, t0 + 2200, 4),
+            (t0 + 3900, t0 + 4100, 1)]
+    assert index.gaps[1][1] > WRAP    # unwrapped
+    assert index.missing == 6 and index.unlocated == 0
+    assert index.received == 54 and index.board_count == 60
+    assert index.interval_ms == pytest.approx(100)
+
+def test_unlocated_losses():
+    """Samples reported by the board but not placed by the timestamps are unlocated"""
+    index = GapIndex(100)
+    for t in _stream(0, 20, 100, dropped={5}):
+        index.observe(t)
+    index.halt(22)
+    assert index.gaps == [(400, 600, 1)]
+    assert index.unlocated == 2 and index.missing == 3
+
+def test_restart_compares_the_session_only():
+    """After a restart, the HALT count is compared with the samples of the new session"""
+    index = GapIndex(100)
+    for t in range(0, 1000, 100):
+        index.observe(t)
+    index.restart()
+    for t in range(0, 500, 100):
+        index.observe(t)
+    index.halt(5)
+    assert index.unlocated == 0 and index.received == 15
+
+def test_mask_and_fill_recorded_arrays():
+    """The recorded (wrapped) timestamps are masked after each gap and NaN-filled"""
+    t0 = WRAP - 2000
+    timestamps = np.array(_stream(t0, 40, 100, dropped={18, 19, 20, 21}), dtype=np.int64)
+    index = GapIndex(100)
+    for t in timestamps:
+        index.observe(int(t))
+    mask = index.mask(timestamps)
+    assert list(np.flatnonzero(mask)) == [18]
+    values = np.arange(len(timestamps), dtype=np.float64)
+    t_filled, v_filled = index.fill(timestamps, values)
+    assert len(t_filled) == 40
+    assert np.array_equal(t_filled, t0 + 100.0*np.arange(40))
+    assert np.isnan(v_filled[18:22]).all()
+    assert np.array_equal(v_filled[22:], values[18:])
+
+def test_save_load(tmp_path):
+    """An index saved next to a recording loads with the same gaps and counts"""
+    index = GapIndex()
+    for t in _stream(WRAP - 1000, 30, 200, dropped={2, 7, 8}):
+        index.observe(t)
+    index.halt(31)
+    sink = sinks.CsvSampleSink(str(tmp_path / "rec.csv"))
+    sink.write_gaps(index)
+    loaded = GapIndex.load(str(tmp_path / "rec.csv.gaps.json"))
+    assert loaded.gaps == index.gaps
+    assert (loaded.interval_ms, loaded.received, loaded.board_count, loaded.unlocated) == (
+            index.interval_ms, index.received, 31, 1)
+    assert np.array_equal(loaded.to_array(), index.to_array())
+
+def test_unwrap():
+    """Timestamps are unwrapped at each rollover, not at small steps back"""
+    assert list(gaps.unwrap([WRAP - 10, 5, 20])) == [WRAP - 10, WRAP + 5, WRAP + 20]
+    assert list(gaps.unwrap([10, 8, 12])) == [10, 8, 12]
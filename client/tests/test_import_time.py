@@ -0,0 +1,19 @@
+import os
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+# modules that must only be imported when a sink that needs them is opened
+LAZY_MODULES = ["influxdb_client", "sqlite3", "numpy", "datetime"]
+
+def test_sinks_and_board_import_no_heavy_modules():
+    """Importing the sinks and the controller must not load database clients or NumPy"""
+    code = ("import sys\n"
+            "import ptprobe.sinks, ptprobe.board\n"
+            "print(','.join(m for m in {!r} if m in sys.modules))\n").format(LAZY_MODULES)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([SRC] + [p for p in [env.get("PYTHONPATH")] if p])
+    out = subprocess.run([sys.executable, "-c", code], env=env, check=True,
+            stdout=subprocess.PIPE, universal_newlines=True).stdout.strip()
+    assert out == "", "imported at import time: {}".format(out)
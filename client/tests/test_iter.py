@@ -0,0 +1,105 @@
+import os
+import struct
+import threading
+import time
+
+import pytest
+
+from ptprobe import simulator
+from ptprobe.board import Controller
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="the simulator needs pseudo-terminals")
+
+class _Board (simulator.SimulatedBoard):
+    """A simulated board that counts the halt commands it receives"""
+
+    def __init__(self, **kwargs):
+        self.halts = 0
+        super().__init__(**kwargs)
+
+    def _halt(self, send=True):
+        if self.started:
+            self.halts += 1
+        super()._halt(send)
+
+def _halted(sim, timeout=2.0):
+    """Wait for the board to stop streaming"""
+    t_end = time.monotonic() + timeout
+    while sim.started and time.monotonic() < t_end:
+        time.sleep(0.01)
+    return not sim.started
+
+def test_iter_samples_max_samples():
+    """The board stops itself after max_samples, each sample is a list of its own"""
+    with _Board(rate=100.0) as sim:
+        pt = Controller(sim.port)
+        samples = list(pt.iter_samples(max_samples=10))
+        assert len(samples) == 10
+        assert len({id(s) for s in samples}) == 10
+        timestamps = [s[0] for s in samples]
+        assert timestamps == sorted(set(timestamps))
+        assert _halted(sim) and sim.halts == 0
+        assert pt.metrics.dropped == 0
+
+def test_leaving_the_loop_halts_the_board():
+    """Breaking out of the loop halts the board, and the next stream starts clean"""
+    with _Board(rate=100.0) as sim:
+        pt = Controller(sim.port)
+        for n, sample in enumerate(pt.iter_samples(), 1):
+            if n == 5:
+                break
+        assert _halted(sim) and sim.halts == 1
+        assert not pt._streaming
+
+        gen = pt.iter_samples()
+        first = next(gen)
+        assert first[0] > sample[0]
+        gen.close()
+        assert _halted(sim) and sim.halts == 2
+        assert len(list(pt.iter_samples(max_samples=3))) == 3
+
+def test_requests_while_iterating():
+    """Requests from another thread are answered from the stream"""
+    with _Board(board_id=9, rate=50.0) as sim:
+        pt = Controller(sim.port)
+        answers = []
+        for n, sample in enumerate(pt.iter_samples(max_samples=25)):
+            if n == 2:
+                th = threading.Thread(target=lambda: answers.append(pt.board_id()))
+                th.start()
+        th.join(5.0)
+        assert answers == [9]
+
+def test_iter_batches_sizes():
+    """Batches hold size samples, the last one the rest, as typed arrays"""
+    np = pytest.importorskip("numpy")
+    with _Board(rate=100.0, T_channels=(1,), T_faults={1: 2}) as sim:
+        pt = Controller(sim.port)
+        batches = list(pt.iter_batches(size=4, max_samples=10))
+    assert [len(b["timestamp"]) for b in batches] == [4, 4, 2]
+    batch = batches[0]
+    assert batch["timestamp"].dtype == np.int64 and batch["active_T"].dtype == bool
+    assert batch["pressure"].shape == (4, 4)
+    timestamps = np.concatenate([b["timestamp"] for b in batches])
+    assert np.all(np.diff(timestamps) > 0)
+    active = np.concatenate([b["active_T"] for b in batches])
+    assert active[:, 1].all() and not active[:, [0, 2, 3]].any()
+    assert np.all(np.concatenate([b["fault_T"] for b in batches])[:, 1] == 2)
+    for b in batches:
+        for t, pressure in zip(b["timestamp"], b["pressure"]):
+            P = sim.pressure(sim.values(int(t))[2])
+            assert list(pressure) == [struct.unpack('>f', struct.pack('>f', p))[0] for p in P]
+
+def test_iter_batches_max_latency():
+    """A batch is passed on when its first sample is older than max_latency_ms"""
+    pytest.importorskip("numpy")
+    with _Board(rate=50.0) as sim:
+        pt = Controller(sim.port)
+        batches = pt.iter_batches(size=1000, max_latency_ms=100)
+        t0 = time.monotonic()
+        sizes = [len(next(batches)["timestamp"]) for _ in range(3)]
+        elapsed = time.monotonic() - t0
+        batches.close()
+        assert all(1 <= n <= 10 for n in sizes)
+        assert elapsed < 1.0
+        assert _halted(sim) and sim.halts == 1
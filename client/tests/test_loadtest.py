@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+from ptprobe import loadtest, sinks
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="the simulator needs pseudo-terminals")
+
+class _BrokenSink (sinks.ListSampleSink):
+    """A sink that breaks on the first sample of one board"""
+
+    def __init__(self, board, how):
+        super().__init__()
+        self.board = board
+        self.how = how
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def write(self, sample, *args):
+        if self.board == "1":
+            if self.how == "exit":
+                os._exit(3)
+            raise RuntimeError("sink failed")
+        super().write(sample, *args)
+
+@pytest.fixture(autouse=True)
+def broken_sink():
+    sinks.register_sink("broken", _BrokenSink)
+
+@pytest.mark.parametrize("processes,how", [(False, "raise"), (True, "raise"), (True, "exit")])
+def test_failed_board_is_reported(processes, how):
+    """A board whose collection raises or whose process dies is reported, the others measured"""
+    result = loadtest.run_load(3, rate=20.0, duration=1.0, warmup=0.5,
+            sinks=[("broken", ("{board}", how))], processes=processes)
+    assert [b["board"] for b in result["boards"]] == [0, 2]
+    assert all(b["samples"] > 0 for b in result["boards"])
+    assert [b["board"] for b in result["failed"]] == [1]
+    expected = "exited with code 3" if how == "exit" else "sink failed"
+    assert expected in result["failed"][0]["error"]
+    summary = loadtest.summarize(result, 20.0, 1.0)
+    assert summary["failed"] == 1
+    assert "failed 1" in loadtest.format_summary(3, summary)
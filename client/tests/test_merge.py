@@ -0,0 +1,32 @@
+from ptprobe import merge
+from ptprobe.gaps import WRAP
+
+def _stream(t0, n, dt=100):
+    """Samples whose uint32 timestamps start at t0"""
+    return [[(t0 + i*dt) % WRAP, i] for i in range(n)]
+
+def test_merge_streams_across_rollover():
+    """Streams stay in time order when one board's counter wraps"""
+    a = _stream(WRAP - 250, 6)          # wraps after its third sample
+    b = _stream(WRAP - 200, 6, dt=90)
+    merged = list(merge.merge_streams({"a": a, "b": b}))
+    times = [t for t, _, _ in merged]
+    assert times == sorted(times)
+    assert [(key, sample[1]) for _, key, sample in merged][:4] == [("a", 0), ("b", 0), ("a", 1), ("b", 1)]
+    assert times[-1] > WRAP
+
+def test_time_merger_across_rollover():
+    """The live merger emits in time order across a rollover, without late samples"""
+    out = []
+    merger = merge.TimeMerger(["a", "b"], window_ms=1000,
+            offsets={"b": 50}, output=lambda t, key, sample: out.append((t, key)))
+    a = _stream(WRAP - 250, 8)
+    b = _stream(WRAP - 300, 8)
+    for sa, sb in zip(a, b):
+        merger.push("a", sa)
+        merger.push("b", sb)
+    merger.flush()
+    assert merger.late_count == 0
+    assert len(out) == 16
+    assert [t for t, _ in out] == sorted(t for t, _ in out)
+    assert out[-1][0] == WRAP - 250 + 700
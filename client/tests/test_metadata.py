@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+from ptprobe import metadata, simulator
+from ptprobe.board import Controller
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="the simulator needs pseudo-terminals")
+
+ALL = {"B"} | {"SP{}".format(ich) for ich in range(4)} | {"ST{}".format(ich) for ich in range(4)}
+
+class _CountingBoard (simulator.SimulatedBoard):
+    """A simulated board that records the requests it answers"""
+
+    def __init__(self, **kwargs):
+        self.asked = []
+        super().__init__(**kwargs)
+
+    def _ask(self, msg):
+        self.asked.append(msg)
+        super()._ask(msg)
+
+@pytest.mark.parametrize("command,args,asked", [
+    ("set_P_poly_coeffs", (2, [1.0, 2.0, 0.5]), {"SP2"}),
+    ("set_board_id", (9,), {"B"}),
+    ("configure", {"board_id": 9, "P_coeffs": {1: [1.0, 2.0, 0.5]}}, {"B", "SP1"}),
+    ("configure", {"debug_level": 0}, set()),
+    ("set_debug_level", (0,), set()),
+    ("store_board_config", (True,), ALL),
+    ("reset_board", (), ALL),
+])
+def test_write_command_invalidates(command, args, asked):
+    """After a write command, board_info asks again for exactly what it may have changed"""
+    with _CountingBoard(board_id=5) as sim:
+        pt = Controller(sim.port)
+        first = pt.board_info()
+        assert set(sim.asked) == ALL and len(sim.asked) == len(ALL)
+        del sim.asked[:]
+        assert pt.board_info() == first and sim.asked == []
+
+        method = getattr(pt, command)
+        method(**args) if isinstance(args, dict) else method(*args)
+        info = pt.board_info()
+        assert set(sim.asked) == asked and len(sim.asked) == len(asked)
+        assert info["board_id"] == sim.board_id
+        assert [p["ai"] for p in info["P"]] == [pytest.approx(ai) for ai in sim.ai]
+
+def test_refresh_asks_again():
+    """board_info(refresh=True) ignores the cache"""
+    with _CountingBoard() as sim:
+        pt = Controller(sim.port)
+        pt.board_info()
+        del sim.asked[:]
+        pt.board_info(refresh=True)
+        assert set(sim.asked) == ALL
+
+def test_persisted_per_board(tmp_path):
+    """A new controller is served from the file, for the same board only"""
+    path = str(tmp_path / "meta.json")
+    with _CountingBoard(board_id=5) as sim:
+        Controller(sim.port, metadata_path=path).board_info()
+        del sim.asked[:]
+        # without USB information the board is identified by its ID
+        pt = Controller(sim.port, metadata_path=path)
+        pt.board_info()
+        assert sim.asked == ["B"]
+
+        pt.set_board_id(6)
+        del sim.asked[:]
+        pt.board_info()
+        # the sensors of the board are unchanged, only its ID is asked again
+        assert sim.asked == ["B"]
+    boards = metadata.MetadataCache(path=path).boards
+    assert set(boards) == {"id:5", "id:6"}
+    assert (boards["id:5"]["board_id"][1], boards["id:6"]["board_id"][1]) == (5, 6)
@@ -0,0 +1,93 @@
+import math
+import re
+
+import pytest
+
+from ptprobe import metrics
+
+np = pytest.importorskip("numpy")
+
+def test_running_stats_match_numpy():
+    """Welford updates and Chan merges agree with NumPy on the same data"""
+    rng = np.random.default_rng(11)
+    x = rng.normal(1e6, 3.0, 10000)   # a large mean, where naive sums lose precision
+    stats = metrics.RunningStats()
+    for v in x[:4000]:
+        stats.add(float(v))
+    for part in np.array_split(x[4000:], 7):
+        stats.add_batch(len(part), float(part.mean()), float(((part - part.mean())**2).sum()),
+                float(part.min()), float(part.max()))
+    assert stats.n == len(x)
+    assert stats.mean == pytest.approx(x.mean(), rel=1e-12)
+    assert stats.variance == pytest.approx(x.var(ddof=1), rel=1e-9)
+    assert (stats.min, stats.max) == (x.min(), x.max())
+
+def test_running_stats_edge_cases():
+    """No or one observation gives zero variance, an empty batch changes nothing"""
+    stats = metrics.RunningStats()
+    assert stats.variance == 0.0
+    stats.add(5.0)
+    stats.add_batch(0, 0.0, 0.0, math.inf, -math.inf)
+    assert (stats.n, stats.mean, stats.variance, stats.min, stats.max) == (1, 5.0, 0.0, 5.0, 5.0)
+
+def test_dropped_from_halt_count():
+    """The HALT count minus the samples received in the run are dropped"""
+    m = metrics.AcquisitionMetrics()
+    m.start_run()
+    for i in range(10):
+        m.data_frame(i*0.01, 56)
+    m.halt_frame(12, 5)
+    m.start_run()
+    m.data_frame(1.0, 56)
+    m.halt_frame(1, 5)
+    assert (m.samples, m.dropped, m.frames_decoded, m.bytes_read) == (11, 2, 13, 11*56 + 10)
+    assert m.interarrival.n == 9
+    assert m.interarrival.mean == pytest.approx(1e4)
+
+def _parse(text):
+    """Prometheus text to {(name, labels): value}, checking HELP/TYPE lines"""
+    samples = {}
+    typed = set()
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            typed.add(line.split()[2])
+            continue
+        if line.startswith("#"):
+            continue
+        m = re.match(r'^(\w+)(\{.*\})? (\S+)$', line)
+        assert m, line
+        name, labels, value = m.groups()
+        assert any(name == t or name.startswith(t + "_") for t in typed), name
+        samples[(name, labels or "")] = float(value)
+    return samples
+
+def test_prometheus_text():
+    """The exposition lists each metric once with a HELP and TYPE, for all controllers"""
+    m1 = metrics.AcquisitionMetrics(labels={"port": "/dev/ttyACM0"})
+    m2 = metrics.AcquisitionMetrics(labels={"port": 'a"b'})
+    m1.start_run()
+    m1.data_frame(0.0, 56)
+    m1.data_frame(0.2, 56)
+    m1.halt_frame(3, 5)
+    for dt in (3e-5, 3e-5, 0.3):
+        m1.sink_write("0:csv", dt)
+    text = metrics.format_prometheus([m1, m2])
+    assert text.count("# TYPE ptprobe_samples_total counter") == 1
+    assert text.count("# HELP ") == text.count("# TYPE ")
+    samples = _parse(text)
+    assert samples[("ptprobe_samples_total", '{port="/dev/ttyACM0"}')] == 2
+    assert samples[("ptprobe_dropped_total", '{port="/dev/ttyACM0"}')] == 1
+    assert samples[("ptprobe_samples_total", '{port="a\\"b"}')] == 0
+    assert samples[("ptprobe_interarrival_us", '{port="/dev/ttyACM0",stat="mean"}')] == pytest.approx(2e5)
+    bucket = lambda le: samples[("ptprobe_sink_write_seconds_bucket",
+            '{{port="/dev/ttyACM0",sink="0:csv",le="{}"}}'.format(le))]
+    assert (bucket("5e-05"), bucket("0.2"), bucket("0.5"), bucket("+Inf")) == (2, 2, 3, 3)
+    assert samples[("ptprobe_sink_write_seconds_count", '{port="/dev/ttyACM0",sink="0:csv"}')] == 3
+    assert m1.to_prometheus() == metrics.format_prometheus([m1])
+
+def test_write_prometheus(tmp_path):
+    """The text file is written whole, without the temporary file"""
+    path = tmp_path / "ptprobe.prom"
+    metrics.write_prometheus(str(path), [metrics.AcquisitionMetrics()])
+    assert path.read_text().startswith("# HELP ptprobe_bytes_read_total")
+    assert [p.name for p in tmp_path.iterdir()] == ["ptprobe.prom"]
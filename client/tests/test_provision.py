@@ -0,0 +1,47 @@
+import os
+import struct
+import time
+
+import pytest
+
+from ptprobe import provision, simulator
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="the simulator needs pseudo-terminals")
+
+COEFFS = [-95.5, 910.25, -12.125]
+
+@pytest.mark.parametrize("debug_level", [None, 1])
+def test_provision_board_reads_back(debug_level):
+    """A board left at a debug level is quiet for the readback, then gets the manifest level"""
+    entry = {"id": 7, "coefficients": COEFFS}
+    if debug_level is not None:
+        entry["debug_level"] = debug_level
+    with simulator.SimulatedBoard(board_id=1) as sim:
+        sim.debug_level = 2
+        result = provision.provision_board(sim.port, entry, store=False, cache=False)
+        assert result["errors"] == []
+        assert result["ok"] and result["board_id"] == 7
+        assert sim.board_id == 7
+        f32 = [struct.unpack('<f', struct.pack('<f', a))[0] for a in COEFFS]
+        assert all(list(ai) == f32 for ai in sim.ai)
+        # the last command is not answered, wait for the board to handle it
+        deadline = time.monotonic() + 2.0
+        while sim.debug_level != (debug_level or 0) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert sim.debug_level == (debug_level or 0)
+
+def test_provision_board_reports_mismatch():
+    """A coefficient the board does not take is reported, and the debug level is left at 0"""
+    entry = {"coefficients": [COEFFS]*4, "debug_level": 1}
+    with simulator.SimulatedBoard(board_id=1) as sim:
+        configure = sim._configure
+
+        def ignore_ch2(buf):
+            if buf[1:2] == b'P' and len(buf) >= 8 and buf[2] == 2:
+                return 8
+            return configure(buf)
+        sim._configure = ignore_ch2
+        result = provision.provision_board(sim.port, entry, store=False, cache=False)
+        assert not result["ok"]
+        assert result["errors"][0].startswith("ch2 coefficients")
+        assert sim.debug_level == 0
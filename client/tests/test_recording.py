@@ -0,0 +1,118 @@
+import logging
+import os
+
+import numpy as np
+import pytest
+
+from ptprobe import recording, sinks
+
+def _samples(n, t0=1000, dt=200):
+    """PT Probe samples holding NumPy values, as a board batch yields them"""
+    rng = np.random.default_rng(5)
+    return [[np.int64(t0 + dt*i), np.array([True, True, False, True]),
+            np.array([0, 0, 4, 0]), rng.normal(20, 1, 4), rng.normal(25, .1, 4),
+            rng.normal(90, 1, 4).astype(np.float32)] for i in range(n)]
+
+@pytest.fixture
+def recorded(tmp_path):
+    """A file written by CsvSampleSink, and its samples"""
+    filename = str(tmp_path / "rec.csv")
+    samples = _samples(500)
+    sink = sinks.CsvSampleSink(filename)
+    sink.open()
+    for sample in samples:
+        sink.write(sample)
+    sink.close()
+    return filename, samples
+
+def test_sink_output_round_trips(recorded):
+    """Every column of a CsvSampleSink file loads with its type and value"""
+    filename, samples = recorded
+    table = recording.load_csv(filename, chunk_bytes=4096)
+    assert list(table) == sinks.CSV_COLUMNS
+    assert np.array_equal(table["Time"], [s[0] for s in samples])
+    assert table["CH_2 Active T"].dtype == bool and not table["CH_2 Active T"].any()
+    assert np.array_equal(table["CH_2 Error Code"], np.full(len(samples), 4))
+    assert np.array_equal(table["CH_1 Temp"], [s[3][1] for s in samples])
+    assert np.array_equal(table["CH_3 Pressure"], [s[5][3] for s in samples])
+
+def test_header_is_skipped(recorded, tmp_path):
+    """A header line does not become a row"""
+    filename, samples = recorded
+    with_header = str(tmp_path / "header.csv")
+    with open(with_header, "w") as hf:
+        hf.write(", ".join(sinks.CSV_COLUMNS) + "\n")
+        hf.write(open(filename).read())
+    table = recording.load_csv(with_header)
+    assert np.array_equal(table["Time"], recording.load_csv(filename)["Time"])
+
+def test_columns_projection(recorded):
+    """Only the selected columns are returned, in file order, by name or index"""
+    filename, samples = recorded
+    table = recording.load_csv(filename, columns=["CH_0 Pressure", 0])
+    assert list(table) == ["Time", "CH_0 Pressure"]
+    assert np.array_equal(table["CH_0 Pressure"], [s[5][0] for s in samples])
+    with pytest.raises(KeyError):
+        recording.load_csv(filename, columns=["Humidity"])
+
+def test_time_range(recorded):
+    """The rows with lo <= Time < hi are kept, across chunks"""
+    filename, samples = recorded
+    table = recording.load_csv(filename, columns=["CH_0 Temp"],
+            t_range=(2000, 3000), chunk_bytes=1024)
+    assert list(table) == ["CH_0 Temp"]
+    assert np.array_equal(table["CH_0 Temp"], [s[3][0] for s in samples if 2000 <= s[0] < 3000])
+    table = recording.load_csv(filename, t_range=(None, 1400))
+    assert np.array_equal(table["Time"], [1000, 1200])
+
+@pytest.mark.parametrize("keep", [5, 100, -1])
+def test_truncated_last_line(recorded, tmp_path, caplog, keep):
+    """A line cut off at the end of an interrupted recording is dropped with a warning"""
+    filename, samples = recorded
+    data = open(filename, "rb").read()
+    start = data.rfind(b"\n", 0, len(data) - 1) + 1
+    if keep < 0:
+        # cut just after the last separator
+        keep = data.rfind(b", ") + 2 - start
+    truncated = str(tmp_path / "truncated.csv")
+    with open(truncated, "wb") as hf:
+        hf.write(data[:start + keep])
+    with caplog.at_level(logging.WARNING):
+        table = recording.load_csv(truncated, chunk_bytes=4096)
+    assert len(table["Time"]) == len(samples) - 1
+    assert "Dropped malformed line" in caplog.text
+
+def test_malformed_lines(recorded, tmp_path, caplog):
+    """Lines with bad values or a wrong number of values are dropped, the rest kept"""
+    filename, samples = recorded
+    lines = open(filename).read().splitlines(True)
+    lines[10] = lines[10].replace("True", "Maybe", 1)
+    lines[20] = lines[20][:50] + "\n"
+    malformed = str(tmp_path / "malformed.csv")
+    with open(malformed, "w") as hf:
+        hf.writelines(lines)
+    with caplog.at_level(logging.WARNING):
+        table = recording.load_csv(malformed)
+    kept = [s[0] for i, s in enumerate(samples) if i not in (10, 20)]
+    assert np.array_equal(table["Time"], kept)
+    assert caplog.text.count("Dropped malformed line") == 2
+
+def test_sidecar_cache_follows_mtime(recorded):
+    """The binary sidecar serves loads until the CSV file is newer"""
+    filename, samples = recorded
+    table = recording.load_csv(filename, columns=["Time"], cache=True)
+    sidecar = filename + ".npy"
+    assert os.path.exists(sidecar)
+    assert np.array_equal(table["Time"], [s[0] for s in samples])
+
+    # a stale sidecar is still used while it is newer than the CSV file
+    with open(filename, "a") as hf:
+        hf.write(", ".join(["999999"] + ["1"]*20) + "\n")
+    st = os.stat(sidecar)
+    os.utime(filename, (st.st_atime, st.st_mtime - 10))
+    assert len(recording.load_csv(filename, columns=["Time"], cache=True)["Time"]) == len(samples)
+
+    os.utime(sidecar, (st.st_atime, st.st_mtime - 20))
+    table = recording.load_csv(filename, columns=["Time"], cache=True)
+    assert len(table["Time"]) == len(samples) + 1 and table["Time"][-1] == 999999
+    assert os.path.getmtime(sidecar) >= os.path.getmtime(filename)
@@ -0,0 +1,139 @@
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+
+from ptprobe import simulator
+from ptprobe.board import BoardTimeout, Controller
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="the simulator needs pseudo-terminals")
+
+class _Board (simulator.SimulatedBoard):
+    """A simulated board that can answer requests late and stall its stream
+
+    ``delays`` maps a request (e.g. 'B' for the board ID) to the delays (s)
+    of its next answers. From DATA frame ``stall_after`` on, frames are not
+    sent until the board is halted, as when only the link stalls.
+    """
+
+    def __init__(self, **kwargs):
+        self.delays = {}
+        self.stall_after = None
+        self.sent = 0
+        self.halts = 0
+        super().__init__(**kwargs)
+
+    def _ask(self, msg):
+        if self.delays.get(msg):
+            threading.Timer(self.delays[msg].pop(0), simulator.SimulatedBoard._ask, (self, msg)).start()
+            return
+        super()._ask(msg)
+
+    def _write(self, buf):
+        if buf[0] >> 6 == Controller.PacketType.DATA and len(buf) > 5:
+            self.sent += 1
+            if self.stall_after is not None and self.sent > self.stall_after:
+                return
+        super()._write(buf)
+
+    def _halt(self, send=True):
+        if self.started:
+            self.halts += 1
+            self.stall_after = None
+        super()._halt(send)
+
+@contextmanager
+def _streaming(pt):
+    """Collect in a thread for the duration of the context, once samples arrive"""
+    th = threading.Thread(target=pt.collect_samples)
+    th.start()
+    try:
+        t_end = time.monotonic() + 5.0
+        while pt.metrics.samples == 0 and time.monotonic() < t_end:
+            time.sleep(0.01)
+        yield th
+    finally:
+        pt.stop_collection()
+        th.join(5.0)
+    assert not th.is_alive()
+
+def _f32(values):
+    return [struct.unpack('<f', struct.pack('<f', v))[0] for v in values]
+
+def test_requests_while_streaming():
+    """Requests are answered from the collection loop without disturbing it"""
+    with _Board(board_id=3, rate=50.0) as sim:
+        pt = Controller(sim.port)
+        with _streaming(pt):
+            assert pt.board_id() == 3
+            assert pt.sensor_status_P(2)["ai"] == _f32(sim.DEFAULT_AI)
+            n = pt.metrics.samples
+            assert pt.board_id() == 3
+            time.sleep(0.1)
+            assert pt.metrics.samples > n
+        assert pt.metrics.header_errors == 0
+
+def test_request_timeout():
+    """A request that times out raises, and its late answer is not taken by the next one"""
+    with _Board(board_id=3, rate=50.0) as sim:
+        sim.ai[1] = [1.5, 2.5, 3.5]
+        sim.delays['SP1'] = [0.5]
+        pt = Controller(sim.port)
+        pt.response_timeout = 0.3
+        with _streaming(pt):
+            with pytest.raises(BoardTimeout):
+                pt.sensor_status_P(1)
+            assert not pt._pending
+            # the late answer arrives, then the next request of the same type
+            time.sleep(0.4)
+            sim.ai[1] = [4.5, 5.5, 6.5]
+            assert pt.sensor_status_P(1)["ai"] == [4.5, 5.5, 6.5]
+        assert pt.metrics.header_errors == 1
+        assert not pt._pending
+
+def test_same_type_requests_outstanding():
+    """Two requests of the same type waiting at once each get their own answer"""
+    with _Board(board_id=3, rate=50.0) as sim:
+        for ich in range(4):
+            sim.ai[ich] = [float(ich), 0.5, 0.25]
+        sim.delays['SP1'] = [0.3]
+        sim.delays['SP2'] = [0.1]
+        sim.delays['B'] = [0.2, 0.1]
+        pt = Controller(sim.port)
+        results = {}
+
+        def request(key, fn):
+            results[key] = fn()
+        with _streaming(pt):
+            threads = [threading.Thread(target=request, args=args) for args in [
+                    ("P1", lambda: pt.sensor_status_P(1)["ai"]),
+                    ("P2", lambda: pt.sensor_status_P(2)["ai"]),
+                    ("B1", pt.board_id), ("B2", pt.board_id)]]
+            for th in threads:
+                th.start()
+            for th in threads:
+                th.join(5.0)
+        assert results == {"P1": [1.0, 0.5, 0.25], "P2": [2.0, 0.5, 0.25], "B1": 3, "B2": 3}
+        assert pt.metrics.header_errors == 0
+
+def test_reconnect_halts_streaming_board():
+    """A board that still streams behind a stalled link is halted before it is restarted"""
+    with _Board(rate=50.0) as sim:
+        sim.stall_after = 10
+        pt = Controller(sim.port)
+        pt.reconnect = True
+        pt.watchdog_min = 0.3
+        th = threading.Thread(target=pt.collect_samples, kwargs={"max_samples": 40})
+        th.start()
+        th.join(10.0)
+        stuck = th.is_alive()
+        if stuck:
+            pt.stop_collection()
+            th.join(5.0)
+        assert not stuck
+        assert pt.metrics.reconnects == 1
+        assert sim.halts == 1       # by the reconnect, then it stops at the count
+        assert pt.metrics.samples == 40
@@ -0,0 +1,81 @@
+import os
+import struct
+
+import pytest
+
+from ptprobe import simulator
+from ptprobe.board import Controller
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="the simulator needs pseudo-terminals")
+
+N = 20
+
+class _NoisyBoard (simulator.SimulatedBoard):
+    """A simulated board that damages the stream before some DATA frames
+
+    The board clock runs from 0x80808080, so that the timestamp bytes of a
+    damaged frame all read as RESP headers, which are rejected out of sync:
+    the number of bytes skipped is exact.
+    """
+
+    def __init__(self, damage, **kwargs):
+        """:param damage: Called as ``damage(index, frame)`` for each DATA
+            frame, returns the bytes written instead"""
+        self.damage = damage
+        self.frames = 0
+        super().__init__(**kwargs)
+
+    def millis(self):
+        return 0x80808080 + self.frames
+
+    def _write(self, buf):
+        if self.started and len(buf) > 5 and buf[0] >> 6 == Controller.PacketType.DATA:
+            buf = self.damage(self.frames, buf)
+            self.frames += 1
+        super()._write(buf)
+
+def _collect(damage):
+    """Collect N samples from a board damaging its stream, returns the controller"""
+    with _NoisyBoard(damage, rate=200.0) as sim:
+        pt = Controller(sim.port)
+        assert pt.collect_samples(max_samples=N) == N
+    return pt
+
+def _at(index, noise, keep=None):
+    """Damage: noise before frame index, the frame cut to keep bytes"""
+    def damage(i, frame):
+        if i != index:
+            return frame
+        return noise + frame[:keep]
+    return damage
+
+def test_garbage_bytes():
+    """Garbage between frames is skipped without losing a sample"""
+    pt = _collect(_at(5, bytes([0x01, 0xFF, 0x9A, 0x02])))
+    m = pt.metrics
+    assert (m.samples, m.dropped) == (N, 0)
+    assert (m.resyncs, m.header_errors, m.skipped_bytes) == (1, 1, 4)
+
+def test_truncated_frame():
+    """A frame cut off after its timestamp is dropped, and the next frame read"""
+    pt = _collect(_at(5, b'', keep=5))
+    m = pt.metrics
+    assert (m.samples, m.dropped) == (N - 1, 1)
+    assert (m.resyncs, m.header_errors, m.skipped_bytes) == (1, 1, 5)
+
+def test_fake_halt_mid_stream():
+    """A HALT header in the stream does not end the collection"""
+    # in sync with an implausible count, then out of sync with a plausible one
+    halt = lambda count: bytes([Controller.PacketType.HALT << 6]) + struct.pack('>I', count)
+    pt = _collect(_at(5, halt(0) + bytes([0xFF]) + halt(5)))
+    m = pt.metrics
+    assert (m.samples, m.dropped) == (N, 0)
+    assert (m.resyncs, m.header_errors, m.skipped_bytes) == (1, 1, 11)
+
+def test_two_damaged_frames():
+    """Each loss of sync is counted once"""
+    damage = lambda i, frame: (bytes([0x01]) + frame) if i in (3, 12) else frame
+    pt = _collect(damage)
+    m = pt.metrics
+    assert (m.samples, m.dropped) == (N, 0)
+    assert (m.resyncs, m.header_errors, m.skipped_bytes) == (2, 2, 2)
@@ -0,0 +1,116 @@
+import pytest
+
+from ptprobe import rollup
+
+np = pytest.importorskip("numpy")
+
+# 70 s before an hour boundary, 50 s into a minute
+BASE = 1700000000 - 1700000000 % 3600 + 3600 - 70
+
+class _Clock:
+    """Map board timestamps (ms) to UTC from a fixed start"""
+
+    def to_utc(self, t_ms):
+        return BASE + t_ms/1000.0
+
+def _samples(n, t0_ms=0):
+    """5 Hz samples with thermocouples 0 and 2 active, channel 2 faulty every 4th sample"""
+    samples = []
+    for i in range(n):
+        active = [True, False, True, False]
+        fault = [0, 0, 3 if i % 4 == 0 else 0, 0]
+        T = [10.0 + 0.01*i, 0, 0 if fault[2] else 30.0 - 0.02*i, 0]
+        Tref = [25.0 + 0.001*i, 0, 26.0, 0]
+        P = [100.0 + (i % 7), 0, 50.0 - (i % 3), 0]
+        samples.append([t0_ms + 200*i, active, fault, T, Tref, P])
+    return samples
+
+def _write(path, samples, **kwargs):
+    sink = rollup.RollupSink(path, board_id=3, clock=_Clock(), **kwargs)
+    sink.open()
+    for sample in samples:
+        sink.write(sample)
+    sink.close()
+
+def _expected(samples, tier, channel):
+    """The (start, count, min, max, mean, variance, faults) rows of a channel computed directly"""
+    kind, ich = channel.rstrip("0123"), int(channel[-1])
+    column = {"P": 5, "T": 3, "Tref": 4}[kind]
+    groups = {}
+    for s in samples:
+        start = int(BASE + s[0]/1000.0)
+        start -= start % tier
+        value, fault = s[column][ich], kind == "T" and s[2][ich]
+        values, faults = groups.setdefault(start, ([], [0]))
+        if fault:
+            faults[0] += 1
+        else:
+            values.append(value)
+    rows = []
+    for start in sorted(groups):
+        values, faults = groups[start]
+        x = np.array(values)
+        rows.append((start, len(x), x.min(), x.max(), x.mean(),
+                x.var(ddof=1) if len(x) > 1 else 0.0, faults[0]))
+    return rows
+
+def _assert_rows(rows, expected):
+    assert [r[0] for r in rows] == [e[0] for e in expected]
+    for r, e in zip(rows, expected):
+        assert r[1] == e[1] and r[6] == e[6]
+        assert r[2:6] == pytest.approx(e[2:6], rel=1e-9, abs=1e-9)
+
+@pytest.mark.parametrize("tier", rollup.TIERS)
+@pytest.mark.parametrize("channel", ["P0", "P2", "T0", "T2", "Tref2"])
+def test_tiers_match_direct_aggregates(tmp_path, tier, channel):
+    """Each tier holds the aggregates of its intervals, across minute and hour boundaries"""
+    path = str(tmp_path / "rollup.db")
+    samples = _samples(750)     # 150 s
+    _write(path, samples)
+    store = rollup.RollupStore(path)
+    got_tier, rows = store.query(channel, BASE, BASE + 200, resolution=tier, board_id=3)
+    store.close()
+    assert got_tier == tier
+    _assert_rows(rows, _expected(samples, tier, channel))
+    assert len(rows) == {1: 150, 60: 4, 3600: 2}[tier]
+
+def test_inactive_channels_skipped(tmp_path):
+    """Inactive thermocouple channels, and their pressures, have no aggregates"""
+    path = str(tmp_path / "rollup.db")
+    _write(path, _samples(50))
+    store = rollup.RollupStore(path)
+    channels = {r[0] for r in store.client.execute("SELECT DISTINCT channel FROM rollup")}
+    assert channels == {"P0", "P2", "T0", "T2", "Tref0", "Tref2"}
+    assert store.query("T1", BASE, BASE + 60)[1] == []
+    store.close()
+
+def test_pressure_channels_without_thermocouples(tmp_path):
+    """P_channels selects the pressures to aggregate when no thermocouple is active"""
+    path = str(tmp_path / "rollup.db")
+    samples = _samples(50)
+    for s in samples:
+        s[1] = [False]*4
+    _write(path, samples, P_channels=[0, 1])
+    store = rollup.RollupStore(path)
+    channels = {r[0] for r in store.client.execute("SELECT DISTINCT channel FROM rollup")}
+    store.close()
+    assert channels == {"P0", "P1"}
+
+def test_collections_merge(tmp_path):
+    """A second collection in the same intervals is merged with the stored buckets"""
+    path = str(tmp_path / "rollup.db")
+    samples = _samples(750)
+    _write(path, samples[:333])     # ends within a second
+    _write(path, samples[333:])
+    store = rollup.RollupStore(path)
+    for tier in rollup.TIERS:
+        _assert_rows(store.query("P0", BASE, BASE + 200, resolution=tier)[1],
+                _expected(samples, tier, "P0"))
+    store.close()
+
+def test_query_resolution():
+    """The coarsest tier not coarser than the resolution is used"""
+    store = rollup.RollupStore(":memory:")
+    assert [store.query("P0", 0, 1, resolution=r)[0] for r in (0.5, 1, 59, 300, 86400)] == [
+            1, 1, 1, 60, 3600]
+    store.close()
@@ -0,0 +1,34 @@
+import json
+import os
+
+import pytest
+
+from ptprobe.board import Controller
+from ptprobe.simulator import SimulatedBoard
+from ptprobe.sinks import ListSampleSink
+from ptprobe.tracing import ChromeTracer
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="the simulator needs a pseudo-terminal")
+
+def test_collection_trace_is_chrome_trace_json(tmp_path):
+    """A traced collection writes a trace with every loop stage as complete events"""
+    path = str(tmp_path / "trace.json")
+    tracer = ChromeTracer(path)
+    sink = ListSampleSink()
+    with SimulatedBoard(rate=100.0) as sim:
+        pt = Controller(sim.port, sinks=[sink], tracer=tracer)
+        pt.collect_samples(max_samples=20)
+    tracer.save()
+
+    with open(path) as hf:
+        trace = json.load(hf)
+    events = trace["traceEvents"]
+    assert len(sink.data) == 20
+    assert [e["args"]["name"] for e in events if e["ph"] == "M"] == [sim.port]
+    spans = [e for e in events if e["ph"] == "X"]
+    names = set(e["name"] for e in spans)
+    assert {"read_wait", "header", "decode", "sink 0:ListSampleSink"} <= names
+    for e in spans:
+        assert e["dur"] >= 0 and e["ts"] >= 0
+        assert isinstance(e["pid"], int) and isinstance(e["tid"], int)
+    assert sum(1 for e in spans if e["name"] == "header") == 20
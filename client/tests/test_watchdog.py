@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+
+import pytest
+
+from ptprobe import simulator, sinks
+from ptprobe.board import BoardTimeout, Controller
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="the simulator needs pseudo-terminals")
+
+class _SilentBoard (simulator.SimulatedBoard):
+    """A simulated board that stops sending after a number of DATA frames
+
+    With ``until_halt`` it sends again once it is halted and restarted,
+    otherwise it also ignores the halt command, as a hung board does.
+    """
+
+    def __init__(self, after, until_halt=False, **kwargs):
+        self.after = after
+        self.until_halt = until_halt
+        self.sent = 0
+        super().__init__(**kwargs)
+
+    def _write(self, buf):
+        if self.after is not None and self.started:
+            self.sent += 1
+            if self.sent > self.after:
+                return
+        super()._write(buf)
+
+    def _halt(self, send=True):
+        if self.until_halt:
+            self.after = None
+        elif self.after is not None and self.sent > self.after:
+            return
+        super()._halt(send)
+
+class _TimedSink (sinks.SampleSink):
+    """Record the time of each write"""
+
+    def __init__(self):
+        self.times = []
+
+    def write(self, sample, *args):
+        self.times.append(time.monotonic())
+
+def test_stop_within_read_timeout():
+    """After a stop, no sample is delivered after one read timeout, and the collection returns"""
+    with simulator.SimulatedBoard(rate=5.0) as sim:
+        sink = _TimedSink()
+        pt = Controller(sim.port, sinks=[sink])
+        th = threading.Thread(target=pt.collect_samples)
+        th.start()
+        while len(sink.times) < 2:
+            time.sleep(0.01)
+        time.sleep(0.1)     # between two frames, the read is blocked
+        t_stop = time.monotonic()
+        pt.stop_collection()
+        th.join(5.0)
+        t_joined = time.monotonic()
+        assert not th.is_alive()
+        assert all(t <= t_stop + pt.read_timeout + 0.05 for t in sink.times)
+        assert t_joined - t_stop < pt.read_timeout + pt.halt_timeout + 0.1
+        assert pt.metrics.dropped == 0
+
+def test_stop_hung_board():
+    """A stop returns within the halt timeout when the board sends no HALT"""
+    with _SilentBoard(after=3, rate=20.0) as sim:
+        pt = Controller(sim.port)
+        th = threading.Thread(target=pt.collect_samples)
+        th.start()
+        time.sleep(0.5)
+        t_stop = time.monotonic()
+        pt.stop_collection()
+        th.join(5.0)
+        assert not th.is_alive()
+        assert time.monotonic() - t_stop < pt.read_timeout + pt.halt_timeout + 0.1
+
+def test_silent_board_times_out():
+    """A board that falls silent raises BoardTimeout after the watchdog limit"""
+    with _SilentBoard(after=5, rate=20.0) as sim:
+        pt = Controller(sim.port)
+        pt.watchdog_min = 0.5
+        t0 = time.monotonic()
+        with pytest.raises(BoardTimeout):
+            pt.collect_samples()
+        # 5 frames at 20 Hz, then the watchdog
+        assert 0.5 < time.monotonic() - t0 < 0.25 + 0.5 + 0.5
+        assert pt.metrics.samples == 5
+
+def test_silent_board_reconnects():
+    """With reconnect, collection resumes after the board was silent"""
+    with _SilentBoard(after=5, until_halt=True, rate=20.0) as sim:
+        pt = Controller(sim.port)
+        pt.watchdog_min = 0.5
+        pt.reconnect = True
+        pt.collect_samples(max_samples=20)
+        assert pt.metrics.reconnects == 1
+        assert pt.metrics.samples == 20
@@ -4,9 +4,12 @@
 #include <Arduino.h>
 #include <FlashStorage.h>
 
-#define FW_VERSION_MINOR 7
+#define FW_VERSION_MINOR 10
 #define FW_VERSION_MAJOR 0
 
+// minimum time between display updates while streaming
+#define DISPLAY_INTERVAL_MS 200
+
 #ifdef BREADBOARD_PROTO
 
   // mode select push button 
@@ -67,7 +70,8 @@ struct RunConfig
   
   RunConfig() 
     : started(false), led0(0), led1(0), 
-      conversion_state(0)
+      conversion_state(0), sample_interval_ms(0),
+      last_sample_ms(0), last_display_ms(0)
   {
   
   }
@@ -101,6 +105,9 @@ struct RunConfig
   int8_t led0;
   int8_t led1;
   int conversion_state; // 0=idle, 1=conversion, 2=ready, 3=stop
+  uint16_t sample_interval_ms;  // minimum time between samples (0=free running)
+  uint32_t last_sample_ms;
+  uint32_t last_display_ms;
 
   BoardConfig board;
 
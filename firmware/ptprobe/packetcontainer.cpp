@@ -14,7 +14,7 @@
  b6-b9: T0 (float)
  ...
  b22: P ch active (upper 4 bits) | P ch error (lower 4 bits)
- b23-b26: P0 (float)
+ b23-b26: P0 (float), or the raw ADC value (0-1) with FRAME_RAW_P
  ... 
  b39: T ref ch active (upper 4 bits) | T ref ch error (lower 4 bits)
  b40-b43: Tref0 
@@ -43,7 +43,7 @@ int8_t PacketContainer::write_data(uint8_t nch_T, TSensorData const* Tdata, uint
     }
   }
   for (uint8_t ich = 0; ich < nch_P; ++ich) {
-    write_val(P_GROUP_BYTE,ich,Pdata[ich].P);
+    write_val(P_GROUP_BYTE,ich,(format & FRAME_RAW_P) ? Pdata[ich].raw : Pdata[ich].P);
   }
   buf[0] = 55;
   buf[0] |= (HDR_TYPE_DATA << 6);
@@ -53,6 +53,70 @@ int8_t PacketContainer::write_data(uint8_t nch_T, TSensorData const* Tdata, uint
   return 56;
 }
 
+/*!
+ \brief write compact data packet to buffer, increment count
+
+ Only the channels that are active and selected by channel_mask are sent,
+ in ascending channel order.
+
+ b0: HDR_TYPE_DATA | byte_count (excl header), never 55 (the full packet)
+ b1: T ch active (upper 4 bits) | T ch error (lower 4 bits)
+ b2: P ch active (upper 4 bits) | timestamp is delta (bit 0)
+ timestamp: uint16_t ms since the previous packet if the delta bit is set,
+   otherwise uint32_t ms (always for the first and every ABS_TIMESTAMP_EVERY packet)
+ per active T channel: T (float) or error (int32_t), Tref (float)
+ per active P channel: P (float), or the raw ADC value (0-1) with FRAME_RAW_P
+
+ \returns number of bytes in buffer
+*/
+int8_t PacketContainer::write_data_compact(uint8_t nch_T, TSensorData const* Tdata, uint8_t nch_P, PSensorData const* Pdata)
+{
+  uint8_t t_group = 0;
+  uint8_t p_group = 0;
+  uint8_t pos = 3;
+
+  uint32_t const timestamp = millis();
+  uint32_t const delta = timestamp - last_timestamp;
+  if ((format & FRAME_DELTA_TS) && (count % ABS_TIMESTAMP_EVERY != 0) && (delta <= 0xFFFF)) {
+    p_group |= 0x01;
+    write_to_buf(static_cast<uint16_t>(delta), &buf[pos]);
+    pos += sizeof(uint16_t);
+  } else {
+    write_to_buf(timestamp, &buf[pos]);
+    pos += sizeof(uint32_t);
+  }
+  last_timestamp = timestamp;
+
+  for (uint8_t ich = 0; ich < nch_T; ++ich) {
+    if ((channel_mask & (0x10 << ich)) && (Tdata[ich].ndx >= 0)) {
+      t_group |= (1 << ich+4);
+      if (Tdata[ich].fault == 0) {
+        write_to_buf(Tdata[ich].T, &buf[pos]);
+      } else {
+        t_group |= (1 << ich);
+        write_to_buf(static_cast<int32_t>(Tdata[ich].fault), &buf[pos]);
+      }
+      pos += 4;
+      write_to_buf(Tdata[ich].Tref, &buf[pos]);
+      pos += 4;
+    }
+  }
+  for (uint8_t ich = 0; ich < nch_P; ++ich) {
+    if (channel_mask & (0x01 << ich)) {
+      p_group |= (1 << ich+4);
+      write_to_buf((format & FRAME_RAW_P) ? Pdata[ich].raw : Pdata[ich].P, &buf[pos]);
+      pos += 4;
+    }
+  }
+  buf[1] = t_group;
+  buf[2] = p_group;
+  buf[0] = (HDR_TYPE_DATA << 6) | (pos - 1);
+
+  count++;
+
+  return pos;
+}
+
 /*!
     \brief value response packet
 
@@ -7,7 +7,7 @@
 #define HDR_TYPE_RESP 0x2
 #define HDR_TYPE_HALT 0x3
 
-#define RESP_TYPE_RSVD 0x0
+#define RESP_TYPE_FMT  0x0
 #define RESP_TYPE_ID   0x1
 #define RESP_TYPE_T    0x2
 #define RESP_TYPE_P    0x3
@@ -18,17 +18,27 @@
 
 #define MAX_PACKET_LENGTH 64
 
+// streaming frame format flags
+#define FRAME_COMPACT  0x01   // only active channels, no per-group headers
+#define FRAME_DELTA_TS 0x02   // 16 bit timestamp delta when possible (compact only)
+#define FRAME_RAW_P    0x04   // send the raw ADC value (0-1) in place of the converted pressure
+#define ABS_TIMESTAMP_EVERY 64  // absolute timestamp interval with FRAME_DELTA_TS, for resync
+
 
 class PacketContainer 
 {
 public:
-  PacketContainer() : count(0), max_packets(0) {}
+  PacketContainer() : count(0), max_packets(0), format(0), channel_mask(0xFF), last_timestamp(0) {}
 
   uint32_t count;
   uint32_t max_packets;
+  uint8_t format;         // FRAME_* flags
+  uint8_t channel_mask;   // T channels (upper 4 bits) | P channels (lower 4 bits), compact only
+  uint32_t last_timestamp;
   uint8_t const* buffer() const { return &buf[0]; }
 
   int8_t write_data(uint8_t nch_T, TSensorData const* Tdata, uint8_t nch_P, PSensorData const* Pdata);
+  int8_t write_data_compact(uint8_t nch_T, TSensorData const* Tdata, uint8_t nch_P, PSensorData const* Pdata);
   int8_t write_resp_id(uint32_t id) {
     buf[0] = (HDR_TYPE_RESP << 6) | (RESP_TYPE_ID << 3);
     write_to_buf(id, &buf[1]);
@@ -41,6 +51,13 @@ public:
     write_to_buf(count, &buf[1]);
     return 5;
   }
+  int8_t write_resp_fmt(uint16_t interval_ms) {
+    buf[0] = (HDR_TYPE_RESP << 6) | (RESP_TYPE_FMT << 3);
+    buf[1] = format;
+    buf[2] = channel_mask;
+    write_to_buf(interval_ms, &buf[3]);
+    return 5;
+  }
   int8_t write_status_T(int8_t ch, TSensorData const& sensor);
   int8_t write_status_P(int8_t ch, PSensorData const& sensor);
   
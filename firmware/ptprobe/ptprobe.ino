@@ -104,10 +104,17 @@ void loop()
   
   if (cfg.started) {
     if (cfg.conversion_state == 0) {
-      // activity
-      cfg.toggle_led0();
-      
-      if (probes_T.start_conversion()) {
+      if ((cfg.sample_interval_ms > 0) && (millis() - cfg.last_sample_ms < cfg.sample_interval_ms)) {
+        // wait for the next sample
+      } else if ((packet.format & FRAME_COMPACT) && !(packet.channel_mask & 0xF0)) {
+        // no T channels selected, skip the (slow) T conversion
+        cfg.last_sample_ms = millis();
+        cfg.toggle_led0();
+        cfg.conversion_state = 2;
+      } else if (probes_T.start_conversion()) {
+        // activity
+        cfg.last_sample_ms = millis();
+        cfg.toggle_led0();
         cfg.conversion_state = 1;
       } else {
         cfg.report_fault("Failed to start conversion");
@@ -116,20 +123,29 @@ void loop()
     } else if ((cfg.conversion_state == 1) && (probes_T.conversion_complete())) {
       cfg.conversion_state = 2;
     } else if (cfg.conversion_state == 2) {
-      read_all_T(4, T_sensor, probes_T);
+      bool const compact = packet.format & FRAME_COMPACT;
+      if (!compact || (packet.channel_mask & 0xF0)) {
+        read_all_T(4, T_sensor, probes_T);
+      }
       read_all_P(4, P_sensor);
 
-      auto const byte_count = packet.write_data(4,T_sensor,4,P_sensor);
+      auto const byte_count = compact 
+        ? packet.write_data_compact(4,T_sensor,4,P_sensor) 
+        : packet.write_data(4,T_sensor,4,P_sensor);
       //Serial.println(byte_count);
       if (cfg.board.debug_level < 1) {
         Serial.write(packet.buffer(), byte_count);
       }
       
-      for (int i = 0; i < 4; ++i) {
-        update_T_display(i);
-        update_P_display(i);
+      // the display update is slow, limit it at high sample rates
+      if (millis() - cfg.last_display_ms >= DISPLAY_INTERVAL_MS) {
+        cfg.last_display_ms = millis();
+        for (int i = 0; i < 4; ++i) {
+          update_T_display(i);
+          update_P_display(i);
+        }
+        display.show();
       }
-      display.show();
 
       if ((packet.max_packets == 0) || (packet.count < packet.max_packets)) {
         cfg.conversion_state = 0;
@@ -149,7 +165,11 @@ void loop()
     cfg.set_led1(HIGH);
   }
 
-  delay(10);
+  if (!cfg.started || (cfg.sample_interval_ms == 0) || (cfg.sample_interval_ms >= 10)) {
+    delay(10);
+  } else {
+    delay(1);
+  }
 
 }
 
@@ -275,12 +295,16 @@ void respond_ask_P(
 // Message format
 // H : halt, send last packet then halt packet
 // R# : start with max packets count as string (0=no max), streams packets HDR_DATA | timestamp_ms | T .. | P ..
-// C : configure
+// F<flags><mask><interval> : streaming frame format (only while halted), returns ACK | FMT_TYPE | flags | mask | 16 bit interval
+//  flags : uint8 FRAME_COMPACT (0x01) | FRAME_DELTA_TS (0x02) | FRAME_RAW_P (0x04), 0 for the full frame
+//  mask : uint8 T channels (upper 4 bits) | P channels (lower 4 bits), compact only
+//  interval : uint16 minimum sample interval in ms (0=free running)
+// C : configure (also accepted while streaming)
 //  Pca## : pressure channel c, coefficient a (0=cte, 1=lin, 2=quad), ## as float string 
 //  D# : serial debug level (0-off, 1-on)
 //  B# : board ID (with 32 bit ID)
 //  W : write configuration to flash 
-// A : ask
+// A : ask (also accepted while streaming; responses are sent between data packets)
 //  B  : board ID, returns ACK | ID_TYPE | 32bit ID
 //  T# : temperature on channel #, returns ACK | PROBE_T_TYPE | CH# | ERR Flag | 32 bit float
 //  R# : ref. temperature on channel #, returns ACK | REF_T_TYPE | 32 bit float
@@ -309,8 +333,8 @@ void process_serial_buffer(bool force_halt)
       display.data_rect(3,0).update_lbl_lo("OFF",false);
       display.show();
     }
-  } else if (!cfg.started) {
-    if (data_in == 'R') {
+  } else if (data_in == 'R') {
+    if (!cfg.started) {
       char count_buf[4];
       int const rlen = Serial.readBytes(count_buf, 4);
       if (rlen == 4) {
@@ -332,94 +356,115 @@ void process_serial_buffer(bool force_halt)
         Serial.print(packet.max_packets);
         Serial.println(" samples)");
       }
-    } else if (data_in == 'C') {
-      char const cfg_opt = Serial.read();
-      if (cfg_opt == 'D') {   // debug level
-        int8_t const dbg = Serial.read();
-        if (dbg >= 0 && dbg < 3) {
-          cfg.board.debug_level = dbg;
-        }
-      } else if (cfg_opt == 'P') {
-        int8_t const P_ch = Serial.read();
-        int8_t const icoeff = Serial.read();
-        char ai_buf[4];
-        auto const rlen = Serial.readBytes(ai_buf, 4);
-        if ((rlen == 4) && (P_ch >= 0) && (P_ch < 4) && (icoeff >=0) && (icoeff < 3)) {
-          auto const aval = *reinterpret_cast<float const*>(&ai_buf[0]);
-          P_sensor[P_ch].ai[icoeff] = aval;
-          cfg.board.set_ai(icoeff, P_ch, aval);
-        }
-      } else if (cfg_opt == 'B') {
-        char id_buf[4];
-        auto const rlen = Serial.readBytes(id_buf, 4);
-        if (rlen == 4) {
-          cfg.board.id = *reinterpret_cast<uint32_t*>(&id_buf[0]);
-        }
-      } else if (cfg_opt == 'W') {
-        cfg.set_led1(LOW);
-        for (int itog = 0; itog < 3; ++itog) {
-          delay(100);
-          cfg.toggle_led1();
-        }
-        cfg_store.write(cfg.board);
-        for (int itog = 0; itog < 3; ++itog) {
-          delay(100);
-          cfg.toggle_led1();
-        }
+    }
+  } else if (data_in == 'F') {
+    char fmt_buf[4];
+    int const rlen = Serial.readBytes(fmt_buf, 4);
+    if ((rlen == 4) && !cfg.started) {
+      packet.format = fmt_buf[0];
+      packet.channel_mask = fmt_buf[1];
+      cfg.sample_interval_ms = *reinterpret_cast<uint16_t*>(&fmt_buf[2]);
+    }
+    if (cfg.board.debug_level < 1) {
+      auto const len = packet.write_resp_fmt(cfg.sample_interval_ms);
+      Serial.write(packet.buffer(), len);
+    } else {
+      Serial.print("Format: 0x");
+      Serial.print(packet.format, HEX);
+      Serial.print(" mask: 0x");
+      Serial.print(packet.channel_mask, HEX);
+      Serial.print(" interval: ");
+      Serial.println(cfg.sample_interval_ms);
+    }
+  } else if (data_in == 'C') {  // configure, also while streaming
+    char const cfg_opt = Serial.read();
+    if (cfg_opt == 'D') {   // debug level
+      int8_t const dbg = Serial.read();
+      if (dbg >= 0 && dbg < 3) {
+        cfg.board.debug_level = dbg;
+      }
+    } else if (cfg_opt == 'P') {
+      int8_t const P_ch = Serial.read();
+      int8_t const icoeff = Serial.read();
+      char ai_buf[4];
+      auto const rlen = Serial.readBytes(ai_buf, 4);
+      if ((rlen == 4) && (P_ch >= 0) && (P_ch < 4) && (icoeff >=0) && (icoeff < 3)) {
+        auto const aval = *reinterpret_cast<float const*>(&ai_buf[0]);
+        P_sensor[P_ch].ai[icoeff] = aval;
+        cfg.board.set_ai(icoeff, P_ch, aval);
+      }
+    } else if (cfg_opt == 'B') {
+      char id_buf[4];
+      auto const rlen = Serial.readBytes(id_buf, 4);
+      if (rlen == 4) {
+        cfg.board.id = *reinterpret_cast<uint32_t*>(&id_buf[0]);
+      }
+    } else if (cfg_opt == 'W') {
+      cfg.set_led1(LOW);
+      for (int itog = 0; itog < 3; ++itog) {
+        delay(100);
+        cfg.toggle_led1();
       }
-      debug_print_config();
-    } else if (data_in == 'A') {  // ask
-      int const rlen = Serial.readBytesUntil('\n', msg_buffer, MSG_BUF_LEN-1);
-      msg_buffer[rlen] = '\0'; 
-      if (rlen > 2) {
-        if (msg_buffer[0] == 'S') {
-          int const ch = msg_buffer[2] - '0';
-          if (cfg.board.debug_level == 0) {
-            int8_t slen = 0;
-            if (msg_buffer[1] == 'T') { // status on T probe
-              slen = packet.write_status_T(ch, T_sensor[ch]);
-            } else if (msg_buffer[1] == 'P') { // status on P probe
-              slen = packet.write_status_P(ch, P_sensor[ch]);
-            }
-            Serial.write(packet.buffer(), slen);    
-          } else {
-            if (msg_buffer[1] == 'T') { // status on T probe
-              debug_print_status_T(ch, T_sensor[ch]);
-            } else if (msg_buffer[1] == 'P') { // status on P probe
-              debug_print_status_P(ch, P_sensor[ch]);
-            }
+      cfg_store.write(cfg.board);
+      for (int itog = 0; itog < 3; ++itog) {
+        delay(100);
+        cfg.toggle_led1();
+      }
+    }
+    debug_print_config();
+  } else if (data_in == 'A') {  // ask, also while streaming
+    int const rlen = Serial.readBytesUntil('\n', msg_buffer, MSG_BUF_LEN-1);
+    msg_buffer[rlen] = '\0'; 
+    if (rlen > 2) {
+      if (msg_buffer[0] == 'S') {
+        int const ch = msg_buffer[2] - '0';
+        if (cfg.board.debug_level == 0) {
+          int8_t slen = 0;
+          if (msg_buffer[1] == 'T') { // status on T probe
+            slen = packet.write_status_T(ch, T_sensor[ch]);
+          } else if (msg_buffer[1] == 'P') { // status on P probe
+            slen = packet.write_status_P(ch, P_sensor[ch]);
+          }
+          Serial.write(packet.buffer(), slen);    
+        } else {
+          if (msg_buffer[1] == 'T') { // status on T probe
+            debug_print_status_T(ch, T_sensor[ch]);
+          } else if (msg_buffer[1] == 'P') { // status on P probe
+            debug_print_status_P(ch, P_sensor[ch]);
           }
         }
-      } else if (rlen == 2) { // ask sensor values
-        int8_t const ch = msg_buffer[1] - '0';
-        if (ch >= 0 && ch < 4) {
-          cfg.set_led0(HIGH);
-          if ((msg_buffer[0] == 'T') || (msg_buffer[0] == 'R')) {
+      }
+    } else if (rlen == 2) { // ask sensor values
+      int8_t const ch = msg_buffer[1] - '0';
+      if (ch >= 0 && ch < 4) {
+        cfg.set_led0(HIGH);
+        if ((msg_buffer[0] == 'T') || (msg_buffer[0] == 'R')) {
+          if (!cfg.started) {   // while streaming, report the latest conversion
             one_shot_T(T_sensor[ch], probes_T);
-            respond_ask_T(msg_buffer[0] == 'T' ? RESP_TYPE_T : RESP_TYPE_TREF, ch);
-            update_T_display(ch);
-            display.show();
-          } else if ((msg_buffer[0] == 'P') || (msg_buffer[0] == 'A'))  {
-            one_shot_P(ch, P_sensor[ch]);
-            respond_ask_P(msg_buffer[0] == 'P' ? RESP_TYPE_P : RESP_TYPE_ADC, ch);
-            update_P_display(ch);
-            display.show();
           }
-          cfg.set_led0(LOW);      
-        }  
-      } else if (rlen == 1) {
-        if (msg_buffer[0] == 'B') {
-          if (cfg.board.debug_level == 0) {
-            auto const len = packet.write_resp_id(cfg.board.id);
-            Serial.write(packet.buffer(),len);
-          } else {
-            Serial.print("Board ID 0x");
-            Serial.println(cfg.board.id, HEX);
-          }
-        }        
-      }
+          respond_ask_T(msg_buffer[0] == 'T' ? RESP_TYPE_T : RESP_TYPE_TREF, ch);
+          update_T_display(ch);
+          display.show();
+        } else if ((msg_buffer[0] == 'P') || (msg_buffer[0] == 'A'))  {
+          one_shot_P(ch, P_sensor[ch]);
+          respond_ask_P(msg_buffer[0] == 'P' ? RESP_TYPE_P : RESP_TYPE_ADC, ch);
+          update_P_display(ch);
+          display.show();
+        }
+        cfg.set_led0(LOW);      
+      }  
+    } else if (rlen == 1) {
+      if (msg_buffer[0] == 'B') {
+        if (cfg.board.debug_level == 0) {
+          auto const len = packet.write_resp_id(cfg.board.id);
+          Serial.write(packet.buffer(),len);
+        } else {
+          Serial.print("Board ID 0x");
+          Serial.println(cfg.board.id, HEX);
+        }
+      }        
     }
-  } // not started
+  }
 }
 
 